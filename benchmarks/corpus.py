@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+import random
+
+# Generator of synthetic editions for the benchmarks: a text file with page
+# breaks, folio breaks and paragraphs or stanzas, and the variants, rejected
+# readings and notes files that go with it, in the formats of Txt_models.
+
+WORDS = (
+    "Deu nun num Jesu maisun meisun estages Reis celeste suveraine cels solier estelé "
+    "chambre clarté joie parmanable maiene siecle sale travail luite jur nuit enfer "
+    "gaiole chartre peines puurs oscurté feste fiz amis Sathanas feluns cheitifs "
+    "laborurs champiuns vespree vie recreant peine feu jurnee pruz enemi victorie "
+    "dulzur divine Glorie secle asai repos luur tenebrur purveance creance Moyses "
+    "Abraham Ysaac Jacob li la le les de des del e a en est ki ke ço sunt sur cume"
+).split()
+
+WITNESSES = ['A', 'B', 'C', 'D', 'P']
+
+# Function to give the files of a synthetic volume, as found by ed2tei batch
+def corpus_files(directory, name):
+    prefix = os.path.join(directory, name)
+    return {
+        'text': prefix + '_text.txt',
+        'variants': prefix + '_variants.txt',
+        'rejected': prefix + '_rejected.txt',
+        'notes': prefix + '_notes.txt',
+    }
+
+def _misspell(word, rng):
+    if len(word) < 3:
+        return word + word[-1]
+    i = rng.randrange(len(word) - 1)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+# Function to write a synthetic volume of the given number of lines. density is
+# the share of lines with variants; rejected readings and notes are a quarter and
+# a tenth as frequent. Returns the paths of the files.
+def generate_corpus(directory, lines, name='synthetic', density=0.2, is_verse=False, lines_per_page=40, lines_per_folio=20, seed=0):
+    rng = random.Random(seed)
+    files = corpus_files(directory, name)
+    os.makedirs(directory, exist_ok=True)
+
+    with open(files['text'], 'w', encoding='utf-8') as text_file, \
+         open(files['variants'], 'w', encoding='utf-8') as variants_file, \
+         open(files['rejected'], 'w', encoding='utf-8') as rejected_file, \
+         open(files['notes'], 'w', encoding='utf-8') as notes_file:
+
+        block_left = 0
+        folio = 0
+        for line_number in range(1, lines + 1):
+            if (line_number - 1) % lines_per_page == 0:
+                text_file.write(f"<p {line_number // lines_per_page + 1}>\n")
+
+            # Paragraphs are long, stanzas short
+            if block_left == 0:
+                if line_number > 1:
+                    text_file.write("\n")
+                block_left = rng.randint(4, 8) if is_verse else rng.randint(10, 30)
+            block_left -= 1
+
+            words = [rng.choice(WORDS) for _ in range(rng.randint(6, 9) if is_verse else rng.randint(12, 18))]
+            if line_number % lines_per_folio == 1:
+                folio += 1
+                # Two sides per folio: 1r, 1v, 2r...
+                words.insert(rng.randrange(len(words)), f"[f.{(folio + 1) // 2}{'vr'[folio % 2]}]")
+            text_file.write(' '.join(words) + "\n")
+
+            plain_words = [word for word in words if not word.startswith('[')]
+            if rng.random() < density:
+                entries = []
+                for lemma in rng.sample(plain_words, min(len(plain_words), rng.randint(1, 3))):
+                    witnesses = ','.join(sorted(rng.sample(WITNESSES, rng.randint(1, 2))))
+                    entries.append(f"({lemma}) {_misspell(lemma, rng)} [{witnesses}]")
+                variants_file.write(f"{line_number} {' '.join(entries)}\n")
+            if rng.random() < density / 4:
+                corr = rng.choice(plain_words)
+                rejected_file.write(f"{line_number} ({corr}) {_misspell(corr, rng)}\n")
+            if rng.random() < density / 10:
+                notes_file.write(f"{line_number} ({rng.choice(plain_words)}) Note on line {line_number}.\n")
+
+    return files
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic edition for the benchmarks.")
+    parser.add_argument("--output_dir", required=True, help="Directory for the generated files.")
+    parser.add_argument("--lines", type=int, default=10000, help="Number of lines of the text (default: 10000).")
+    parser.add_argument("--name", default="synthetic", help="Name of the volume (default: synthetic).")
+    parser.add_argument("--density", type=float, default=0.2, help="Share of the lines with variants (default: 0.2).")
+    parser.add_argument("--is_verse", action="store_true", help="Generate verse (short lines and stanzas) instead of prose.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator (default: 0).")
+
+    args = parser.parse_args()
+
+    files = generate_corpus(args.output_dir, args.lines, args.name, args.density, args.is_verse, seed=args.seed)
+    print(f"Generated {args.lines} lines: {files['text']}")
+
+
+if __name__ == "__main__":
+    main()
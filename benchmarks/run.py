@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import contextlib
+import datetime
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+from Ed2TEI.xml_backend import BACKENDS, XML_BACKEND_ENV, set_backend
+
+from .corpus import generate_corpus
+
+# Benchmarks of the conversion: every stage runs in a fresh process, so that its
+# peak memory is its own, on synthetic editions of increasing size. The results
+# are written to a JSON file, and can be compared with those of an earlier run.
+
+STAGES = ['create_tei', 'add_variants', 'add_rejected', 'add_notes', 'build', 'build_stream']
+
+TEI_OPTIONS = {'number_stanzas_paragraphs': True}
+
+def _peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+# Function run in the worker process: times one stage with the given XML backend,
+# returns (seconds, base RSS, peak RSS, metrics report of the stage)
+def run_stage(stage, files, tei_file, output_file, is_verse, backend='auto'):
+    from Ed2TEI import add_notes, add_rejected, add_variants, create_tei
+    from Ed2TEI.add_notes import read_notes_from_file
+    from Ed2TEI.add_rejected import read_rejected_from_file
+    from Ed2TEI.add_variants import read_variants_from_file
+    from Ed2TEI.pipeline import build_edition
+    from Ed2TEI.instrumentation import reset_metrics
+    from Ed2TEI.xml_backend import set_backend
+
+    set_backend(backend)
+    base_rss = _peak_rss_kb()
+    options = dict(TEI_OPTIONS, is_verse=is_verse)
+    metrics = reset_metrics(quiet=True, detailed=True)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        if stage == 'create_tei':
+            create_tei(files['text'], output_file, **options)
+        elif stage == 'add_variants':
+            add_variants(tei_file, read_variants_from_file(files['variants']), output_file)
+        elif stage == 'add_rejected':
+            add_rejected(tei_file, read_rejected_from_file(files['rejected']), output_file)
+        elif stage == 'add_notes':
+            add_notes(tei_file, read_notes_from_file(files['notes']), output_file)
+        elif stage in ('build', 'build_stream'):
+            build_edition(
+                files['text'], output_file,
+                variants_file=files['variants'], rejected_file=files['rejected'], notes_file=files['notes'],
+                stream=stage == 'build_stream', **options
+            )
+        else:
+            raise ValueError(f"Unknown stage: {stage}")
+        seconds = time.perf_counter() - start
+
+    return seconds, base_rss, _peak_rss_kb(), metrics.report()
+
+def _in_fresh_process(*args):
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(run_stage, *args).result()
+
+# Function to benchmark every stage on a synthetic edition of the given size, with
+# each of the XML backends given; each stage keeps the fastest of repeat runs
+def benchmark_size(lines, work_dir, stages=STAGES, density=0.2, is_verse=False, repeat=1, backends=('auto',)):
+    files = generate_corpus(work_dir, lines, density=density, is_verse=is_verse)
+    tei_file = os.path.join(work_dir, 'synthetic.xml')
+    _in_fresh_process('create_tei', files, None, tei_file, is_verse)
+
+    results = []
+    for backend, stage in itertools.product(backends, stages):
+        output_file = os.path.join(work_dir, f'{stage}.xml')
+        runs = [_in_fresh_process(stage, files, tei_file, output_file, is_verse, backend) for _ in range(repeat)]
+        fastest = min(runs, key=lambda run: run[0])
+        seconds = fastest[0]
+        peaks = [run[2] for run in runs if run[2] is not None]
+        result = {
+            'stage': stage,
+            'lines': lines,
+            'density': density,
+            'is_verse': is_verse,
+            'xml_backend': backend,
+            'seconds': round(seconds, 6),
+            'lines_per_second': round(lines / seconds, 1) if seconds else None,
+            'base_rss_kb': runs[0][1],
+            'peak_rss_kb': max(peaks) if peaks else None,
+            'timers': fastest[3]['timers'],
+            'counters': fastest[3]['counters'],
+        }
+        print(f"{stage:>14} {backend:>5} {lines:>9} lines {seconds:9.3f} s {result['lines_per_second'] or 0:>12,.0f} lines/s"
+              + (f" {result['peak_rss_kb'] / 1024:8.1f} MB" if result['peak_rss_kb'] else ""))
+        results.append(result)
+    return results
+
+# What identifies a run in the results files; the files written before the
+# backend of each run was recorded give it for all their runs
+def _run_key(run, results):
+    return run['stage'], run['lines'], run['density'], run['is_verse'], run.get('xml_backend', results.get('xml_backend'))
+
+# Function to print the change of every stage against an earlier results file
+def compare_results(previous, current):
+    previous_runs = {_run_key(run, previous): run for run in previous['runs']}
+    for run in current['runs']:
+        old = previous_runs.get(_run_key(run, current))
+        if old is None or not old['seconds']:
+            continue
+        line = f"{run['stage']:>14} {run['xml_backend']:>5} {run['lines']:>9} lines: time x{run['seconds'] / old['seconds']:.2f}"
+        if old.get('peak_rss_kb') and run.get('peak_rss_kb'):
+            line += f", peak memory x{run['peak_rss_kb'] / old['peak_rss_kb']:.2f}"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the conversion stages on synthetic editions.")
+    parser.add_argument("--lines", type=int, nargs='+', default=[1000, 10000], help="Sizes of the editions, in lines (default: 1000 10000).")
+    parser.add_argument("--stages", nargs='+', choices=STAGES, default=STAGES, help="Stages to run (default: all).")
+    parser.add_argument("--density", type=float, default=0.2, help="Share of the lines with variants (default: 0.2).")
+    parser.add_argument("--is_verse", action="store_true", help="Benchmark verse instead of prose.")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs of each stage, the fastest is kept (default: 1).")
+    parser.add_argument("--output_file", default="benchmark_results.json", help="JSON results file (default: benchmark_results.json).")
+    parser.add_argument("--compare", help="Earlier results file to compare with.")
+    parser.add_argument("--xml_backend", nargs='+', choices=BACKENDS, help="XML backends of Ed2TEI to run every stage with (default: $ED2TEI_XML_BACKEND or auto).")
+    parser.add_argument("--work_dir", help="Directory for the generated files (default: a temporary directory).")
+
+    args = parser.parse_args()
+
+    results = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'runs': [],
+    }
+
+    # The backends are resolved here, so that auto is recorded as the backend it stands for
+    try:
+        backends = list(dict.fromkeys(set_backend(name) for name in args.xml_backend or [os.environ.get(XML_BACKEND_ENV) or 'auto']))
+    except ValueError as error:
+        parser.error(str(error))
+    results['xml_backends'] = backends
+
+    with contextlib.ExitStack() as stack:
+        work_dir = args.work_dir or stack.enter_context(tempfile.TemporaryDirectory(prefix='ed2tei-bench-'))
+        for lines in args.lines:
+            results['runs'].extend(benchmark_size(lines, work_dir, args.stages, args.density, args.is_verse, args.repeat, backends))
+
+    with open(args.output_file, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {args.output_file}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            compare_results(json.load(file), results)
+
+
+if __name__ == "__main__":
+    main()
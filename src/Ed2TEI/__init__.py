@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Sep 28 15:40:53 2024
+
+@author: DelphDem
+"""
+
+import importlib
+import sys
+import types
+
+# The functions of the package and their module. They are imported when first
+# used, so that the ed2tei subcommands and the scripts only load their own modules.
+_MODULES = {
+    'create_tei': 'process_text',
+    'add_variants': 'add_variants',
+    'add_rejected': 'add_rejected',
+    'add_notes': 'add_notes',
+}
+
+__all__ = list(_MODULES)
+
+def __getattr__(name):
+    if name not in _MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    function = getattr(importlib.import_module(f'.{_MODULES[name]}', __name__), name)
+    globals()[name] = function
+    return function
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+# The modules add_variants, add_rejected and add_notes are named like their
+# function: once imported, they are not bound over it in the package
+class _Package(types.ModuleType):
+    def __setattr__(self, name, value):
+        if name in _MODULES and isinstance(value, types.ModuleType):
+            return
+        super().__setattr__(name, value)
+
+sys.modules[__name__].__class__ = _Package
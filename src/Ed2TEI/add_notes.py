@@ -5,110 +5,169 @@ Created on Sat Sep 28 15:55:47 2024
 @author: DelphDem
 """
 import xml.etree.ElementTree as ET
-import re
 import argparse
 
+from .apparatus_tokenizer import group_records, iter_records, split_bracketed_text
+from .instrumentation import add_metrics_options, finish_run, get_metrics, start_run
+from .lemma_locator import locate_lemmas
+from .shards import apply_layers_to_shards, is_sharded
+from .standoff import StandoffLine
+from .streaming import stream_layers
+from .tei_document import ApparatusLayer, apply_layers, load_tree, tei_tag, write_tree
+from .xml_backend import add_backend_option, select_backend
+
 # Register the XML namespace
 ET.register_namespace('', "http://www.tei-c.org/ns/1.0")
 ET.register_namespace('xml', "http://www.w3.org/XML/1998/namespace")
 
+# Function to parse the note text into (location_text, note_content), (None, None) when malformed
+def parse_note_entry(note_text):
+    # The bracketed location text and the note content
+    return split_bracketed_text(note_text) or (None, None)
+
 # Function to parse the note text
 def parse_note_text(note_text):
-    # This regex captures the bracketed location text and the note content
-    match = re.match(r'\(([^)]+)\)\s*(.+)', note_text)
-    if match:
-        location_text, note_content = match.groups()
-        location_text = location_text.strip()
-        note_content = note_content.strip()
-        return location_text, note_content
+    location_text, note_content = parse_note_entry(note_text)
+    if location_text is None:
+        get_metrics().warn(f"Note format error: '{note_text}'", 'malformed_entries')
+    return location_text, note_content
+
+# Function to get the parsed note of a line, (location_text, note_content), which
+# is given either as its text or as already compiled by compile_notes
+def note_entries(note_entry):
+    if isinstance(note_entry, str):
+        return parse_note_text(note_entry)
+    return note_entry
+
+# Function to compile the records of a notes file: {line_id: (location_text, note_content)}
+def compile_notes(records):
+    return {
+        line_id: (line_records[-1].lemma, line_records[-1].readings[0])
+        for line_id, line_records in group_records(records).items()
+    }
+
+# Function to add a <note> to the standoff model of its line, returns whether it was added
+def annotate_note(line, tei_line_id, note_entry, note_counter):
+    metrics = get_metrics()
+
+    # Parse the note text to get the location and content
+    location_text, note_content = note_entries(note_entry)
+
+    if location_text and note_content:
+        # Find the position of the location text in the line text
+        _, location_pos, location_end = locate_lemmas(line.text, [location_text])[0]
+
+        if location_pos is not None:
+            # Create the <note> element, placed right after the location text
+            note_element = line.element.makeelement(tei_tag('note'), {'resp': '#EDT', 'n': str(note_counter)})
+            note_element.text = note_content
+            line.add(location_end, location_end, note_element)
+
+            metrics.count('notes_added')
+            return True
+        else:
+            metrics.warn(f"Location text '{location_text}' not found in line {tei_line_id}.", 'lemmas_not_found')
     else:
-        print(f"Note format error: '{note_text}'")
-        return None, None
+        metrics.warn(f"Skipping malformed note in line {tei_line_id}.", 'skipped_notes')
+    return False
+
+# Function to insert a <note> into its <l> element, returns whether it was added
+def insert_note(l_element, tei_line_id, note_entry, note_counter):
+    line = StandoffLine(l_element)
+    added = annotate_note(line, tei_line_id, note_entry, note_counter)
+    line.render()
+    return added
+
+# Function to number the notes before any of them is placed, so that the lines can
+# be annotated in any order: {tei_line_id: number}. As when they are added one
+# after the other, the notes are numbered in the order of the notes file and only
+# the notes that can be placed get a number. line_text(tei_line_id) gives the base
+# text of a line, None when the line is not in the document.
+def number_notes(notes_info, line_text):
+    note_numbers = {}
+    for line_id, note_entry in notes_info.items():
+        location_text, note_content = note_entries(note_entry)
+        if not (location_text and note_content):
+            continue
+        text = line_text(f"L{line_id}")
+        if text is not None and locate_lemmas(text, [location_text])[0][1] is not None:
+            note_numbers[f"L{line_id}"] = len(note_numbers) + 1
+    return note_numbers
+
+# Function to get the notes as an apparatus layer. Applied in the order of the notes
+# file, the notes are numbered as they are placed; once the layer is prepared, they
+# are numbered in advance by number_notes.
+def notes_layer(notes_info):
+    notes_info = {line_id: note_entries(note_entry) for line_id, note_entry in notes_info.items()}
+    note_numbers = {}
+    placed = 0
+
+    def prepare(line_text):
+        note_numbers.update(number_notes(notes_info, line_text))
+
+    def annotate(line, tei_line_id, note_text):
+        nonlocal placed
+        note_counter = note_numbers.get(tei_line_id, 0) if layer.prepared else placed + 1
+        if annotate_note(line, tei_line_id, note_text, note_counter):
+            placed += 1
+
+    layer = ApparatusLayer(notes_info, annotate, "Line ID {} not found in the TEI file. Skipping note entry...", prepare)
+    return layer
 
 # Function to insert notes into the TEI file
-def add_notes(tei_file, notes_info, output_file):
-    parser = ET.XMLParser(encoding="utf-8")
-    tree = ET.parse(tei_file, parser=parser)
-    root = tree.getroot()
-    ns = {'tei': "http://www.tei-c.org/ns/1.0", 'xml': "http://www.w3.org/XML/1998/namespace"}
-
-    # Initialize note counter
-    note_counter = 1
-
-    for line_id, note_text in notes_info.items():
-        tei_line_id = f"L{line_id}"
-        l_element = root.find(f'.//tei:l[@xml:id="{tei_line_id}"]', ns)
-
-        if l_element is not None:
-            # Prepare the original text of the line
-            line_text = ''.join(l_element.itertext())
-
-            # Parse the note text to get the location and content
-            location_text, note_content = parse_note_text(note_text)
-
-            if location_text and note_content:
-                # Find the position of the location text in the line text
-                location_pos = line_text.find(location_text)
-
-                if location_pos != -1:
-                    # Create the <note> element
-                    note_element = ET.Element('note', {'resp': '#EDT', 'n': str(note_counter)})
-                    note_element.text = note_content
-
-                    # Increment the note counter
-                    note_counter += 1
-
-                    # Insert the note at the correct position in the line
-                    before_location = line_text[:location_pos + len(location_text)]
-                    after_location = line_text[location_pos + len(location_text):]
-
-                    # Clear the original <l> element and reconstruct it
-                    l_element.clear()
-                    l_element.set('{http://www.w3.org/XML/1998/namespace}id', tei_line_id)
-
-                    l_element.text = before_location
-                    l_element.append(note_element)
-                    note_element.tail = after_location
-
-                    print(f"Added <note> to line ID {tei_line_id}")
-                else:
-                    print(f"Location text '{location_text}' not found in line {tei_line_id}.")
-            else:
-                print(f"Skipping malformed note in line {line_id}: '{note_text}'")
-        else:
-            print(f"Line ID {tei_line_id} not found in the TEI file. Skipping note entry...")
+def add_notes(tei_file, notes_info, output_file=None, stream=False):
+    layers = [notes_layer(notes_info)]
+
+    # A sharded edition only gets the shards holding the lines rewritten
+    if isinstance(tei_file, str) and is_sharded(tei_file):
+        apply_layers_to_shards(tei_file, layers, output_file)
+        return None
+
+    # In streaming mode the lines are read, updated and written one at a time
+    if stream:
+        stream_layers(tei_file, output_file, layers)
+        return None
+
+    tree = load_tree(tei_file)
+    apply_layers(tree, layers)
 
     # Save the updated TEI file
-    tree.write(output_file, encoding='utf-8', xml_declaration=True)
+    write_tree(tree, output_file)
+    return tree
 
 # Function to read the notes from the file
 def read_notes_from_file(file_path):
-    notes = {}
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            for line in file:
-                match = re.match(r'^(\d+)\s+(.*)$', line.strip())
-                if match:
-                    line_id, text = match.groups()
-                    notes[line_id] = text
+        return compile_notes(iter_records(file_path, 'notes'))
     except FileNotFoundError:
-        print(f"Notes file not found: {file_path}")
-    return notes
+        get_metrics().warn(f"Notes file not found: {file_path}", 'missing_files')
+        return {}
 
-def main():
-    """Main function to handle CLI arguments and execute the add_notes function."""
-    parser = argparse.ArgumentParser(description="Add notes to a TEI file.")
+def add_arguments(parser):
     parser.add_argument("--tei_file", required=True, help="The path to the TEI XML file to modify.")
     parser.add_argument("--notes_file", required=True, help="The path to the text file containing notes.")
     parser.add_argument("--output_file", required=True, help="The path to save the modified TEI file.")
+    parser.add_argument("--stream", action="store_true", help="Process the TEI file line by line instead of loading it whole.")
+    add_metrics_options(parser)
+    add_backend_option(parser)
 
-    args = parser.parse_args()
+def run(args):
+    metrics = start_run(args)
+    select_backend(args)
 
     # Read the notes from the provided text file
-    notes_info = read_notes_from_file(args.notes_file)
+    with metrics.timer('parse'):
+        notes_info = read_notes_from_file(args.notes_file)
 
     # Add notes to the TEI file
-    add_notes(args.tei_file, notes_info, args.output_file)
+    add_notes(args.tei_file, notes_info, args.output_file, stream=args.stream)
+    finish_run(args)
+
+def main():
+    """Main function to handle CLI arguments and execute the add_notes function."""
+    parser = argparse.ArgumentParser(description="Add notes to a TEI file.")
+    add_arguments(parser)
+    run(parser.parse_args())
 
 
 if __name__ == "__main__":
@@ -6,130 +6,151 @@ Created on Sat Sep 28 15:55:36 2024
 """
 
 import xml.etree.ElementTree as ET
-import re
 import argparse
 
+from .apparatus_tokenizer import group_records, iter_records, split_bracketed_text
+from .instrumentation import add_metrics_options, finish_run, get_metrics, start_run
+from .lemma_locator import lemma_text, locate_lemmas
+from .shards import apply_layers_to_shards, is_sharded
+from .standoff import StandoffLine
+from .streaming import stream_layers
+from .tei_document import ApparatusLayer, apply_layers, load_tree, tei_tag, write_tree
+from .xml_backend import add_backend_option, select_backend
+
 # Register the XML namespace
 ET.register_namespace('', "http://www.tei-c.org/ns/1.0")
 ET.register_namespace('xml', "http://www.w3.org/XML/1998/namespace")
 
+# Function to parse one rejected reading into (corr_text, sic_text), None when malformed
+def parse_rejected_entry(rejected_text):
+    # The corrected form (lemma) in brackets and the rejected reading
+    return split_bracketed_text(rejected_text)
+
+def build_choice_element(corr_text, sic_text, makeelement=ET.Element):
+    # Create the <choice> element
+    choice_element = makeelement(tei_tag('choice'), {})
+    sic_element = makeelement(tei_tag('sic'), {})
+    sic_element.text = sic_text
+    corr_element = makeelement(tei_tag('corr'), {'resp': '#EDT'})
+    corr_element.text = lemma_text(corr_text)
+    choice_element.extend([sic_element, corr_element])
+    return choice_element
+
 # Function to parse the rejected readings and return <choice> element
 def parse_rejected_text(rejected_text):
-    # This regex captures the corrected form (lemma) and the rejected reading
-    match = re.match(r'\(([^)]+)\)\s*(.+)', rejected_text)
-    if match:
-        corr_text, sic_text = match.groups()
-        corr_text = corr_text.strip()
-        sic_text = sic_text.strip()
-
-        # Create the <choice> element
-        choice_element = ET.Element('choice')
-        sic_element = ET.SubElement(choice_element, 'sic')
-        sic_element.text = sic_text
-        corr_element = ET.SubElement(choice_element, 'corr', {'resp': '#EDT'})
-        corr_element.text = corr_text
-
-        return choice_element, corr_text
+    entry = parse_rejected_entry(rejected_text)
+    if entry:
+        corr_text, sic_text = entry
+        return build_choice_element(corr_text, sic_text), corr_text
     else:
-        print(f"Rejected reading format error: '{rejected_text}'")
+        get_metrics().warn(f"Rejected reading format error: '{rejected_text}'", 'malformed_entries')
         return None, None
 
-# Function to insert rejected readings into the TEI file
-def add_rejected(tei_file, rejected_info, output_file):
-    parser = ET.XMLParser(encoding="utf-8")
-    tree = ET.parse(tei_file, parser=parser)
-    root = tree.getroot()
-    ns = {'tei': "http://www.tei-c.org/ns/1.0", 'xml': "http://www.w3.org/XML/1998/namespace"}
-
-    for line_id, rejected_text in rejected_info.items():
-        tei_line_id = f"L{line_id}"
-        l_element = root.find(f'.//tei:l[@xml:id="{tei_line_id}"]', ns)
-
-        if l_element is not None:
-            # Prepare the original text of the line
-            line_text = ''.join(l_element.itertext())
-
-            # Split multiple rejected readings by semicolon and process each
-            rejected_parts = [part.strip() for part in rejected_text.split(';') if part.strip()]
-            new_content = []
-            last_pos = 0
-
-            for rejected_part in rejected_parts:
-                choice_element, corr_text = parse_rejected_text(rejected_part)
-
-                if choice_element is not None:
-                    # Find the position of the corrected text (lemma) in the line text
-                    lemma_pos = line_text.find(corr_text, last_pos)
-
-                    if lemma_pos != -1:
-                        # Append the text before the lemma and the <choice> element
-                        before_lemma = line_text[last_pos:lemma_pos]
-                        new_content.append(before_lemma)
-                        new_content.append(choice_element)
-
-                        # Update the position after the lemma
-                        last_pos = lemma_pos + len(corr_text)
-                    else:
-                        print(f"Corrected text '{corr_text}' not found in line {tei_line_id}.")
-            
-            # Append the remaining text after the last lemma
-            remaining_text = line_text[last_pos:]
-            new_content.append(remaining_text)
-
-            # Clear the original <l> element and reconstruct it with new content
-            l_element.clear()
-            l_element.set('{http://www.w3.org/XML/1998/namespace}id', tei_line_id)
-
-            # Set the first text part if it exists
-            if isinstance(new_content[0], str):
-                l_element.text = new_content[0]
-                new_content = new_content[1:]
-
-            # Append the rest of the <choice> elements and text
-            for part in new_content:
-                if isinstance(part, str):
-                    if len(l_element) > 0:
-                        l_element[-1].tail = part
-                    else:
-                        l_element.text = part
-                else:
-                    l_element.append(part)
-
-            print(f"Added <choice> to line ID {tei_line_id}")
+# Function to get the parsed readings of a line, [(corr_text, sic_text), ...], which
+# is given either as its text or as already compiled by compile_rejected. Multiple
+# rejected readings are separated by semicolons; the malformed ones are skipped.
+def rejected_entries(rejected_entry):
+    if not isinstance(rejected_entry, str):
+        return rejected_entry
+    entries = []
+    for part in rejected_entry.split(';'):
+        if part.strip():
+            entry = parse_rejected_entry(part.strip())
+            if entry is None:
+                get_metrics().warn(f"Rejected reading format error: '{part.strip()}'", 'malformed_entries')
+            else:
+                entries.append(entry)
+    return entries
+
+# Function to compile the records of a rejected readings file: {line_id: readings}
+def compile_rejected(records):
+    return {
+        line_id: [(record.lemma, record.readings[0]) for record in line_records]
+        for line_id, line_records in group_records(records).items()
+    }
+
+# Function to add the <choice> elements of a line to its standoff model
+def annotate_rejected(line, tei_line_id, rejected_text):
+    # Locate all the corrected texts (lemmas) in one scan, each one after the previous
+    metrics = get_metrics()
+    rejected_parts = rejected_entries(rejected_text)
+    located = locate_lemmas(line.text, [corr_text for corr_text, _ in rejected_parts])
+
+    for (corr_text, sic_text), (_, lemma_pos, lemma_end) in zip(rejected_parts, located):
+        if lemma_pos is not None:
+            # The corrected text becomes the <corr> of the <choice> element
+            choice_element = build_choice_element(corr_text, sic_text, line.element.makeelement)
+            if line.add(lemma_pos, lemma_end, choice_element, choice_element.find(tei_tag('corr'))):
+                metrics.count('choices_added')
+            else:
+                metrics.warn(f"Corrected text '{corr_text}' overlaps other markup in line {tei_line_id}.", 'overlapping_lemmas')
         else:
-            print(f"Line ID {tei_line_id} not found in the TEI file. Skipping rejected entry...")
+            metrics.warn(f"Corrected text '{corr_text}' not found in line {tei_line_id}.", 'lemmas_not_found')
+
+# Function to insert the <choice> elements of a line into its <l> element
+def insert_rejected(l_element, tei_line_id, rejected_text):
+    line = StandoffLine(l_element)
+    annotate_rejected(line, tei_line_id, rejected_text)
+    line.render()
+
+# Function to get the rejected entries as an apparatus layer
+def rejected_layer(rejected_info):
+    return ApparatusLayer(rejected_info, annotate_rejected, "Line ID {} not found in the TEI file. Skipping rejected entry...")
+
+# Function to insert rejected readings into the TEI file
+def add_rejected(tei_file, rejected_info, output_file=None, stream=False):
+    layers = [rejected_layer(rejected_info)]
+
+    # A sharded edition only gets the shards holding the lines rewritten
+    if isinstance(tei_file, str) and is_sharded(tei_file):
+        apply_layers_to_shards(tei_file, layers, output_file)
+        return None
+
+    # In streaming mode the lines are read, updated and written one at a time
+    if stream:
+        stream_layers(tei_file, output_file, layers)
+        return None
+
+    tree = load_tree(tei_file)
+    apply_layers(tree, layers)
 
     # Save the updated TEI file
-    tree.write(output_file, encoding='utf-8', xml_declaration=True)
+    write_tree(tree, output_file)
+    return tree
 
 # Function to read the rejected readings from the file
 def read_rejected_from_file(file_path):
-    rejected_readings = {}
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            for line in file:
-                match = re.match(r'^(\d+)\s+(.*)$', line.strip())
-                if match:
-                    line_id, text = match.groups()
-                    rejected_readings[line_id] = text
+        return compile_rejected(iter_records(file_path, 'rejected'))
     except FileNotFoundError:
-        print(f"Rejected readings file not found: {file_path}")
-    return rejected_readings
+        get_metrics().warn(f"Rejected readings file not found: {file_path}", 'missing_files')
+        return {}
 
-def main():
-    """Main function to handle CLI arguments and execute the add_rejected function."""
-    parser = argparse.ArgumentParser(description="Add rejected readings to a TEI file.")
+def add_arguments(parser):
     parser.add_argument("--tei_file", required=True, help="The path to the TEI XML file to modify.")
     parser.add_argument("--rejected_file", required=True, help="The path to the text file containing rejected readings.")
     parser.add_argument("--output_file", required=True, help="The path to save the modified TEI file.")
-    
-    args = parser.parse_args()
+    parser.add_argument("--stream", action="store_true", help="Process the TEI file line by line instead of loading it whole.")
+    add_metrics_options(parser)
+    add_backend_option(parser)
+
+def run(args):
+    metrics = start_run(args)
+    select_backend(args)
 
     # Read the rejected readings from the provided text file
-    rejected_info = read_rejected_from_file(args.rejected_file)
+    with metrics.timer('parse'):
+        rejected_info = read_rejected_from_file(args.rejected_file)
 
     # Add rejected readings to the TEI file
-    add_rejected(args.tei_file, rejected_info, args.output_file)
+    add_rejected(args.tei_file, rejected_info, args.output_file, stream=args.stream)
+    finish_run(args)
+
+def main():
+    """Main function to handle CLI arguments and execute the add_rejected function."""
+    parser = argparse.ArgumentParser(description="Add rejected readings to a TEI file.")
+    add_arguments(parser)
+    run(parser.parse_args())
 
 
 if __name__ == "__main__":
@@ -6,136 +6,164 @@ Created on Sat Sep 28 15:55:25 2024
 """
 
 import xml.etree.ElementTree as ET
-import re
 import argparse
 
+from .apparatus_tokenizer import group_records, iter_records, split_variant_text
+from .instrumentation import add_metrics_options, finish_run, get_metrics, start_run
+from .lemma_locator import lemma_text, locate_lemmas
+from .shards import apply_layers_to_shards, is_sharded
+from .standoff import StandoffLine
+from .streaming import stream_layers
+from .tei_document import ApparatusLayer, apply_layers, load_tree, tei_tag, write_tree
+from .xml_backend import add_backend_option, select_backend
+
 # Register the XML namespace
 ET.register_namespace('', "http://www.tei-c.org/ns/1.0")
 ET.register_namespace('xml', "http://www.w3.org/XML/1998/namespace")
 
-def parse_variant_text(variant_text):
-    # This regex captures the lemma, multiple readings, and their respective witnesses
-    parts = re.findall(r'\(([^)]+)\)\s*([^\[\(\]]+)(?:\s*\[(.*?)\])?', variant_text)
-    app_elements = {}
+# Function to group the (lemma, readings, witnesses) parts of a line into
+# (lemma, [(reading, wit), ...]) entries, one per lemma in order of first
+# appearance; plain data, so it can be cached
+def group_variant_parts(parts):
+    entries = {}
+
+    for lemma, readings, witnesses_list in parts:
+        lemma_readings = entries.setdefault(lemma, [])
+
+        # Format multiple witnesses as a space-separated list
+        wit = " ".join(f"#{w}" for w in witnesses_list) if witnesses_list else "#unknown"
+
+        # Handle multiple readings and their witnesses
+        for reading in readings:
+            lemma_readings.append((reading, wit))
+
+    return list(entries.items())
 
-    for lemma, readings, witnesses in parts:
-        lemma = lemma.strip()
-        readings = [r.strip() for r in re.split(r'\s(?=\[|$)', readings) if r.strip()]
+# Function to parse the variant text into its entries, see group_variant_parts
+def parse_variant_entries(variant_text):
+    # The lemmas, their readings and their respective witnesses, see apparatus_tokenizer
+    return group_variant_parts((lemma, readings, witnesses) for _, lemma, readings, witnesses in split_variant_text(variant_text))
 
-        # Split multiple witnesses separated by commas (e.g., [C,P]) into individual witness IDs
-        witnesses_list = witnesses.split(',') if witnesses else []
+# Function to create the <app> element of each lemma from the parsed entries;
+# makeelement creates the elements, for the XML backend of the document
+def build_app_elements(entries, makeelement=ET.Element):
+    app_elements = {}
 
+    for lemma, readings in entries:
         # Create the <app> element and lemma element
-        if lemma not in app_elements:
-            app_element = ET.Element('app', {'type': 'variant'})
-            lem_element = ET.SubElement(app_element, 'lem')
-            lem_element.text = lemma
-            app_elements[lemma] = app_element
+        app_element = makeelement(tei_tag('app'), {'type': 'variant'})
+        lem_element = makeelement(tei_tag('lem'), {})
+        lem_element.text = lemma_text(lemma)
+        app_element.append(lem_element)
+        app_elements[lemma] = app_element
 
-        # Handle multiple readings and their witnesses
-        for i, reading in enumerate(readings):
-            if reading:  # Ignore empty readings
-                # Format multiple witnesses as a space-separated list
-                wit = " ".join(f"#{w.strip()}" for w in witnesses_list) if witnesses_list else "#unknown"
-                rdg_element = ET.SubElement(app_elements[lemma], 'rdg', {'wit': wit})
-                rdg_element.text = reading.strip()  # Ensure there is no trailing space
+        for reading, wit in readings:
+            rdg_element = makeelement(tei_tag('rdg'), {'wit': wit})
+            rdg_element.text = reading
+            app_element.append(rdg_element)
 
     return app_elements
 
-def add_variants(tei_file, variants_info, output_file):
-    parser = ET.XMLParser(encoding="utf-8")
-    tree = ET.parse(tei_file, parser=parser)
-    root = tree.getroot()
-    ns = {'tei': "http://www.tei-c.org/ns/1.0", 'xml': "http://www.w3.org/XML/1998/namespace"}
-
-    for line_id, variant_text in variants_info.items():
-        tei_line_id = f"L{line_id}"
-        l_element = root.find(f'.//tei:l[@xml:id="{tei_line_id}"]', ns)
-        
-        if l_element is not None:
-            app_elements = parse_variant_text(variant_text)
-            
-            # Prepare the original text of the line
-            line_text = ''.join(l_element.itertext())
-            
-            # Sort lemmas by order of appearance in the line text
-            lemmas = sorted(app_elements.keys(), key=lambda x: line_text.find(x))
-            
-            # Reset the <l> element
-            l_element.clear()
-            l_element.set('{http://www.w3.org/XML/1998/namespace}id', tei_line_id)
-            
-            # Initialize position to track text
-            pos = 0
-
-            for lemma in lemmas:
-                # Find where the lemma is in the line text
-                lemma_pos = line_text.find(lemma, pos)
-                if lemma_pos == -1:
-                    print(f"Lemma '{lemma}' not found in line {tei_line_id}.")
-                    continue
-                
-                # Add the text before the lemma
-                before_lemma = line_text[pos:lemma_pos]
-                if before_lemma:
-                    if not l_element.text:
-                        l_element.text = before_lemma
-                    else:
-                        last_elem = l_element[-1] if len(l_element) > 0 else None
-                        if last_elem is not None:
-                            last_elem.tail = before_lemma
-                        else:
-                            l_element.text += before_lemma
-                
-                # Insert the <app> element for the lemma
-                l_element.append(app_elements[lemma])
-                
-                # Move the position past the current lemma
-                pos = lemma_pos + len(lemma)
-            
-            # Add the remaining text after the last lemma
-            if pos < len(line_text):
-                if len(l_element):
-                    l_element[-1].tail = line_text[pos:]
-                else:
-                    l_element.text = line_text[pos:]
-                    
-            print(f"Added variant <app> to line ID {tei_line_id}")
+def parse_variant_text(variant_text):
+    return build_app_elements(parse_variant_entries(variant_text))
+
+# Function to get the parsed entries of a line, which is given either as its text
+# or as already compiled by compile_variants
+def variant_entries(variant_entry):
+    if isinstance(variant_entry, str):
+        return parse_variant_entries(variant_entry)
+    return variant_entry
+
+# Function to compile the records of a variants file: {line_id: entries}; the
+# entries of a line given on several lines of the file are gathered
+def compile_variants(records):
+    return {
+        line_id: group_variant_parts((record.lemma, record.readings, record.witnesses) for record in line_records)
+        for line_id, line_records in group_records(records, join=True).items()
+    }
+
+# Function to add the <app> elements of a line to its standoff model
+def annotate_variants(line, tei_line_id, variant_text):
+    metrics = get_metrics()
+    app_elements = build_app_elements(variant_entries(variant_text), line.element.makeelement)
+
+    # Locate all the lemmas in one scan, in order of appearance in the line text
+    located = locate_lemmas(line.text, list(app_elements), in_text_order=True)
+
+    for lemma, lemma_pos, lemma_end in located:
+        if lemma_pos is None:
+            metrics.warn(f"Lemma '{lemma}' not found in line {tei_line_id}.", 'lemmas_not_found')
+            continue
+
+        # The lemma becomes the <lem> of its <app> element
+        app_element = app_elements[lemma]
+        if line.add(lemma_pos, lemma_end, app_element, app_element.find(tei_tag('lem'))):
+            metrics.count('apps_added')
         else:
-            print(f"Line ID {tei_line_id} not found in the TEI file. Skipping variant entry...")
+            metrics.warn(f"Lemma '{lemma}' overlaps other markup in line {tei_line_id}.", 'overlapping_lemmas')
+
+# Function to insert the <app> elements of a line into its <l> element
+def insert_variants(l_element, tei_line_id, variant_text):
+    line = StandoffLine(l_element)
+    annotate_variants(line, tei_line_id, variant_text)
+    line.render()
+
+# Function to get the variant entries as an apparatus layer
+def variants_layer(variants_info):
+    return ApparatusLayer(variants_info, annotate_variants, "Line ID {} not found in the TEI file. Skipping variant entry...")
+
+def add_variants(tei_file, variants_info, output_file=None, stream=False):
+    layers = [variants_layer(variants_info)]
+
+    # A sharded edition only gets the shards holding the lines rewritten
+    if isinstance(tei_file, str) and is_sharded(tei_file):
+        apply_layers_to_shards(tei_file, layers, output_file)
+        return None
+
+    # In streaming mode the lines are read, updated and written one at a time
+    if stream:
+        stream_layers(tei_file, output_file, layers)
+        return None
+
+    tree = load_tree(tei_file)
+    apply_layers(tree, layers)
 
     # Save the updated TEI file
-    tree.write(output_file, encoding='utf-8', xml_declaration=True)
+    write_tree(tree, output_file)
+    return tree
 
+# Function to read and compile the variants of the file
 def read_variants_from_file(file_path):
-    variants = {}
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            for line in file:
-                match = re.match(r'^(\d+)\s+(.*)$', line.strip())
-                if match:
-                    line_id, text = match.groups()
-                    if line_id not in variants:
-                        variants[line_id] = text
-                    else:
-                        variants[line_id] += f" {text}"
+        return compile_variants(iter_records(file_path, 'variants'))
     except FileNotFoundError:
-        print(f"Variants file not found: {file_path}")
-    return variants
+        get_metrics().warn(f"Variants file not found: {file_path}", 'missing_files')
+        return {}
 
-def main():
-    parser = argparse.ArgumentParser(description="Add variant readings to a TEI file.")
+def add_arguments(parser):
     parser.add_argument("--tei_file", required=True, help="The path to the TEI XML file to modify.")
     parser.add_argument("--variants_file", required=True, help="The path to the text file containing variant readings.")
     parser.add_argument("--output_file", required=True, help="The path to save the modified TEI file.")
-    
-    args = parser.parse_args()
+    parser.add_argument("--stream", action="store_true", help="Process the TEI file line by line instead of loading it whole.")
+    add_metrics_options(parser)
+    add_backend_option(parser)
+
+def run(args):
+    metrics = start_run(args)
+    select_backend(args)
 
     # Read the variants from the provided text file
-    variants_info = read_variants_from_file(args.variants_file)
+    with metrics.timer('parse'):
+        variants_info = read_variants_from_file(args.variants_file)
 
     # Add variants to the TEI file
-    add_variants(args.tei_file, variants_info, args.output_file)
+    add_variants(args.tei_file, variants_info, args.output_file, stream=args.stream)
+    finish_run(args)
+
+def main():
+    parser = argparse.ArgumentParser(description="Add variant readings to a TEI file.")
+    add_arguments(parser)
+    run(parser.parse_args())
 
 
 if __name__ == "__main__":
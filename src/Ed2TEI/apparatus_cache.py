@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import pickle
+
+from .apparatus_loader import parse_apparatus_file
+from .file_io import mapped_file
+from .instrumentation import get_metrics, recorded_warnings, replay_warnings
+
+# On-disk cache of the parsed apparatus files. An entry is keyed by the path and
+# the hash of the file content, the apparatus kind and the parser version, so an
+# unchanged file is never parsed twice. The warnings given while parsing the file
+# are kept with the entry and given again when it is read. The cache is bounded
+# in size: the least recently used entries are evicted first.
+
+# Bump when the parsing of the apparatus files changes, to invalidate the cache
+PARSER_VERSION = 3
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+CACHE_SUFFIX = '.pickle'
+
+def default_cache_dir():
+    return os.environ.get('ED2TEI_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'ed2tei')
+
+# The path is part of the key, as the warnings give the position in the file
+def cache_key(file_path, kind, data):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{os.path.abspath(file_path)}\0{kind}:{PARSER_VERSION}:{pickle.HIGHEST_PROTOCOL}\0".encode('utf-8'))
+    digest.update(data)
+    return digest.hexdigest()
+
+# Function to read and parse an apparatus file, from the cache when possible.
+# Returns {line_id: parsed entries} as the compile_* functions do. Large
+# files are parsed by up to workers processes, see apparatus_loader.
+def load_apparatus(file_path, kind, use_cache=False, cache_dir=None, max_size=DEFAULT_MAX_SIZE, workers=1):
+    if not use_cache:
+        return parse_apparatus_file(file_path, kind, workers)
+
+    # The file is hashed as it is on disk, compressed or not
+    try:
+        with mapped_file(file_path) as data:
+            key = cache_key(file_path, kind, data)
+    except FileNotFoundError:
+        # Let the reader report the missing file
+        return parse_apparatus_file(file_path, kind, workers)
+
+    cache_dir = cache_dir or default_cache_dir()
+    cache_file = os.path.join(cache_dir, key + CACHE_SUFFIX)
+    try:
+        with open(cache_file, 'rb') as file:
+            compiled, warnings = pickle.load(file)
+        # Mark the entry as recently used for the eviction
+        os.utime(cache_file)
+    except Exception:
+        # Missing or damaged entry: the file is parsed and the entry written again
+        pass
+    else:
+        replay_warnings(warnings)
+        return compiled
+
+    with recorded_warnings() as warnings:
+        compiled = parse_apparatus_file(file_path, kind, workers)
+    _store(cache_file, (compiled, warnings))
+    evict_cache(cache_dir, max_size)
+    return compiled
+
+def _store(cache_file, entry):
+    temp_file = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(temp_file, 'wb') as file:
+            pickle.dump(entry, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, cache_file)
+    except OSError as error:
+        get_metrics().warn(f"Could not write the apparatus cache: {error}", 'cache_errors')
+
+def _cache_entries(cache_dir):
+    entries = []
+    try:
+        names = os.listdir(cache_dir)
+    except FileNotFoundError:
+        return entries
+    for name in names:
+        if name.endswith(CACHE_SUFFIX):
+            path = os.path.join(cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+# Function to remove the least recently used entries until the cache fits in max_size bytes
+def evict_cache(cache_dir=None, max_size=DEFAULT_MAX_SIZE):
+    entries = sorted(_cache_entries(cache_dir or default_cache_dir()))
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+# Function to empty the cache, returns the number of entries removed
+def clear_cache(cache_dir=None):
+    entries = _cache_entries(cache_dir or default_cache_dir())
+    for _, _, path in entries:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return len(entries)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import gc
+import io
+import mmap
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from .add_variants import compile_variants, read_variants_from_file
+from .add_rejected import compile_rejected, read_rejected_from_file
+from .add_notes import compile_notes, read_notes_from_file
+from .apparatus_tokenizer import tokenize_entry_lines, tokenize_records
+from .file_io import is_compressed
+from .instrumentation import get_metrics, recorded_warnings, replay_warnings, reset_metrics
+
+# Parsing of the apparatus files. Below PARALLEL_THRESHOLD a file is read and
+# parsed in this process. Larger files are cut into chunks at line breaks, found
+# by scanning the mapped file; the chunks are tokenized in a process pool into
+# ApparatusRecord, which are compiled in the order of the file, so the result is
+# the same as reading the file at once.
+
+PARALLEL_THRESHOLD = 2 * 1024 * 1024
+MIN_CHUNK_SIZE = 512 * 1024
+CHUNKS_PER_WORKER = 2
+
+# Reader and compiler of each kind of apparatus file
+APPARATUS_READERS = {
+    'variants': (read_variants_from_file, compile_variants),
+    'rejected': (read_rejected_from_file, compile_rejected),
+    'notes': (read_notes_from_file, compile_notes),
+}
+
+# Line breaks as read in text mode: \n, \r\n or a lone \r
+LINE_BREAK = re.compile(rb'\r\n?|\n')
+
+# The records and parsed entries are many small objects in no reference cycle: the cyclic
+# garbage collector is paused while they are built, pickled and unpickled, as it
+# would otherwise scan them again and again
+@contextlib.contextmanager
+def gc_paused():
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+# Function to cut the file content into about chunks parts ending at line breaks;
+# returns (start, end, number of the first line) for each part
+def chunk_boundaries(data, chunks):
+    size = len(data)
+    boundaries = []
+    start = 0
+    first_line = 1
+    for number in range(1, chunks + 1):
+        if start >= size:
+            break
+        end = size
+        if number < chunks:
+            line_break = LINE_BREAK.search(data, max(start, size * number // chunks))
+            if line_break is not None:
+                end = line_break.end()
+        boundaries.append((start, end, first_line))
+        part = data[start:end]
+        first_line += part.count(b'\n') + part.count(b'\r') - part.count(b'\r\n')
+        start = end
+    return boundaries
+
+# Function run in the worker processes: tokenizes the bytes start:end of an
+# apparatus file and returns (records, warnings), the warnings being given again
+# by the main process
+def parse_chunk(file_path, kind, start, end, first_line):
+    reset_metrics(quiet=True)
+    with open(file_path, 'rb') as file:
+        file.seek(start)
+        data = file.read(end - start)
+    with recorded_warnings() as warnings, gc_paused():
+        lines = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8')
+        records = list(tokenize_records(tokenize_entry_lines(lines, file_path, first_line), file_path, kind))
+    return records, warnings
+
+# Function to read and parse an apparatus file: {line_id: parsed entries}, as the
+# compile_* functions give them. workers is the number of processes for the files
+# above threshold bytes, the number of CPUs when 0; with 1, the default, the file
+# is always parsed here, as are the compressed files, which cannot be read from
+# the middle.
+def parse_apparatus_file(file_path, kind, workers=1, threshold=PARALLEL_THRESHOLD):
+    read_file, compile_entries = APPARATUS_READERS[kind]
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    try:
+        size = os.path.getsize(file_path)
+    except OSError:
+        size = 0
+    if workers < 2 or is_compressed(file_path) or size < max(threshold, 2 * MIN_CHUNK_SIZE):
+        with gc_paused():
+            return read_file(file_path)
+
+    metrics = get_metrics()
+    chunks = min(workers * CHUNKS_PER_WORKER, size // MIN_CHUNK_SIZE)
+    with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        boundaries = chunk_boundaries(data, chunks)
+    with gc_paused(), ProcessPoolExecutor(max_workers=min(workers, len(boundaries))) as executor:
+        futures = [
+            executor.submit(parse_chunk, file_path, kind, start, end, first_line)
+            for start, end, first_line in boundaries
+        ]
+
+        # The records are compiled in the order of the file
+        records = []
+        for future in futures:
+            chunk_records, warnings = future.result()
+            replay_warnings(warnings)
+            records.extend(chunk_records)
+        compiled = compile_entries(records)
+    metrics.count('parse_chunks', len(boundaries))
+    return compiled
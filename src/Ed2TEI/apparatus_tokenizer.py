@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+import re
+
+from .file_io import open_text
+from .instrumentation import get_metrics
+
+# Tokenizer shared by the variants, rejected readings and notes files. Every line
+# of an apparatus file is a line number followed by its entry; the file is read
+# one line at a time, so memory does not depend on its size. Problems are reported
+# with their position in the file, as file:line:column.
+
+# A line of an apparatus file, once stripped
+ENTRY_LINE = re.compile(r'(\d+)\s+(.*)')
+# A lemma of the variants file, its readings and their witnesses: (lemma) readings [C,P]
+VARIANT_PART = re.compile(r'\(([^)]+)\)\s*([^\[\(\]]+)(?:\s*\[(.*?)\])?')
+READING_SEPARATOR = re.compile(r'\s(?=\[|$)')
+# A rejected reading, (corrected text) rejected text, or a note, (location) note
+BRACKETED_ENTRY = re.compile(r'\(([^)]+)\)\s*(.+)')
+# The rejected readings of a line, separated by semicolons
+REJECTED_PART = re.compile(r'[^;]+')
+
+APPARATUS_KINDS = ('variants', 'rejected', 'notes')
+# The kinds whose entries for a line can be spread over several lines of the file
+JOINED_KINDS = ('variants',)
+
+# One parsed entry of an apparatus file. For variants, the lemma with its readings
+# and their witnesses; for rejected readings, the corrected text and the rejected
+# one; for notes, the location text and the note.
+class ApparatusRecord:
+    __slots__ = ('kind', 'line_id', 'lemma', 'readings', 'witnesses', 'position')
+
+    def __init__(self, kind, line_id, lemma, readings, witnesses, position):
+        self.kind = kind
+        self.line_id = line_id
+        self.lemma = lemma
+        self.readings = readings
+        self.witnesses = witnesses
+        # (file, line, column) of the entry
+        self.position = position
+
+    def location(self):
+        return format_position(*self.position)
+
+    def __repr__(self):
+        return f"ApparatusRecord({self.kind!r}, {self.line_id!r}, {self.lemma!r}, {self.readings!r}, {self.witnesses!r}, {self.location()!r})"
+
+def format_position(file_path, line_number, column):
+    return f"{file_path}:{line_number}:{column}"
+
+# Function to split the text of a variant entry into (column, lemma, readings,
+# witnesses), column being the offset of the lemma in the text
+def split_variant_text(variant_text):
+    for match in VARIANT_PART.finditer(variant_text):
+        lemma, readings, witnesses = match.groups()
+        readings = [reading.strip() for reading in READING_SEPARATOR.split(readings) if reading.strip()]
+        witnesses = [witness.strip() for witness in witnesses.split(',')] if witnesses else []
+        yield match.start(), lemma.strip(), readings, witnesses
+
+# Function to split a rejected reading or a note into (lemma, content), None when malformed
+def split_bracketed_text(text):
+    match = BRACKETED_ENTRY.match(text)
+    if match:
+        lemma, content = match.groups()
+        return lemma.strip(), content.strip()
+    return None
+
+# Function to report a problem of an apparatus file, at (file, line, column)
+def warn_malformed(position, message):
+    get_metrics().warn(f"{format_position(*position)}: {message}", 'malformed_entries')
+
+# Function to tokenize the lines of an apparatus file: yields (line_id, text, line
+# number, column of the text), and reports the lines that are not entries with
+# report(position, message). The lines can be a part of the file starting at its
+# line first_line.
+def tokenize_entry_lines(lines, file_path, first_line=1, report=warn_malformed):
+    for line_number, line in enumerate(lines, first_line):
+        stripped = line.strip()
+        if not stripped:
+            continue
+        indent = len(line) - len(line.lstrip())
+        match = ENTRY_LINE.fullmatch(stripped)
+        if match is None:
+            report((file_path, line_number, indent + 1), "expected a line number followed by an entry, skipping the line")
+            continue
+        yield match.group(1), match.group(2), line_number, indent + match.start(2) + 1
+
+def iter_entry_lines(file_path, report=warn_malformed):
+    with open_text(file_path) as file:
+        yield from tokenize_entry_lines(file, file_path, report=report)
+
+# Function to tokenize the entry lines of an apparatus file, as given by
+# tokenize_entry_lines, into ApparatusRecord, one entry at a time; the malformed
+# entries are reported with report(position, message) and skipped
+def tokenize_records(entry_lines, file_path, kind, report=warn_malformed):
+    if kind not in APPARATUS_KINDS:
+        raise ValueError(f"Unknown apparatus kind '{kind}', expected one of: {', '.join(APPARATUS_KINDS)}")
+    for line_id, text, line_number, column in entry_lines:
+        if kind == 'variants':
+            parts = list(split_variant_text(text))
+            if not parts:
+                report((file_path, line_number, column), f"no (lemma) reading [witnesses] in '{text}'")
+            for offset, lemma, readings, witnesses in parts:
+                yield ApparatusRecord(kind, line_id, lemma, tuple(readings), tuple(witnesses), (file_path, line_number, column + offset))
+            continue
+
+        # A line holds several rejected readings, but a single note
+        parts = [(part.start(), part.group(0)) for part in REJECTED_PART.finditer(text)] if kind == 'rejected' else [(0, text)]
+        for offset, part_text in parts:
+            if not part_text.strip():
+                continue
+            part_column = column + offset + len(part_text) - len(part_text.lstrip())
+            entry = split_bracketed_text(part_text.strip())
+            if entry is None:
+                report((file_path, line_number, part_column), f"expected (text) followed by the {'rejected reading' if kind == 'rejected' else 'note'}, got '{part_text.strip()}'")
+                continue
+            lemma, content = entry
+            yield ApparatusRecord(kind, line_id, lemma, (content,), (), (file_path, line_number, part_column))
+
+def iter_records(file_path, kind, report=warn_malformed):
+    yield from tokenize_records(iter_entry_lines(file_path, report), file_path, kind, report)
+
+# Function to gather the records as {line_id: [records]}, the line IDs in order of
+# first appearance. The records of a line given several times are all kept when
+# join is true, as for the variants; otherwise those of the last line of the file
+# replace the earlier ones.
+def group_records(records, join=False):
+    grouped = {}
+    for record in records:
+        line_records = grouped.get(record.line_id)
+        if line_records is None or (not join and line_records[-1].position[1] != record.position[1]):
+            grouped[record.line_id] = [record]
+        else:
+            line_records.append(record)
+    return grouped
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import io
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .file_io import COMPRESSIONS
+from .instrumentation import get_metrics, reset_metrics
+from .pipeline import build_edition
+
+# Suffixes of the files of a volume, e.g. Joshua_vol1_text.txt, Joshua_vol1_variants.txt...
+VOLUME_FILES = {
+    'text': '_text.txt',
+    'variants': '_variants.txt',
+    'rejected': '_rejected.txt',
+    'notes': '_notes.txt',
+}
+
+# Function to find the files of a volume from its prefix (e.g. Txt_models/Joshua_vol1);
+# the apparatus files that do not exist are left out. Each file can also be
+# compressed, e.g. Joshua_vol1_text.txt.gz, see file_io.
+def find_volume_files(volume):
+    files = {}
+    for kind, suffix in VOLUME_FILES.items():
+        for path in [volume + suffix] + [volume + suffix + extension for extension in COMPRESSIONS]:
+            if os.path.isfile(path):
+                files[kind] = path
+                break
+    return files
+
+# Function to list the volumes of a directory, i.e. the prefixes of its *_text.txt files
+def discover_volumes(directory):
+    suffixes = [VOLUME_FILES['text']] + [VOLUME_FILES['text'] + extension for extension in COMPRESSIONS]
+    volumes = []
+    for name in sorted(os.listdir(directory)):
+        for suffix in suffixes:
+            if name.endswith(suffix):
+                volume = os.path.join(directory, name[:-len(suffix)])
+                if volume not in volumes:
+                    volumes.append(volume)
+                break
+    return volumes
+
+# Function to read a manifest listing one volume prefix per line, relative to the
+# manifest's directory; blank lines and lines starting with # are ignored
+def read_manifest(manifest_file):
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+    volumes = []
+    with open(manifest_file, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                volumes.append(os.path.join(base_dir, line))
+    return volumes
+
+def volume_output_file(volume, output_dir=None):
+    if output_dir is None:
+        return volume + '.xml'
+    return os.path.join(output_dir, os.path.basename(volume) + '.xml')
+
+# Function run in the worker processes: builds one volume and returns
+# (volume, output file, error, log, metrics report), with error None on success
+def build_volume(volume, output_dir=None, stream=False, use_cache=False, cache_dir=None, tei_options=None, detailed=False):
+    output_file = volume_output_file(volume, output_dir)
+    log = io.StringIO()
+    metrics = reset_metrics(detailed=detailed)
+    try:
+        files = find_volume_files(volume)
+        if 'text' not in files:
+            raise FileNotFoundError(f"Text file not found: {volume + VOLUME_FILES['text']}")
+        with contextlib.redirect_stdout(log):
+            build_edition(
+                files['text'],
+                output_file,
+                variants_file=files.get('variants'),
+                rejected_file=files.get('rejected'),
+                notes_file=files.get('notes'),
+                stream=stream,
+                use_cache=use_cache,
+                cache_dir=cache_dir,
+                # The volumes are already built in parallel
+                parse_workers=1,
+                **(tei_options or {})
+            )
+    except Exception:
+        return volume, output_file, traceback.format_exc(), log.getvalue(), metrics.report()
+    return volume, output_file, None, log.getvalue(), metrics.report()
+
+# Function to build many volumes concurrently in a process pool. Every volume is
+# reported as it finishes; a failing volume does not stop the others. The metrics
+# of the volumes are added to the current metrics.
+def build_volumes(volumes, output_dir=None, workers=None, stream=False, use_cache=False, cache_dir=None, verbose=False, **tei_options):
+    metrics = get_metrics()
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(build_volume, volume, output_dir, stream, use_cache, cache_dir, tei_options, metrics.detailed)
+            for volume in volumes
+        ]
+        for future in as_completed(futures):
+            volume, output_file, error, log, report = future.result()
+            metrics.merge(report)
+            if verbose and log:
+                print(log, end='')
+            if error is None:
+                metrics.count('volumes_built')
+                metrics.info(f"Built volume {volume}: {output_file}")
+            else:
+                metrics.count('volumes_failed')
+                print(f"Failed volume {volume}:\n{error}")
+            results.append((volume, output_file, error))
+
+    failed = sum(1 for _, _, error in results if error is not None)
+    metrics.info(f"{len(results) - failed} volume(s) built, {failed} failed.")
+    return results
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import importlib
+import os
+import sys
+
+# Subcommands of ed2tei: name -> (help, module). The subcommands that replace the
+# create_tei, add_variants, add_rejected and add_notes scripts are defined in their
+# module, by add_arguments and run; the others below, by add_<name>_arguments and
+# run_<name>. Only the module of the subcommand that is run gets imported, so that
+# starting ed2tei stays fast.
+COMMANDS = {
+    'create_tei': ('Convert a txt file to a TEI file.', 'process_text'),
+    'add_variants': ('Add variant readings to a TEI file.', 'add_variants'),
+    'add_rejected': ('Add rejected readings to a TEI file.', 'add_rejected'),
+    'add_notes': ('Add notes to a TEI file.', 'add_notes'),
+    'build': ('Create the TEI file and add the whole apparatus in one pass.', None),
+    'batch': ('Build many volumes in parallel.', None),
+    'watch': ('Build an edition and rebuild it whenever its files are saved.', None),
+    'serve': ('Run a local HTTP service converting the editions it is sent.', None),
+    'run': ('Run the jobs of a TOML or JSON manifest one after the other.', None),
+    'validate': ('Check the apparatus files against the text without building the TEI.', None),
+    'index_witnesses': ('Index the variants of a TEI file by witness into a SQLite database.', None),
+    'query_witnesses': ('Query the witness index of an edition.', None),
+}
+
+# Function to get the functions defining the options of a subcommand and running it
+def load_command(name):
+    module_name = COMMANDS[name][1]
+    if module_name is None:
+        module = sys.modules[__name__]
+        return getattr(module, f'add_{name}_arguments'), getattr(module, f'run_{name}')
+    module = importlib.import_module(f'.{module_name}', __package__)
+    return module.add_arguments, module.run
+
+# Options of the apparatus cache
+def add_cache_options(parser):
+    parser.add_argument('--cache', action='store_true', help='Keep the parsed apparatus files in the apparatus cache, and read them from it.')
+    parser.add_argument('--clear_cache', action='store_true', help='Empty the apparatus cache before building.')
+    parser.add_argument('--cache_dir', help='Directory of the apparatus cache (default: $ED2TEI_CACHE_DIR or ~/.cache/ed2tei).')
+
+def add_parse_workers_option(parser):
+    parser.add_argument('--parse_workers', type=int, default=1, help='Processes parsing the large apparatus files (default: 1, 0 for the number of CPUs).')
+
+def cache_options(args):
+    from .instrumentation import get_metrics
+    if args.clear_cache:
+        from .apparatus_cache import clear_cache
+        removed = clear_cache(args.cache_dir)
+        get_metrics().info(f"Removed {removed} entries from the apparatus cache.")
+    return {'use_cache': args.cache, 'cache_dir': args.cache_dir}
+
+def add_build_arguments(parser):
+    from .instrumentation import add_metrics_options
+    from .process_text import add_tei_options
+    from .shards import add_shard_options
+    from .xml_backend import add_backend_option
+    parser.add_argument('--text', required=True, help='The path to the txt file containing the main text.')
+    parser.add_argument('--output', required=True, help='The path to save the TEI file.')
+    parser.add_argument('--variants', help='The path to the text file containing variant readings.')
+    parser.add_argument('--rejected', help='The path to the text file containing rejected readings.')
+    parser.add_argument('--notes', help='The path to the text file containing notes.')
+    mode_group = parser.add_mutually_exclusive_group()
+    mode_group.add_argument('--stream', action='store_true', help='Write the TEI line by line instead of building the whole tree in memory.')
+    mode_group.add_argument('--incremental', action='store_true', help='Only redo the lines whose text or apparatus changed since the last build.')
+    parser.add_argument('--witness_db', help='Also index the variants by witness into this SQLite database.')
+    add_cache_options(parser)
+    add_parse_workers_option(parser)
+    add_tei_options(parser)
+    add_shard_options(parser)
+    add_metrics_options(parser)
+    add_backend_option(parser)
+
+def run_build(args):
+    from .instrumentation import finish_run, start_run
+    from .pipeline import build_edition
+    from .process_text import tei_options
+    from .shards import shard_options
+    from .xml_backend import select_backend
+    start_run(args)
+    select_backend(args)
+    build_edition(
+        args.text,
+        args.output,
+        variants_file=args.variants,
+        rejected_file=args.rejected,
+        notes_file=args.notes,
+        stream=args.stream,
+        incremental=args.incremental,
+        parse_workers=args.parse_workers,
+        witness_db=args.witness_db,
+        **cache_options(args),
+        **shard_options(args),
+        **tei_options(args)
+    )
+    finish_run(args)
+
+def add_batch_arguments(parser):
+    from .instrumentation import add_metrics_options
+    from .process_text import add_tei_options
+    from .xml_backend import add_backend_option
+    volumes_group = parser.add_mutually_exclusive_group(required=True)
+    volumes_group.add_argument('--dir', help='Directory whose *_text.txt files are the volumes to build.')
+    volumes_group.add_argument('--manifest', help='File listing one volume prefix (e.g. Txt_models/Joshua_vol1) per line.')
+    parser.add_argument('--output_dir', help='Directory for the TEI files (default: next to each volume).')
+    parser.add_argument('--workers', type=int, help='Number of worker processes (default: number of CPUs).')
+    parser.add_argument('--stream', action='store_true', help='Build each volume in streaming mode.')
+    parser.add_argument('--verbose', action='store_true', help='Print the messages of every volume.')
+    add_cache_options(parser)
+    add_tei_options(parser)
+    add_metrics_options(parser)
+    add_backend_option(parser)
+
+def run_batch(args):
+    from .batch import build_volumes, discover_volumes, read_manifest
+    from .instrumentation import finish_run, start_run
+    from .process_text import tei_options
+    from .xml_backend import select_backend
+    start_run(args)
+    select_backend(args)
+    volumes = read_manifest(args.manifest) if args.manifest else discover_volumes(args.dir)
+    results = build_volumes(
+        volumes,
+        output_dir=args.output_dir,
+        workers=args.workers,
+        stream=args.stream,
+        verbose=args.verbose,
+        **cache_options(args),
+        **tei_options(args)
+    )
+    finish_run(args)
+    if any(error is not None for _, _, error in results):
+        sys.exit(1)
+
+def add_watch_arguments(parser):
+    from .instrumentation import add_metrics_options
+    from .process_text import add_tei_options
+    from .watch import DEFAULT_INTERVAL
+    from .xml_backend import add_backend_option
+    files_group = parser.add_mutually_exclusive_group(required=True)
+    files_group.add_argument('--volume', help='Prefix of the files of the volume (e.g. Txt_models/Joshua_vol1), as for batch.')
+    files_group.add_argument('--text', help='The path to the txt file containing the main text.')
+    parser.add_argument('--output', help='The path to save the TEI file (default: <volume>.xml).')
+    parser.add_argument('--variants', help='The path to the text file containing variant readings.')
+    parser.add_argument('--rejected', help='The path to the text file containing rejected readings.')
+    parser.add_argument('--notes', help='The path to the text file containing notes.')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, help=f'Seconds between two checks of the files (default: {DEFAULT_INTERVAL}).')
+    add_tei_options(parser)
+    add_metrics_options(parser)
+    add_backend_option(parser)
+
+def run_watch(args):
+    from .batch import VOLUME_FILES, find_volume_files, volume_output_file
+    from .instrumentation import finish_run, get_metrics, start_run
+    from .process_text import tei_options
+    from .watch import EditionWatcher
+    from .xml_backend import select_backend
+    start_run(args)
+    select_backend(args)
+    if args.volume:
+        # The files that do not exist yet are watched under their plain name
+        files = {kind: args.volume + suffix for kind, suffix in VOLUME_FILES.items()}
+        files.update(find_volume_files(args.volume))
+        output_file = args.output or volume_output_file(args.volume)
+    else:
+        files = {'text': args.text, 'variants': args.variants, 'rejected': args.rejected, 'notes': args.notes}
+        output_file = args.output
+    if output_file is None:
+        sys.exit("ed2tei watch: --output is required with --text")
+
+    watcher = EditionWatcher(files['text'], output_file, files['variants'], files['rejected'], files['notes'], **tei_options(args))
+    get_metrics().info("Watching for changes, press Ctrl+C to stop.")
+    try:
+        watcher.watch(interval=args.interval)
+    except KeyboardInterrupt:
+        pass
+    finish_run(args)
+
+def add_serve_arguments(parser):
+    from .instrumentation import add_metrics_options
+    from .server import DEFAULT_HOST, DEFAULT_MAX_BODY_SIZE, DEFAULT_MAX_QUEUE, DEFAULT_PORT, DEFAULT_TIMEOUT
+    from .xml_backend import add_backend_option
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f'Address to listen on (default: {DEFAULT_HOST}).')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'Port to listen on (default: {DEFAULT_PORT}).')
+    parser.add_argument('--workers', type=int, help='Number of worker processes (default: number of CPUs).')
+    parser.add_argument('--max_queue', type=int, default=DEFAULT_MAX_QUEUE, help=f'Conversions that can wait for a worker before new ones are refused (default: {DEFAULT_MAX_QUEUE}).')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help=f'Seconds after which a conversion is answered with a timeout (default: {DEFAULT_TIMEOUT:g}).')
+    parser.add_argument('--max_body_size', type=int, default=DEFAULT_MAX_BODY_SIZE, help='Largest request body accepted, in bytes (default: 64 MB).')
+    add_metrics_options(parser)
+    add_backend_option(parser)
+
+def run_serve(args):
+    from .instrumentation import finish_run, start_run
+    from .server import serve
+    from .xml_backend import select_backend
+    start_run(args)
+    select_backend(args)
+    serve(
+        args.host,
+        args.port,
+        workers=args.workers,
+        max_queue=args.max_queue,
+        timeout=args.timeout,
+        max_body_size=args.max_body_size
+    )
+    finish_run(args)
+
+def add_run_arguments(parser):
+    from .instrumentation import add_metrics_options
+    parser.add_argument('manifest', help='TOML or JSON file listing the jobs.')
+    parser.add_argument('--stop_on_error', action='store_true', help='Stop at the first job that fails.')
+    add_metrics_options(parser)
+
+# Function to run one job of a manifest, returns None or the error
+def run_job(job, defaults, quiet):
+    import traceback
+    from .jobs import job_arguments, job_command
+    command = job_command(job)
+    parser = argparse.ArgumentParser(prog=f'ed2tei {command}')
+    add_arguments, run = load_command(command)
+    add_arguments(parser)
+    try:
+        arguments = job_arguments(parser, job, defaults)
+        if quiet and 'quiet' not in job:
+            arguments.append('--quiet')
+        run(parser.parse_args(arguments))
+    except SystemExit as exit:
+        # Raised by argparse for invalid options, and by the commands that fail
+        return None if exit.code in (None, 0) else f"{command} exited with status {exit.code}"
+    except Exception:
+        return traceback.format_exc()
+    return None
+
+def run_run(args):
+    from .instrumentation import finish_run, get_metrics, reset_metrics, start_run, use_metrics
+    from .jobs import read_jobs
+    metrics = start_run(args)
+    try:
+        defaults, jobs = read_jobs(args.manifest)
+    except (OSError, ValueError) as error:
+        sys.exit(f"ed2tei run: {error}")
+
+    # The paths of the jobs are relative to the manifest
+    working_dir = os.getcwd()
+    os.chdir(os.path.dirname(os.path.abspath(args.manifest)))
+    done = failed = 0
+    try:
+        for number, job in enumerate(jobs, 1):
+            name = job.get('name', f"job {number}")
+            # Every job records its own metrics, added to those of the run
+            reset_metrics(quiet=args.quiet, detailed=metrics.detailed)
+            error = run_job(job, defaults, args.quiet)
+            metrics.merge(get_metrics().report())
+            if error is None:
+                done += 1
+                metrics.count('jobs_done')
+            else:
+                failed += 1
+                metrics.count('jobs_failed')
+                print(f"Failed {name}:\n{error}")
+                if args.stop_on_error:
+                    break
+    finally:
+        os.chdir(working_dir)
+        use_metrics(metrics)
+
+    metrics.info(f"{done} job(s) done, {failed} failed.")
+    finish_run(args)
+    if failed:
+        sys.exit(1)
+
+def add_validate_arguments(parser):
+    from .instrumentation import add_metrics_options
+    files_group = parser.add_mutually_exclusive_group(required=True)
+    files_group.add_argument('--volume', help='Prefix of the files of the volume (e.g. Txt_models/Joshua_vol1), as for batch.')
+    files_group.add_argument('--text', help='The path to the txt file containing the main text.')
+    parser.add_argument('--variants', help='The path to the text file containing variant readings.')
+    parser.add_argument('--rejected', help='The path to the text file containing rejected readings.')
+    parser.add_argument('--notes', help='The path to the text file containing notes.')
+    parser.add_argument('--report_file', help='Write the issues found to this JSON file.')
+    parser.add_argument('--strict', action='store_true', help='Exit with an error status on warnings too.')
+    add_metrics_options(parser)
+
+def run_validate(args):
+    from .batch import find_volume_files
+    from .instrumentation import finish_run, start_run
+    from .validate import validate_edition
+    metrics = start_run(args)
+    if args.volume:
+        files = find_volume_files(args.volume)
+        if 'text' not in files:
+            sys.exit(f"ed2tei validate: no text file for the volume {args.volume}")
+    else:
+        files = {'text': args.text, 'variants': args.variants, 'rejected': args.rejected, 'notes': args.notes}
+
+    report = validate_edition(files['text'], files)
+    if args.report_file:
+        report.write(args.report_file)
+    metrics.info(f"{report.errors} error(s), {report.warnings} warning(s) in {report.summary['lines']} lines of {files['text']}")
+    finish_run(args)
+    if report.errors or (args.strict and report.warnings):
+        sys.exit(1)
+
+def add_index_witnesses_arguments(parser):
+    from .instrumentation import add_metrics_options
+    parser.add_argument('tei_file', help='Path to the TEI file, or to the master file of a sharded edition.')
+    parser.add_argument('db_file', help='Path to the SQLite database to write.')
+    add_metrics_options(parser)
+
+def run_index_witnesses(args):
+    from .instrumentation import finish_run, start_run
+    from .witness_index import index_witnesses
+    start_run(args)
+    index_witnesses(args.tei_file, args.db_file)
+    finish_run(args)
+
+def add_query_witnesses_arguments(parser):
+    parser.add_argument('db_file', help='Path to the SQLite database written by index_witnesses or build --witness_db.')
+    query_group = parser.add_mutually_exclusive_group(required=True)
+    query_group.add_argument('--witness', help='List the readings of a witness.')
+    query_group.add_argument('--lemma', help='List the lines where a lemma has variants.')
+    query_group.add_argument('--line', help='Show the apparatus of a line (e.g. L6).')
+    query_group.add_argument('--agree', nargs='+', metavar='WITNESS', help='List the readings shared by all the witnesses given.')
+    query_group.add_argument('--list_witnesses', action='store_true', help='List the witnesses and their number of readings.')
+
+# Function to print the results of a query, one tab-separated row per line
+def run_query_witnesses(args):
+    from .witness_index import WitnessDatabase
+    try:
+        database = WitnessDatabase(args.db_file)
+    except (OSError, ValueError) as error:
+        sys.exit(f"ed2tei query_witnesses: {error}")
+    with database:
+        if args.witness:
+            rows = database.readings_of(args.witness)
+        elif args.lemma:
+            rows = [(line_id,) for line_id in database.lines_of(args.lemma)]
+        elif args.line:
+            rows = [
+                (lemma, reading, ' '.join(witnesses))
+                for lemma, readings in database.apps_of(args.line)
+                for reading, witnesses in readings
+            ]
+        elif args.agree:
+            rows = database.agreements(args.agree)
+        else:
+            rows = database.witnesses()
+    for row in rows:
+        print('\t'.join(str(value) for value in row))
+
+def make_parser(command=None):
+    parser = argparse.ArgumentParser(prog='ed2tei', description="Convert critical editions to TEI XML.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name, (help_text, _) in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=help_text, description=help_text)
+        # Only the subcommand that is run gets its options, and its module imported
+        if name == command:
+            add_arguments, run = load_command(name)
+            add_arguments(subparser)
+            subparser.set_defaults(func=run)
+    return parser
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv and argv[0] in COMMANDS else None
+    args = make_parser(command).parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
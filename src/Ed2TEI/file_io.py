@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import bz2
+import contextlib
+import gzip
+import io
+import lzma
+import mmap
+import os
+
+# Input and output of the files of an edition. The text, the apparatus files and
+# the TEI can be compressed: a file ending in .gz, .xz or .bz2 is decompressed
+# while it is read and compressed while it is written, one block at a time, so no
+# decompressed copy of it is ever written to disk. The temporary file of an output
+# (output + '.tmp') is compressed like the output itself.
+#
+# The files that are read as a whole, to hash them or to find elements in them,
+# are memory-mapped when they are large and not compressed, instead of being
+# copied into memory. The lines of the text and apparatus files are read through
+# the buffered text layer, which is faster than splitting mapped lines in Python.
+
+COMPRESSIONS = {'.gz': gzip, '.xz': lzma, '.bz2': bz2}
+TEMP_SUFFIX = '.tmp'
+# Level of gzip compression, as the gzip tool
+GZIP_LEVEL = 6
+MMAP_THRESHOLD = 1024 * 1024
+
+# Function to get the compression module of a file from its extension, None for
+# a file that is not compressed or an open stream
+def compression(file_path):
+    if not isinstance(file_path, (str, os.PathLike)):
+        return None
+    name = os.fspath(file_path)
+    if name.endswith(TEMP_SUFFIX):
+        name = name[:-len(TEMP_SUFFIX)]
+    return COMPRESSIONS.get(os.path.splitext(name)[1].lower())
+
+def is_compressed(file_path):
+    return compression(file_path) is not None
+
+# Function to open a file in binary mode, 'rb' or 'wb', through its compression
+def open_binary(file_path, mode='rb'):
+    module = compression(file_path)
+    if module is None:
+        return open(file_path, mode)
+    if module is gzip:
+        # No time stamp in the header, so that the same document gives the same file
+        return gzip.GzipFile(file_path, mode, compresslevel=GZIP_LEVEL, mtime=0)
+    return module.open(file_path, mode)
+
+# Function to open a file in text mode, 'r' or 'w', encoded in UTF-8
+def open_text(file_path, mode='r', newline=None, errors=None, buffering=-1):
+    if compression(file_path) is None:
+        return open(file_path, mode, encoding='utf-8', errors=errors, newline=newline, buffering=buffering)
+    return io.TextIOWrapper(open_binary(file_path, mode + 'b'), encoding='utf-8', errors=errors, newline=newline)
+
+# Function to compress the content of a file as its extension says
+def compress(content, file_path):
+    module = compression(file_path)
+    if module is None:
+        return content
+    if module is gzip:
+        # gzip.compress only takes mtime from Python 3.8 on
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=GZIP_LEVEL, mtime=0) as file:
+            file.write(content)
+        return buffer.getvalue()
+    return module.compress(content)
+
+def read_bytes(file_path):
+    with open_binary(file_path) as file:
+        return file.read()
+
+# Function to get the bytes of a file as they are on disk, memory-mapped above
+# MMAP_THRESHOLD; the mapping is closed when the block ends
+@contextlib.contextmanager
+def mapped_file(file_path):
+    with open(file_path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size < MMAP_THRESHOLD:
+            yield file.read()
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+# Function to get the content of a file: decompressed when it is compressed,
+# memory-mapped when it is large
+@contextlib.contextmanager
+def file_content(file_path):
+    if is_compressed(file_path):
+        yield read_bytes(file_path)
+        return
+    with mapped_file(file_path) as data:
+        yield data
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import hashlib
+import json
+import re
+import xml.etree.ElementTree as ET
+
+from .process_text import iter_line_records, tei_tree_from_records
+from .add_variants import annotate_variants, variants_layer
+from .add_rejected import annotate_rejected, rejected_layer
+from .add_notes import annotate_note, notes_layer, number_notes
+from .apparatus_tokenizer import APPARATUS_KINDS
+from .file_io import file_content, open_text, read_bytes
+from .instrumentation import get_metrics
+from .serializer import tostring
+from .standoff import StandoffLine
+from .tei_document import TEI_NS, apply_layers, write_atomic, write_tree
+from .tei_writer import format_line, record_line_texts
+
+# Incremental builds: a manifest of content hashes is kept next to the output,
+# one for every line of the text and every apparatus entry. On the next build
+# only the <l> elements whose text or apparatus changed are rendered again and
+# spliced into the previous output. Anything that moves the line numbering or
+# the structure (pages, paragraphs, stanzas, options) triggers a full rebuild.
+
+MANIFEST_VERSION = 4
+
+# Matches a whole <l> element of the output; lines never contain other lines
+L_ELEMENT = re.compile(r'<l\s[^>]*?xml:id="(L\d+)"[^>]*?(?:/>|>.*?</l>)', re.DOTALL)
+
+def manifest_file(output_file):
+    return output_file + '.manifest.json'
+
+def _digest(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+# Function to hash the text: one hash per line, and one for everything else
+# (line IDs and numbers, page breaks, folios, paragraphs or stanzas)
+def _text_hashes(records):
+    structure = hashlib.blake2b(digest_size=16)
+    lines = {}
+    for record in records:
+        if record[0] == 'l':
+            _, line_id, n, line_content = record
+            lines[line_id] = _digest(line_content)
+            structure.update(f"l {line_id} {n}\n".encode('utf-8'))
+        else:
+            structure.update((' '.join(str(part) for part in record) + '\n').encode('utf-8'))
+    return structure.hexdigest(), lines
+
+# Apparatus entries are hashed in their parsed form, as the compile_* functions give them
+def entry_digest(entry):
+    return _digest(repr(entry))
+
+def _load_manifest(output_file):
+    try:
+        with open(manifest_file(output_file), 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+def _save_manifest(output_file, manifest):
+    with open(manifest_file(output_file), 'w', encoding='utf-8') as file:
+        json.dump(manifest, file)
+
+def _full_rebuild_reason(previous, manifest, output):
+    if previous is None:
+        return "no manifest"
+    if output is None:
+        return "no previous output"
+    if previous['output'] != _digest(output):
+        return "the output was modified since the last build"
+    if previous['options'] != manifest['options']:
+        return "the options changed"
+    if previous['structure'] != manifest['structure']:
+        return "the line numbering or structure changed"
+    return None
+
+def _changed_lines(previous, manifest):
+    changed = {
+        line_id for line_id, line_hash in manifest['lines'].items()
+        if previous['lines'].get(line_id) != line_hash
+    }
+    for kind, entries in manifest['apparatus'].items():
+        previous_entries = previous['apparatus'].get(kind, {})
+        for line_id in entries.keys() | previous_entries.keys():
+            if entries.get(line_id) != previous_entries.get(line_id):
+                changed.add(f"L{line_id}")
+    # Lines whose note is numbered anew, as notes were added, removed or moved
+    note_numbers = manifest['note_numbers']
+    previous_numbers = previous['note_numbers']
+    for line_id in note_numbers.keys() | previous_numbers.keys():
+        if note_numbers.get(line_id) != previous_numbers.get(line_id):
+            changed.add(line_id)
+    return changed
+
+# Function to number the notes of an edition from the line records of its text,
+# see add_notes.number_notes
+def record_note_numbers(records, notes):
+    line_texts = record_line_texts(records, {f"L{line_id}" for line_id in notes})
+    return number_notes(notes, line_texts.get)
+
+# Function to render one line from its record and its apparatus entries, its
+# note numbered note_number. Returns the <l> element as text.
+def render_line(record, apparatus, note_number):
+    _, line_id, n, line_content = record
+    key = line_id[1:]
+    l_element = ET.fromstring(f'<TEI xmlns="{TEI_NS}">{format_line(line_id, n, line_content)}</TEI>')[0]
+    line = StandoffLine(l_element)
+
+    if key in apparatus['variants']:
+        annotate_variants(line, line_id, apparatus['variants'][key])
+    if key in apparatus['rejected']:
+        annotate_rejected(line, line_id, apparatus['rejected'][key])
+    if key in apparatus['notes']:
+        annotate_note(line, line_id, apparatus['notes'][key], note_number)
+
+    line.render()
+    return tostring(l_element)
+
+# Function to splice the changed lines into the previous output
+def _splice(output, records, changed, apparatus, note_numbers):
+    replacements = {
+        record[1]: render_line(record, apparatus, note_numbers.get(record[1], 0))
+        for record in records if record[0] == 'l' and record[1] in changed
+    }
+
+    def replace(match):
+        return replacements.get(match.group(1), match.group(0))
+
+    return L_ELEMENT.sub(replace, str(output, 'utf-8')).encode('utf-8')
+
+def _full_build(records, apparatus, output_file):
+    tree = tei_tree_from_records(records)
+    apply_layers(tree, [variants_layer(apparatus['variants']), rejected_layer(apparatus['rejected']), notes_layer(apparatus['notes'])])
+    write_tree(tree, output_file)
+
+# Function to build an edition incrementally: same result as build_edition, but
+# only the lines whose text or apparatus changed since the last build are redone.
+# apparatus maps 'variants', 'rejected' and 'notes' to their entries, see
+# pipeline.load_apparatus_files. Returns the set of line IDs that were rendered
+# again, or None after a full build.
+def build_incremental(text_file, output_file, apparatus, **tei_options):
+    with open_text(text_file) as infile:
+        records = list(iter_line_records(infile, **tei_options))
+    structure, line_hashes = _text_hashes(records)
+
+    apparatus = {kind: apparatus.get(kind, {}) for kind in APPARATUS_KINDS}
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'options': tei_options,
+        'structure': structure,
+        'lines': line_hashes,
+        'apparatus': {
+            kind: {line_id: entry_digest(entry) for line_id, entry in entries.items()}
+            for kind, entries in apparatus.items()
+        },
+        'note_numbers': record_note_numbers(records, apparatus['notes']),
+    }
+
+    previous = _load_manifest(output_file)
+    metrics = get_metrics()
+    changed = spliced = None
+    # The previous output is mapped rather than read when it is large; it is closed
+    # before being replaced
+    with contextlib.ExitStack() as stack:
+        try:
+            output = stack.enter_context(file_content(output_file))
+        except OSError:
+            output = None
+        reason = _full_rebuild_reason(previous, manifest, output)
+        if reason is None:
+            changed = _changed_lines(previous, manifest)
+            if changed:
+                spliced = _splice(output, records, changed, apparatus, manifest['note_numbers'])
+
+    if reason is None:
+        if not changed:
+            metrics.info(f"TEI file is up to date: {output_file}")
+            return changed
+        write_atomic(output_file, spliced)
+        manifest['output'] = _digest(spliced)
+        _save_manifest(output_file, manifest)
+        metrics.count('lines_touched', len(changed))
+        metrics.info(f"Updated {len(changed)} line(s) in TEI file: {output_file}")
+        return changed
+
+    metrics.info(f"Full rebuild of {output_file}: {reason}")
+    _full_build(records, apparatus, output_file)
+    manifest['output'] = _digest(read_bytes(output_file))
+    _save_manifest(output_file, manifest)
+    metrics.info(f"Successfully created TEI file: {output_file}")
+    return None
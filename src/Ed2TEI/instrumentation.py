@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import json
+import time
+
+# Metrics of a run: time spent in each stage (convert, parse, index, match,
+# rebuild, serialize) and counters (lines touched, lemmas not found, malformed
+# entries, missing line IDs...). The processing functions record into the
+# current metrics; the commands print a summary and can write them to JSON.
+# Warnings about the apparatus are printed as they come, unless quiet is set.
+# The steps run for every line (match, rebuild, and serialize when streaming) are
+# only timed when detailed is set, i.e. when the timings of the run are asked for.
+
+class Metrics:
+    def __init__(self, quiet=False, detailed=False):
+        self.quiet = quiet
+        self.detailed = detailed
+        self.timers = {}
+        self.counters = {}
+        self.started = time.perf_counter()
+        # The warnings given as (message, counter) while recorded_warnings is active
+        self.recorded = None
+
+    def count(self, name, number=1):
+        self.counters[name] = self.counters.get(name, 0) + number
+
+    def add_time(self, name, seconds):
+        self.timers[name] = self.timers.get(name, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    # Function to report a problem in the data, counted under counter
+    def warn(self, message, counter):
+        self.count(counter)
+        if self.recorded is not None:
+            self.recorded.append((message, counter))
+        if not self.quiet:
+            print(message)
+
+    def info(self, message):
+        if not self.quiet:
+            print(message)
+
+    # Function to add the metrics of another run, e.g. of a volume built in a worker process
+    def merge(self, report):
+        for name, seconds in report.get('timers', {}).items():
+            self.add_time(name, seconds)
+        for name, number in report.get('counters', {}).items():
+            self.count(name, number)
+
+    def report(self):
+        return {
+            'elapsed': round(time.perf_counter() - self.started, 6),
+            'timers': {name: round(seconds, 6) for name, seconds in sorted(self.timers.items())},
+            'counters': dict(sorted(self.counters.items())),
+        }
+
+    def summary(self):
+        counters = ', '.join(f"{name.replace('_', ' ')}: {number}" for name, number in sorted(self.counters.items()))
+        return f"Summary: {counters or 'nothing done'} ({time.perf_counter() - self.started:.3f} s)"
+
+    def write_report(self, output_file):
+        with open(output_file, 'w', encoding='utf-8') as file:
+            json.dump(self.report(), file, indent=2)
+
+
+_current = Metrics()
+
+def get_metrics():
+    return _current
+
+# Function to start recording a new run
+def reset_metrics(quiet=False, detailed=False):
+    global _current
+    _current = Metrics(quiet, detailed)
+    return _current
+
+# Function to make the given metrics the current ones again
+def use_metrics(metrics):
+    global _current
+    _current = metrics
+    return metrics
+
+# Function to run a block without recording its metrics or printing its messages,
+# e.g. a first pass over a file that is read again
+@contextlib.contextmanager
+def unrecorded():
+    metrics = get_metrics()
+    use_metrics(Metrics(quiet=True))
+    try:
+        yield
+    finally:
+        use_metrics(metrics)
+
+# Function to record the warnings given in a block as [(message, counter)], so they
+# can be given again with replay_warnings, e.g. when its result is read from a cache
+@contextlib.contextmanager
+def recorded_warnings():
+    metrics = get_metrics()
+    outer = metrics.recorded
+    warnings = metrics.recorded = []
+    try:
+        yield warnings
+    finally:
+        metrics.recorded = outer
+        if outer is not None:
+            outer.extend(warnings)
+
+def replay_warnings(warnings):
+    metrics = get_metrics()
+    for message, counter in warnings:
+        metrics.warn(message, counter)
+
+# Options of the metrics shared by the commands
+def add_metrics_options(parser):
+    parser.add_argument('--quiet', action='store_true', help='Do not print the warnings and the summary.')
+    parser.add_argument('--metrics_file', help='Write the timings and counters of the run to this JSON file.')
+
+def start_run(args):
+    return reset_metrics(quiet=args.quiet, detailed=bool(args.metrics_file))
+
+# Function to end a run: prints the summary and writes the metrics report
+def finish_run(args):
+    metrics = get_metrics()
+    metrics.info(metrics.summary())
+    if args.metrics_file:
+        metrics.write_report(args.metrics_file)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+# Job manifests: a TOML or JSON file listing conversions that ed2tei run makes one
+# after the other in a single process. Every job gives the command to run (build
+# when not given) and its options, named as on the command line; the options of
+# the defaults table apply to every job whose command accepts them. The paths are
+# relative to the manifest.
+#
+#   [defaults]
+#   number_stanzas_paragraphs = true
+#
+#   [[jobs]]
+#   text = "Joshua_vol1_text.txt"
+#   variants = "Joshua_vol1_variants.txt"
+#   output = "Joshua_vol1.xml"
+#
+#   [[jobs]]
+#   command = "add_notes"
+#   tei_file = "Joshua_vol1.xml"
+#   notes_file = "Joshua_vol1_notes.txt"
+#   output_file = "Joshua_vol1_notes.xml"
+#
+# In JSON the manifest is an object with the same "defaults" and "jobs" keys.
+
+JOB_COMMANDS = ('create_tei', 'add_variants', 'add_rejected', 'add_notes', 'build', 'batch', 'validate', 'index_witnesses')
+DEFAULT_COMMAND = 'build'
+
+# Keys of a job that are not options of its command
+JOB_KEYS = ('command', 'name')
+
+def _load_toml(text):
+    try:
+        import tomllib
+    except ImportError:  # Before Python 3.11
+        try:
+            import tomli as tomllib
+        except ImportError:
+            raise ValueError("TOML manifests need Python 3.11 or the tomli package, use a JSON manifest instead")
+    return tomllib.loads(text)
+
+# Function to read a manifest, returns (defaults, jobs)
+def read_jobs(manifest_file):
+    with open(manifest_file, 'r', encoding='utf-8') as file:
+        text = file.read()
+    try:
+        manifest = _load_toml(text) if manifest_file.endswith('.toml') else json.loads(text)
+    except ValueError as error:
+        raise ValueError(f"Cannot read the manifest {manifest_file}: {error}")
+
+    if not isinstance(manifest, dict) or not isinstance(manifest.get('jobs'), list):
+        raise ValueError(f"The manifest {manifest_file} has no list of jobs")
+    defaults = manifest.get('defaults', {})
+    if not isinstance(defaults, dict):
+        raise ValueError(f"The defaults of the manifest {manifest_file} must be a table")
+    for number, job in enumerate(manifest['jobs'], 1):
+        if not isinstance(job, dict):
+            raise ValueError(f"Job {number} of the manifest {manifest_file} must be a table")
+        command = job.get('command', DEFAULT_COMMAND)
+        if command not in JOB_COMMANDS:
+            raise ValueError(f"Job {number} of the manifest {manifest_file}: unknown command '{command}', expected one of: {', '.join(JOB_COMMANDS)}")
+    return defaults, manifest['jobs']
+
+def job_command(job):
+    return job.get('command', DEFAULT_COMMAND)
+
+# Function to turn the options of a job into the arguments of its command, given
+# the parser of the command
+def job_arguments(parser, job, defaults):
+    positionals = []
+    options = []
+    known = set(JOB_KEYS)
+    for action in parser._actions:
+        if action.dest == 'help':
+            continue
+        known.add(action.dest)
+        if action.dest in job:
+            value = job[action.dest]
+        elif action.dest in defaults:
+            value = defaults[action.dest]
+        else:
+            continue
+
+        if not action.option_strings:
+            positionals.append(str(value))
+        elif action.nargs == 0:
+            # Flags such as --is_verse are given as true or false
+            if value:
+                options.append(action.option_strings[0])
+        else:
+            options.extend([action.option_strings[0], str(value)])
+
+    unknown = sorted(set(job) - known)
+    if unknown:
+        raise ValueError(f"Unknown option(s) for {job_command(job)}: {', '.join(unknown)}")
+    return positionals + options
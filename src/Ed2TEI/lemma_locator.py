@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+import functools
+import re
+import time
+
+from .instrumentation import get_metrics
+
+# Location of the lemmas of a line. All the lemmas of a line are found in a single
+# scan of its text with one compiled alternation, overlapping occurrences included.
+# The lemmas are then placed one after the other without overlapping, each on its
+# first occurrence after the previous one.
+#
+# A lemma repeated in a line can be pointed at with superscript digits, as in the
+# printed apparatus: (et²) is the second occurrence of "et" in the line, counted
+# over the whole line text, inside other words included.
+
+# Below this number of distinct lemmas in a line, looking for each one with
+# str.find is faster than compiling an alternation for the line; both find the
+# same occurrences
+SCAN_THRESHOLD = 8
+
+SUPERSCRIPT_DIGITS = '⁰¹²³⁴⁵⁶⁷⁸⁹'
+SUPERSCRIPT_TO_DIGITS = str.maketrans(SUPERSCRIPT_DIGITS, '0123456789')
+OCCURRENCE_SUFFIX = re.compile(f'[{SUPERSCRIPT_DIGITS}]+$')
+
+# Function to split a lemma into its text and the occurrence it points at (None when not given)
+def split_occurrence(lemma):
+    match = OCCURRENCE_SUFFIX.search(lemma)
+    if match is None or match.start() == 0:
+        return lemma, None
+    occurrence = int(match.group().translate(SUPERSCRIPT_TO_DIGITS))
+    return lemma[:match.start()], occurrence or None
+
+def lemma_text(lemma):
+    return split_occurrence(lemma)[0]
+
+# The pattern finds, at every position, the longest lemma starting there; the
+# shorter lemmas starting at the same position are prefixes of that one
+@functools.lru_cache(maxsize=1024)
+def _compile(lemmas):
+    pattern = re.compile('(?=(' + '|'.join(re.escape(lemma) for lemma in lemmas) + '))')
+    prefixes = {
+        lemma: [other for other in lemmas if other != lemma and lemma.startswith(other)]
+        for lemma in lemmas
+    }
+    return pattern, prefixes
+
+# Function to find every occurrence of the lemmas in the text in one scan:
+# returns {lemma: [start positions in increasing order]}
+def find_occurrences(text, lemmas):
+    lemmas = tuple(sorted({lemma for lemma in lemmas if lemma}, key=lambda lemma: (-len(lemma), lemma)))
+    occurrences = {lemma: [] for lemma in lemmas}
+    if len(lemmas) < SCAN_THRESHOLD:
+        for lemma, positions in occurrences.items():
+            position = text.find(lemma)
+            while position != -1:
+                positions.append(position)
+                position = text.find(lemma, position + 1)
+        return occurrences
+
+    pattern, prefixes = _compile(lemmas)
+    for match in pattern.finditer(text):
+        start = match.start()
+        longest = match.group(1)
+        occurrences[longest].append(start)
+        for shorter in prefixes[longest]:
+            occurrences[shorter].append(start)
+    return occurrences
+
+# Function to locate the lemmas of a line. Returns one (lemma, start, end) per lemma,
+# with start and end None when the lemma is not found. The lemmas are placed in the
+# given order, or in the order of their first appearance in the text when
+# in_text_order is set; each one is placed after the end of the previous one.
+def locate_lemmas(line_text, lemmas, in_text_order=False):
+    metrics = get_metrics()
+    if metrics.detailed:
+        start_time = time.perf_counter()
+    targets = [split_occurrence(lemma) for lemma in lemmas]
+    occurrences = find_occurrences(line_text, [text for text, _ in targets])
+
+    def candidates(target):
+        text, occurrence = target
+        if not text:
+            return [0]
+        positions = occurrences[text]
+        if occurrence is not None:
+            return positions[occurrence - 1:occurrence]
+        return positions
+
+    order = range(len(lemmas))
+    if in_text_order:
+        # Lemmas that are not found come first, as they are skipped anyway
+        order = sorted(order, key=lambda i: next(iter(candidates(targets[i])), -1))
+
+    located = []
+    cursor = 0
+    for i in order:
+        text = targets[i][0]
+        start = None
+        if text:
+            start = next((position for position in candidates(targets[i]) if position >= cursor), None)
+        else:
+            start = cursor
+        if start is None:
+            located.append((lemmas[i], None, None))
+        else:
+            cursor = start + len(text)
+            located.append((lemmas[i], start, cursor))
+    if metrics.detailed:
+        metrics.add_time('match', time.perf_counter() - start_time)
+    return located
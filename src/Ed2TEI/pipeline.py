@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from .process_text import create_tei_tree, iter_line_records
+from .add_variants import variants_layer
+from .add_rejected import rejected_layer
+from .add_notes import notes_layer
+from .apparatus_cache import load_apparatus
+from .file_io import open_text
+from .incremental import build_incremental
+from .instrumentation import get_metrics, unrecorded
+from .shards import write_sharded
+from .streaming import prepare_layers, write_edition
+from .tei_document import apply_layers, write_tree
+from .tei_writer import record_line_texts
+from .witness_index import index_witnesses
+
+# Function to read and parse the apparatus files that are given, optionally through
+# the apparatus cache; returns {'variants': ..., 'rejected': ..., 'notes': ...}.
+# Large files are parsed by up to parse_workers processes, see apparatus_loader.
+def load_apparatus_files(variants_file=None, rejected_file=None, notes_file=None, use_cache=False, cache_dir=None, parse_workers=1):
+    apparatus = {}
+    for kind, file_path in (('variants', variants_file), ('rejected', rejected_file), ('notes', notes_file)):
+        if file_path:
+            apparatus[kind] = load_apparatus(file_path, kind, use_cache=use_cache, cache_dir=cache_dir, workers=parse_workers)
+    return apparatus
+
+# Function to get the base text of the lines of a text file whose ID is in line_ids,
+# in a first pass over the file that is not counted in the metrics
+def text_line_texts(text_file, line_ids, **tei_options):
+    with unrecorded(), open_text(text_file) as infile:
+        return record_line_texts(iter_line_records(infile, **tei_options), line_ids)
+
+# Function to build a complete edition: the text is converted to TEI and the
+# variants, rejected readings and notes are applied to the same in-memory tree,
+# which is parsed once and written once.
+# In streaming mode no tree is built: the TEI is written straight from the lines
+# of the text, and only the lines with an apparatus are parsed, see iter_edition.
+# In incremental mode only the lines that changed since the last build are redone.
+# With use_cache, the parsed apparatus files are kept in the apparatus cache.
+# With shard_by, the edition is written as a master file and its shards, see shards.
+# With witness_db, the variants are indexed by witness into that SQLite database,
+# from the tree, or from the output when no tree is built, see witness_index.
+def build_edition(text_file, output_file, variants_file=None, rejected_file=None, notes_file=None, stream=False, incremental=False, use_cache=False, cache_dir=None, shard_by=None, pages_per_shard=1, parse_workers=1, witness_db=None, **tei_options):
+    metrics = get_metrics()
+    if shard_by and (stream or incremental):
+        raise ValueError("Sharded editions cannot be built in streaming or incremental mode")
+    with metrics.timer('parse'):
+        apparatus = load_apparatus_files(variants_file, rejected_file, notes_file, use_cache=use_cache, cache_dir=cache_dir, parse_workers=parse_workers)
+
+    if incremental:
+        if stream:
+            raise ValueError("Incremental builds cannot be streamed")
+        changed = build_incremental(text_file, output_file, apparatus, **tei_options)
+        # An edition that is up to date keeps its index, unless there is none
+        if witness_db and (changed != set() or not os.path.exists(witness_db)):
+            index_witnesses(output_file, witness_db)
+        return changed
+
+    layers = []
+    if 'variants' in apparatus:
+        layers.append(variants_layer(apparatus['variants']))
+    if 'rejected' in apparatus:
+        layers.append(rejected_layer(apparatus['rejected']))
+    if 'notes' in apparatus:
+        layers.append(notes_layer(apparatus['notes']))
+
+    if stream:
+        prepare_layers(layers, lambda line_ids: text_line_texts(text_file, line_ids, **tei_options))
+        with open_text(text_file) as infile:
+            write_edition(iter_line_records(infile, **tei_options), output_file, layers)
+        metrics.info(f"Successfully created TEI file: {output_file}")
+        if witness_db:
+            index_witnesses(output_file, witness_db)
+        return None
+
+    # The layers are applied together, so that every line is rendered once
+    tree = create_tei_tree(text_file, **tei_options)
+    apply_layers(tree, layers)
+    if witness_db:
+        index_witnesses(tree, witness_db)
+
+    if shard_by:
+        write_sharded(tree, output_file, shard_by, pages_per_shard)
+    else:
+        write_tree(tree, output_file)
+    metrics.info(f"Successfully created TEI file: {output_file}")
+    return tree
@@ -8,6 +8,12 @@ Created on Sat Sep 28 15:55:04 2024
 import argparse
 import re
 
+from .file_io import open_text
+from .instrumentation import add_metrics_options, finish_run, get_metrics, start_run
+from .shards import add_shard_options, shard_options, write_sharded
+from .tei_writer import OUTPUT_BUFFER_SIZE, emit_xml, write_batched
+from .xml_backend import parse_chunks
+
 def arabic_to_roman(number):
     roman_numerals = [
         (1000, 'M'), (900, 'CM'), (500, 'D'), (400, 'CD'),
@@ -21,143 +27,182 @@ def arabic_to_roman(number):
             number -= arabic
     return result
 
-def create_tei(input_file, output_file, is_verse=True, number_stanzas_paragraphs=False, use_roman_numerals=False, number_lines_every=4, reset_counts_on_page_break=False):
-    with open(input_file, 'r', encoding='utf-8') as infile, open(output_file, 'w', encoding='utf-8') as outfile:
-        lines = infile.readlines()
-        line_count = 0
-        stanza_count = 0
-        paragraph_count = 0
-        in_paragraph = False
-        in_stanza = False
-        page_line_count = 0
-
-        outfile.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-        outfile.write('<TEI xmlns="http://www.tei-c.org/ns/1.0">\n')
-        outfile.write('<teiHeader>\n')
-        outfile.write('  <fileDesc>\n')
-        outfile.write('    <titleStmt>\n')
-        outfile.write('      <title></title>\n')
-        outfile.write('    </titleStmt>\n')
-        outfile.write('    <publicationStmt><p></p></publicationStmt>\n')
-        outfile.write('    <sourceDesc><p></p></sourceDesc>\n')
-        outfile.write('  </fileDesc>\n')
-        outfile.write('</teiHeader>\n')
-        outfile.write('  <text>\n')
-        outfile.write('    <body>\n')
-        outfile.write('    <div>\n')
-
-        for line in lines:
-            stripped_line = line.strip()
-            line = re.sub(r'^\d+\s*', '', line)
-
-            if stripped_line.startswith('<p'):
-                if '>' in stripped_line:
-                    page_number, remaining_text = stripped_line[2:].split('>', 1)
-                else:
-                    page_number = stripped_line[2:]
-                    remaining_text = ""
-
-                outfile.write(f'    <pb ed="base" n="{page_number.strip()}"/>\n')
-                if reset_counts_on_page_break:
-                    paragraph_count = 0  # Reset the paragraph counter at each page break
-                    stanza_count = 0     # Reset the stanza counter at each page break
-                    page_line_count = 0  # Reset the line count for n="" at each page break
-
-                if remaining_text.strip():
-                    stripped_line = remaining_text.strip()
-                else:
-                    continue
-
-            if '[f.' in stripped_line:
-                parts = re.split(r'(\[f\.\s*\d+[a-zA-Z]?\])', stripped_line)
-                folio_inserted = False
-                for part in parts:
-                    match = re.search(r'\[f\.\s*(\d+[a-zA-Z]?)\]', part)
-                    if match:
-                        folio_number = match.group(1)
-                        if folio_inserted:
-                            outfile.write(f'    <pb ed="folio" n="{folio_number.strip()}"/>')
-                        else:
-                            folio_inserted = True
-                            stripped_line = stripped_line.replace(part, f'<pb ed="folio" n="{folio_number.strip()}"/>', 1)
-                    
-            if not stripped_line:
-                if in_paragraph:
-                    outfile.write('    </p>\n')
-                    in_paragraph = False
-                if in_stanza:
-                    outfile.write('    </lg>\n')
-                    in_stanza = False
-                continue
-
-            # Handle stanza or paragraph opening
-            if is_verse:
-                if not in_stanza:
-                    stanza_count += 1
-                    stanza_number = arabic_to_roman(stanza_count) if use_roman_numerals else stanza_count
-                    if number_stanzas_paragraphs:
-                        outfile.write(f'    <lg n="{stanza_number}">\n')
-                    else:
-                        outfile.write('    <lg>\n')
-                    in_stanza = True
+FOLIO_SPLIT = re.compile(r'(\[f\.\s*\d+[a-zA-Z]?\])')
+FOLIO_NUMBER = re.compile(r'\[f\.\s*(\d+[a-zA-Z]?)\]')
+
+# The text is converted by a chain of generators, so that only the current line
+# is held in memory whatever the size of the input:
+#   tokenize_lines -> detect_markers -> group_lines -> emit_xml -> write_batched
+# where the last two stages, which write the TEI, are in tei_writer.
+
+# Stage 1: read the input lazily, one stripped line at a time
+def tokenize_lines(infile):
+    for line in infile:
+        yield line.strip()
+
+# Stage 2: recognise the page breaks (<p ...>), folio breaks ([f. ...]) and blank lines.
+# Yields ('pb', page_number), ('folio', folio_number), ('blank', None) and ('line', content) events.
+def detect_markers(lines):
+    for stripped_line in lines:
+        if stripped_line.startswith('<p'):
+            if '>' in stripped_line:
+                page_number, remaining_text = stripped_line[2:].split('>', 1)
             else:
-                if not in_paragraph:
-                    paragraph_count += 1
-                    paragraph_number = arabic_to_roman(paragraph_count) if use_roman_numerals else paragraph_count
-                    if number_stanzas_paragraphs:
-                        outfile.write(f'    <p n="{paragraph_number}">\n')
-                    else:
-                        outfile.write('    <p>\n')
-                    in_paragraph = True
+                page_number = stripped_line[2:]
+                remaining_text = ""
 
-            # Increment the line_count for line IDs
-            line_count += 1
-            page_line_count += 1  # Increment the line count for n=""
+            yield ('pb', page_number.strip())
 
-            if stripped_line[0].isdigit():
-                line_content = stripped_line.split(maxsplit=1)[1]
+            if remaining_text.strip():
+                stripped_line = remaining_text.strip()
             else:
-                line_content = stripped_line
+                continue
 
-            line_id = f"L{line_count}"  # Retain the line count for line IDs
-            if page_line_count % number_lines_every == 0:
-                outfile.write(f'      <l n="{page_line_count}" xml:id="{line_id}">{line_content}</l>\n')
+        if '[f.' in stripped_line:
+            parts = FOLIO_SPLIT.split(stripped_line)
+            folio_inserted = False
+            for part in parts:
+                match = FOLIO_NUMBER.search(part)
+                if match:
+                    folio_number = match.group(1)
+                    if folio_inserted:
+                        yield ('folio', folio_number.strip())
+                    else:
+                        folio_inserted = True
+                        stripped_line = stripped_line.replace(part, f'<pb ed="folio" n="{folio_number.strip()}"/>', 1)
+
+        if not stripped_line:
+            yield ('blank', None)
+            continue
+
+        if stripped_line[0].isdigit():
+            line_content = stripped_line.split(maxsplit=1)[1]
+        else:
+            line_content = stripped_line
+
+        yield ('line', line_content)
+
+# Stage 3: group the lines into stanzas or paragraphs and number them.
+# Yields ('pb', page_number), ('folio', folio_number), ('open', tag, number), ('close', tag)
+# and ('l', line_id, n, content) records, where number and n are None when not displayed.
+def group_lines(events, is_verse=True, number_stanzas_paragraphs=False, use_roman_numerals=False, number_lines_every=4, reset_counts_on_page_break=False):
+    line_count = 0
+    block_count = 0
+    page_line_count = 0
+    in_block = False
+    block_tag = 'lg' if is_verse else 'p'
+
+    for event in events:
+        kind = event[0]
+
+        if kind == 'pb':
+            yield event
+            if reset_counts_on_page_break:
+                block_count = 0      # Reset the paragraph or stanza counter at each page break
+                page_line_count = 0  # Reset the line count for n="" at each page break
+            continue
+
+        if kind == 'folio':
+            yield event
+            continue
+
+        if kind == 'blank':
+            if in_block:
+                yield ('close', block_tag)
+                in_block = False
+            continue
+
+        # Handle stanza or paragraph opening
+        if not in_block:
+            block_count += 1
+            if number_stanzas_paragraphs:
+                block_number = arabic_to_roman(block_count) if use_roman_numerals else block_count
             else:
-                outfile.write(f'      <l xml:id="{line_id}">{line_content}</l>\n')
+                block_number = None
+            yield ('open', block_tag, block_number)
+            in_block = True
+
+        # Increment the line_count for line IDs
+        line_count += 1
+        page_line_count += 1  # Increment the line count for n=""
+
+        line_id = f"L{line_count}"  # Retain the line count for line IDs
+        n = page_line_count if page_line_count % number_lines_every == 0 else None
+        yield ('l', line_id, n, event[1])
+
+    if in_block:
+        yield ('close', block_tag)
+
+    get_metrics().count('lines', line_count)
+
+# Function to get the line records of a text file, see group_lines
+def iter_line_records(infile, **options):
+    return group_lines(detect_markers(tokenize_lines(infile)), **options)
+
+# Function to write the TEI document for an open text file to an open output stream
+def write_tei(infile, outfile, **options):
+    write_batched(emit_xml(iter_line_records(infile, **options)), outfile)
+
+def create_tei(input_file, output_file, is_verse=True, number_stanzas_paragraphs=False, use_roman_numerals=False, number_lines_every=4, reset_counts_on_page_break=False, shard_by=None, pages_per_shard=1):
+    metrics = get_metrics()
+    # A sharded edition is written from the tree, see shards
+    if shard_by:
+        tree = create_tei_tree(input_file, is_verse=is_verse, number_stanzas_paragraphs=number_stanzas_paragraphs,
+                               use_roman_numerals=use_roman_numerals, number_lines_every=number_lines_every,
+                               reset_counts_on_page_break=reset_counts_on_page_break)
+        write_sharded(tree, output_file, shard_by, pages_per_shard)
+        metrics.info(f"Successfully created TEI file: {output_file}")
+        return
+    with metrics.timer('convert'), open_text(input_file) as infile, open_text(output_file, 'w', buffering=OUTPUT_BUFFER_SIZE) as outfile:
+        write_tei(infile, outfile, is_verse=is_verse, number_stanzas_paragraphs=number_stanzas_paragraphs,
+                  use_roman_numerals=use_roman_numerals, number_lines_every=number_lines_every,
+                  reset_counts_on_page_break=reset_counts_on_page_break)
 
-        if in_paragraph:
-            outfile.write('    </p>\n')
-        if in_stanza:
-            outfile.write('    </lg>\n')
+    # Print success message
+    metrics.info(f"Successfully created TEI file: {output_file}")
 
-        outfile.write('    </div>\n')
-        outfile.write('    </body>\n')
-        outfile.write('  </text>\n')
-        outfile.write('</TEI>\n')
+# Function to build the TEI document in memory, without writing an intermediate file
+def create_tei_tree(input_file, **options):
+    with get_metrics().timer('convert'), open_text(input_file) as infile:
+        return tei_tree_from_records(iter_line_records(infile, **options))
 
-    # Print success message
-    print(f"Successfully created TEI file: {output_file}")
+# Function to build the TEI tree from line records, see group_lines
+def tei_tree_from_records(records):
+    return parse_chunks(emit_xml(records))
     
-def main():
-    parser = argparse.ArgumentParser(description="Process text into TEI XML format.")
-    parser.add_argument('input_file', help='Path to the input text file.')
-    parser.add_argument('output_file', help='Path to the output TEI XML file.')
+# Options of create_tei, shared by the commands that start from the txt file
+def add_tei_options(parser):
     parser.add_argument('--is_verse', action='store_true', help='Process as verse.')
     parser.add_argument('--number_stanzas_paragraphs', action='store_true', help='Number stanzas or paragraphs.')
     parser.add_argument('--use_roman_numerals', action='store_true', help='Use Roman numerals for numbering.')
     parser.add_argument('--number_lines_every', type=int, default=4, help='Number lines every N lines.')
     parser.add_argument('--reset_counts_on_page_break', action='store_true', help='Reset line and paragraph counts at every page break.')
-    
-    args = parser.parse_args()
-    create_tei(
-        args.input_file,
-        args.output_file,
-        is_verse=args.is_verse,
-        number_stanzas_paragraphs=args.number_stanzas_paragraphs,
-        use_roman_numerals=args.use_roman_numerals,
-        number_lines_every=args.number_lines_every,
-        reset_counts_on_page_break=args.reset_counts_on_page_break
-    )
+
+def tei_options(args):
+    return {
+        'is_verse': args.is_verse,
+        'number_stanzas_paragraphs': args.number_stanzas_paragraphs,
+        'use_roman_numerals': args.use_roman_numerals,
+        'number_lines_every': args.number_lines_every,
+        'reset_counts_on_page_break': args.reset_counts_on_page_break,
+    }
+
+def add_arguments(parser):
+    parser.add_argument('input_file', help='Path to the input text file.')
+    parser.add_argument('output_file', help='Path to the output TEI XML file.')
+    add_tei_options(parser)
+    add_shard_options(parser)
+    add_metrics_options(parser)
+
+def run(args):
+    start_run(args)
+    create_tei(args.input_file, args.output_file, **tei_options(args), **shard_options(args))
+    finish_run(args)
+
+def main():
+    parser = argparse.ArgumentParser(description="Process text into TEI XML format.")
+    add_arguments(parser)
+    run(parser.parse_args())
 
 if __name__ == "__main__":
     main()
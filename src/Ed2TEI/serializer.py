@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+import xml.etree.ElementTree as ET
+
+from .tei_document import TEI_NS, XML_NS
+
+# Serialization of single elements in exactly the format of ElementTree.write,
+# for the code paths that write the document piece by piece instead of
+# handing a whole tree to ElementTree.
+
+XML_DECLARATION = "<?xml version='1.0' encoding='utf-8'?>\n"
+
+# Prefixes used when writing TEI documents: TEI is the default namespace and
+# the xml prefix is predefined, so neither needs a declaration below the root.
+DEFAULT_PREFIXES = {TEI_NS: '', XML_NS: 'xml'}
+
+def escape_text(text):
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+def escape_attribute(text):
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    if "\"" in text:
+        text = text.replace("\"", "&quot;")
+    if "\r" in text:
+        text = text.replace("\r", "&#13;")
+    if "\n" in text:
+        text = text.replace("\n", "&#10;")
+    if "\t" in text:
+        text = text.replace("\t", "&#09;")
+    return text
+
+# Function to choose the prefix of a namespace: the registered one, or a
+# generated ns0, ns1... numbered like ElementTree does
+def new_prefix(uri, prefixes):
+    prefix = ET._namespace_map.get(uri)
+    if prefix is None or prefix in prefixes.values():
+        prefix = f"ns{sum(1 for known in prefixes.values() if known != 'xml')}"
+    prefixes[uri] = prefix
+    return prefix
+
+# Function to turn a '{uri}local' name into 'prefix:local'. Namespaces that are
+# not known yet get a generated prefix, recorded in new_declarations so that
+# the caller can declare it on the element being written.
+def qualified_name(name, prefixes, new_declarations=None):
+    if name[:1] != '{':
+        return name
+    uri, local = name[1:].split('}', 1)
+    prefix = prefixes.get(uri)
+    if prefix is None:
+        prefix = new_prefix(uri, prefixes)
+        if new_declarations is not None:
+            new_declarations.append((uri, prefix))
+    return f"{prefix}:{local}" if prefix else local
+
+# Function to write the opening tag of an element; declarations is a list of
+# (uri, prefix) namespace declarations to put on it
+def start_tag(element, prefixes, declarations=(), close=False):
+    declarations = list(declarations)
+    tag = qualified_name(element.tag, prefixes, declarations)
+    attributes = [(qualified_name(key, prefixes, declarations), value) for key, value in element.items()]
+    parts = ["<", tag]
+    for uri, prefix in sorted(declarations, key=lambda declaration: declaration[1]):
+        parts.append(f' xmlns{":" + prefix if prefix else ""}="{escape_attribute(uri)}"')
+    for key, value in attributes:
+        parts.append(f' {key}="{escape_attribute(value)}"')
+    parts.append(" />" if close else ">")
+    return "".join(parts)
+
+def end_tag(element, prefixes):
+    return f"</{qualified_name(element.tag, prefixes)}>"
+
+# Function to serialize an element and its children like ElementTree does;
+# declarations are put on the element itself
+def serialize_element(write, element, prefixes, with_tail=False, declarations=()):
+    if element.tag is ET.Comment:
+        write(f"<!--{element.text}-->")
+    elif element.tag is ET.ProcessingInstruction:
+        write(f"<?{element.text}?>")
+    else:
+        known_prefixes = len(prefixes)
+        text = element.text
+        if text or len(element):
+            write(start_tag(element, prefixes, declarations))
+            if text:
+                write(escape_text(text))
+            for child in element:
+                serialize_element(write, child, prefixes, with_tail=True)
+            write(end_tag(element, prefixes))
+        else:
+            write(start_tag(element, prefixes, declarations, close=True))
+        # Namespaces declared on this element go out of scope with it
+        for uri in list(prefixes)[known_prefixes:]:
+            del prefixes[uri]
+    if with_tail and element.tail:
+        write(escape_text(element.tail))
+
+# Function to find the names of a whole document, in the order ElementTree finds
+# them; returns {name: qualified name} and the namespace declarations of the root
+def document_names(root):
+    prefixes = {XML_NS: 'xml'}
+    declarations = []
+    qnames = {}
+    for element in root.iter():
+        tag = element.tag
+        if isinstance(tag, str):
+            if tag not in qnames:
+                qnames[tag] = qualified_name(tag, prefixes, declarations)
+            for key in element.keys():
+                if key not in qnames:
+                    qnames[key] = qualified_name(key, prefixes, declarations)
+    return qnames, declarations
+
+# Function to write namespace declarations as the attributes of an opening tag
+def declaration_attributes(declarations):
+    return ''.join(
+        f' xmlns{":" + prefix if prefix else ""}="{escape_attribute(uri)}"'
+        for uri, prefix in sorted(declarations, key=lambda declaration: declaration[1])
+    )
+
+# Function to serialize a whole document like ElementTree.write, the XML
+# declaration aside: all the namespaces are declared on the root. Works on the
+# trees of ElementTree and lxml.
+def serialize_document(write, root):
+    qnames, declarations = document_names(root)
+    serialize_named(write, root, qnames, declaration_attributes(declarations))
+
+# Function to serialize an element with the qualified names of document_names;
+# declared holds the namespace declarations of the element. The elements in
+# substitutes are written as the text they are mapped to, followed by their tail.
+def serialize_named(write, element, qnames, declared='', substitutes=None):
+    tag = element.tag
+    if substitutes and element in substitutes:
+        write(substitutes[element])
+    elif not isinstance(tag, str):
+        # Comments and processing instructions, of ElementTree or lxml
+        if tag is ET.Comment or getattr(tag, '__name__', '') == 'Comment':
+            write(f"<!--{element.text}-->")
+        elif tag is ET.ProcessingInstruction:
+            write(f"<?{element.text}?>")
+        else:
+            write(f"<?{element.target} {element.text}?>" if element.text else f"<?{element.target}?>")
+    else:
+        qname = qnames[tag]
+        items = element.items()
+        attributes = ''.join([f' {qnames[key]}="{escape_attribute(value)}"' for key, value in items]) if items else ''
+        text = element.text
+        if text or len(element):
+            write(f"<{qname}{declared}{attributes}>")
+            if text:
+                write(escape_text(text))
+            for child in element:
+                serialize_named(write, child, qnames, substitutes=substitutes)
+            write(f"</{qname}>")
+        else:
+            write(f"<{qname}{declared}{attributes} />")
+    if element.tail:
+        write(escape_text(element.tail))
+
+def tostring(element, prefixes=None, with_tail=False):
+    parts = []
+    serialize_element(parts.append, element, dict(prefixes or DEFAULT_PREFIXES), with_tail=with_tail)
+    return "".join(parts)
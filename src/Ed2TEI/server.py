@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from .instrumentation import Metrics, get_metrics, reset_metrics
+from .pipeline import build_edition
+
+# Local conversion service: a small HTTP server, on asyncio and the standard
+# library only, that converts an edition sent in the request and returns its TEI.
+# The conversions run in a bounded process pool; requests wait in a bounded
+# queue for a free worker and are answered 503 when the queue is full and 504
+# when their conversion takes too long.
+#
+#   POST /convert   JSON {"text": ..., "variants": ..., "rejected": ..., "notes": ...,
+#                   "options": {"is_verse": true, ...}}, the apparatus being optional,
+#                   or the text alone as text/plain; returns the TEI file
+#   GET /health     state of the service
+#   GET /metrics    request counters and the timings and counters of the conversions
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_MAX_QUEUE = 32
+DEFAULT_TIMEOUT = 60.0
+DEFAULT_MAX_BODY_SIZE = 64 * 1024 * 1024
+
+APPARATUS_FIELDS = ('variants', 'rejected', 'notes')
+# Options of create_tei accepted in a request, with the defaults of ed2tei build
+TEI_OPTIONS = {
+    'is_verse': False,
+    'number_stanzas_paragraphs': False,
+    'use_roman_numerals': False,
+    'number_lines_every': 4,
+    'reset_counts_on_page_break': False,
+}
+
+REASONS = {
+    200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+    411: 'Length Required', 413: 'Payload Too Large', 500: 'Internal Server Error',
+    503: 'Service Unavailable', 504: 'Gateway Timeout',
+}
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+# Function run in the worker processes: converts one edition and returns
+# (TEI file content, error, messages, metrics report), with error None on success.
+# The error is the message of the exception; its traceback goes to the messages.
+def convert_edition(text, apparatus, tei_options):
+    log = io.StringIO()
+    # The timings of the conversions are given by GET /metrics
+    metrics = reset_metrics(detailed=True)
+    try:
+        with tempfile.TemporaryDirectory(prefix='ed2tei-') as work_dir, contextlib.redirect_stdout(log):
+            files = {}
+            for kind, content in [('text', text)] + list(apparatus.items()):
+                files[kind] = os.path.join(work_dir, f'{kind}.txt')
+                with open(files[kind], 'w', encoding='utf-8') as file:
+                    file.write(content)
+            output_file = os.path.join(work_dir, 'output.xml')
+            build_edition(
+                files['text'], output_file,
+                variants_file=files.get('variants'), rejected_file=files.get('rejected'), notes_file=files.get('notes'),
+                parse_workers=1, **tei_options
+            )
+            with open(output_file, 'rb') as file:
+                tei = file.read()
+    except Exception as error:
+        log.write(traceback.format_exc())
+        return None, str(error) or type(error).__name__, log.getvalue(), metrics.report()
+    return tei, None, log.getvalue(), metrics.report()
+
+# Function to get the text, apparatus and options of a conversion request
+def parse_conversion_request(content_type, body):
+    try:
+        body = body.decode('utf-8')
+    except UnicodeDecodeError:
+        raise RequestError(400, "The request body must be encoded in UTF-8")
+    if content_type.startswith('text/plain'):
+        return body, {}, dict(TEI_OPTIONS)
+
+    try:
+        payload = json.loads(body)
+    except ValueError as error:
+        raise RequestError(400, f"Invalid JSON: {error}")
+    if not isinstance(payload, dict) or not isinstance(payload.get('text'), str):
+        raise RequestError(400, "The request must be a JSON object with the text in 'text'")
+
+    apparatus = {}
+    for kind in APPARATUS_FIELDS:
+        content = payload.get(kind)
+        if content is None:
+            continue
+        if not isinstance(content, str):
+            raise RequestError(400, f"'{kind}' must be a string")
+        apparatus[kind] = content
+
+    options = payload.get('options') or {}
+    if not isinstance(options, dict):
+        raise RequestError(400, "'options' must be an object")
+    tei_options = dict(TEI_OPTIONS)
+    for name, value in options.items():
+        if name not in TEI_OPTIONS:
+            raise RequestError(400, f"Unknown option '{name}'")
+        if type(value) is not type(TEI_OPTIONS[name]):
+            raise RequestError(400, f"'{name}' must be of type {type(TEI_OPTIONS[name]).__name__}")
+        tei_options[name] = value
+    return payload['text'], apparatus, tei_options
+
+class ConversionServer:
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=None, max_queue=DEFAULT_MAX_QUEUE,
+                 timeout=DEFAULT_TIMEOUT, max_body_size=DEFAULT_MAX_BODY_SIZE):
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.max_body_size = max_body_size
+        self.executor = None
+        self.slots = None
+        self.server = None
+        self.started = time.time()
+        self.active = 0
+        self.queued = 0
+        self.requests = {}
+        # Timings and counters of the conversions, gathered from the workers
+        self.metrics = Metrics(quiet=True)
+
+    async def start(self):
+        # The workers are spawned rather than forked: a worker forked while a
+        # request is being answered would hold its connection open
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        self.slots = asyncio.Semaphore(self.workers)
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        # With port 0 the system chooses a free port
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.executor.shutdown(wait=False)
+
+    async def handle(self, reader, writer):
+        start = time.perf_counter()
+        method, path, status = '-', '-', 500
+        try:
+            try:
+                method, path, headers, body = await self.read_request(reader)
+                status, content_type, content = await self.dispatch(method, path, headers, body)
+            except RequestError as error:
+                status, content_type, content = error.status, 'application/json', _json({'error': str(error)})
+            except Exception:
+                # The traceback is only shown in the server log
+                get_metrics().info(traceback.format_exc())
+                status, content_type, content = 500, 'application/json', _json({'error': REASONS[500]})
+            self.requests[status] = self.requests.get(status, 0) + 1
+            writer.write(_response(status, content_type, content))
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            get_metrics().info(f"{method} {path} {status} ({(time.perf_counter() - start) * 1000:.0f} ms)")
+
+    # Function to read an HTTP/1.1 request, one per connection
+    async def read_request(self, reader):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError:
+            raise RequestError(400, "Incomplete request")
+        except asyncio.LimitOverrunError:
+            raise RequestError(413, "Request headers too large")
+
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, _ = lines[0].split(' ', 2)
+        except ValueError:
+            raise RequestError(400, "Malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+
+        body = b''
+        if method == 'POST':
+            if 'content-length' not in headers:
+                raise RequestError(411, "Content-Length is required")
+            try:
+                length = int(headers['content-length'])
+            except ValueError:
+                raise RequestError(400, "Invalid Content-Length")
+            if length > self.max_body_size:
+                raise RequestError(413, f"Request body larger than {self.max_body_size} bytes")
+            try:
+                body = await reader.readexactly(length)
+            except asyncio.IncompleteReadError:
+                raise RequestError(400, "Incomplete request body")
+        return method, target.split('?', 1)[0], headers, body
+
+    async def dispatch(self, method, path, headers, body):
+        routes = {
+            '/convert': ('POST', self.convert),
+            '/health': ('GET', self.health),
+            '/metrics': ('GET', self.report),
+        }
+        if path not in routes:
+            raise RequestError(404, f"Unknown path: {path}")
+        route_method, handler = routes[path]
+        if method != route_method:
+            raise RequestError(405, f"{path} only accepts {route_method}")
+        return await handler(headers, body)
+
+    async def convert(self, headers, body):
+        text, apparatus, tei_options = parse_conversion_request(headers.get('content-type', 'application/json'), body)
+
+        # Wait for a free worker, unless too many requests are waiting already
+        if self.queued >= self.max_queue:
+            self.metrics.count('conversions_rejected')
+            raise RequestError(503, "Too many conversions waiting, try again later")
+        self.queued += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.queued -= 1
+
+        self.active += 1
+        future = asyncio.get_running_loop().run_in_executor(self.executor, convert_edition, text, apparatus, tei_options)
+        # The worker is only given back when its conversion ends, even after a timeout
+        future.add_done_callback(self._release_slot)
+        try:
+            tei, error, log, report = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.metrics.count('conversions_timed_out')
+            raise RequestError(504, f"The conversion took more than {self.timeout} s")
+
+        self.metrics.merge(report)
+        if error is not None:
+            self.metrics.count('conversions_failed')
+            get_metrics().info(f"Conversion failed: {error}\n{log}")
+            raise RequestError(500, error)
+        self.metrics.count('conversions')
+        return 200, 'application/xml; charset=utf-8', tei
+
+    def _release_slot(self, future):
+        self.active -= 1
+        self.slots.release()
+
+    def state(self):
+        return {
+            'status': 'ok',
+            'workers': self.workers,
+            'active': self.active,
+            'queued': self.queued,
+            'max_queue': self.max_queue,
+            'uptime': round(time.time() - self.started, 3),
+        }
+
+    async def health(self, headers, body):
+        return 200, 'application/json', _json(self.state())
+
+    async def report(self, headers, body):
+        report = self.state()
+        report['requests'] = {str(status): number for status, number in sorted(self.requests.items())}
+        report.update(self.metrics.report())
+        return 200, 'application/json', _json(report)
+
+
+def _json(data):
+    return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+def _response(status, content_type, content):
+    head = (
+        f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(content)}\r\n"
+        "Connection: close\r\n\r\n"
+    )
+    return head.encode('latin-1') + content
+
+# Function to run the service until interrupted
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, **server_options):
+    async def run():
+        server = await ConversionServer(host, port, **server_options).start()
+        get_metrics().info(f"Serving on http://{server.host}:{server.port} with {server.workers} worker(s)")
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+import html
+import json
+import os
+import re
+import shutil
+import xml.etree.ElementTree as ET
+
+from .file_io import open_text
+from .instrumentation import get_metrics
+from .serializer import XML_DECLARATION, declaration_attributes, document_names, escape_attribute, escape_text, serialize_named
+from .tei_document import TEI_NS, LineIndex, apply_layers, load_tree, write_atomic, write_tree
+
+# Sharded editions: instead of one large TEI file, the <div> elements of the body
+# are written to shard files, one per page (or every N pages) or one per <div>,
+# and the TEI file itself is a small master document that pulls them in with
+# XInclude. A shard is a complete document whose root is a copy of the <div> it
+# comes from, holding whole paragraphs or stanzas: as pages often start in the
+# middle of one, the shards are cut at the first block boundary after their pages.
+#
+# Next to the master, an index gives the byte offset and length of every <l> and
+# every base page break in the shards, so that a line can be read without parsing
+# anything, and the injectors only load and rewrite the shards holding the lines
+# of their apparatus.
+#
+#   {"version": 1, "shard_by": "page", "master_size": 512,
+#    "shards": [{"file": "edition_shards/0001.xml", "size": 20480}, ...],
+#    "lines": {"L1": [0, 245, 180], ...},        line ID -> [shard, offset, length]
+#    "pages": [["i-7", 0, 210], ...]}            page number, shard, offset
+
+INDEX_VERSION = 1
+SHARD_MODES = ('page', 'div')
+
+XI_NS = 'http://www.w3.org/2001/XInclude'
+DIV_TAG = f'{{{TEI_NS}}}div'
+PB_TAG = f'{{{TEI_NS}}}pb'
+BODY_PATH = f'{{{TEI_NS}}}text/{{{TEI_NS}}}body'
+
+ET.register_namespace('xi', XI_NS)
+
+# Match the <l> elements and page breaks in the bytes of a shard
+L_BYTES = re.compile(rb'<l\s[^>]*?xml:id="(L\d+)"[^>]*?(?:/>|>.*?</l>)', re.DOTALL)
+PB_BYTES = re.compile(rb'<pb\s[^>]*?/>')
+N_ATTRIBUTE = re.compile(rb'\sn="([^"]*)"')
+
+def shard_dir(output_file):
+    return os.path.splitext(output_file)[0] + '_shards'
+
+def index_file(output_file):
+    return output_file + '.index.json'
+
+def read_index(output_file):
+    try:
+        with open(index_file(output_file), 'r', encoding='utf-8') as file:
+            index = json.load(file)
+    except (OSError, ValueError):
+        raise ValueError(f"No shard index for {output_file}")
+    if index.get('version') != INDEX_VERSION:
+        raise ValueError(f"The shard index of {output_file} has an unsupported version")
+    return index
+
+def _save_index(output_file, index):
+    index['master_size'] = os.path.getsize(output_file)
+    write_atomic(index_file(output_file), json.dumps(index).encode('utf-8'))
+
+# Function to tell whether a TEI file is the master of a sharded edition; an index
+# left by an earlier sharded build of a file written whole since does not count
+def is_sharded(tei_file):
+    try:
+        with open(index_file(tei_file), 'r', encoding='utf-8') as file:
+            index = json.load(file)
+        return index.get('master_size') == os.path.getsize(tei_file)
+    except (OSError, ValueError):
+        return False
+
+def _base_page_breaks(element):
+    return sum(1 for pb in element.iter(PB_TAG) if pb.get('ed') == 'base')
+
+# Function to split the children of a <div> into the groups written to one shard
+# each. Shards end at the blocks of the <div>: a page starting inside a paragraph
+# or stanza ends its shard after the block, and the rest of it is shared with the
+# next shard.
+def _split(div, shard_by, pages_per_shard):
+    children = list(div)
+    if shard_by == 'div':
+        return [children]
+    groups = [[]]
+    # Pages with text in the current shard
+    pages = 0
+    for child in children:
+        page_break = child.tag == PB_TAG and child.get('ed') == 'base'
+        if groups[-1] and (pages > pages_per_shard or (page_break and pages >= pages_per_shard)):
+            groups.append([])
+            pages = 0 if page_break else 1
+        groups[-1].append(child)
+        pages += _base_page_breaks(child)
+    return groups
+
+# Function to serialize a shard: the <div> with some of its children
+def _shard_content(div, children, qnames, declared):
+    parts = [XML_DECLARATION]
+    qname = qnames[div.tag]
+    attributes = ''.join([f' {qnames[key]}="{escape_attribute(value)}"' for key, value in div.items()])
+    parts.append(f"<{qname}{declared}{attributes}>")
+    if div.text:
+        parts.append(escape_text(div.text))
+    for child in children:
+        serialize_named(parts.append, child, qnames)
+    parts.append(f"</{qname}>")
+    return ''.join(parts).encode('utf-8', 'xmlcharrefreplace')
+
+# Function to record the lines of a shard in the index; returns its page breaks
+def _index_shard(index, number, content):
+    index['shards'][number]['size'] = len(content)
+    for match in L_BYTES.finditer(content):
+        index['lines'][match.group(1).decode('ascii')] = [number, match.start(), match.end() - match.start()]
+    pages = []
+    for match in PB_BYTES.finditer(content):
+        page_break = match.group(0)
+        if b'ed="base"' in page_break:
+            n = N_ATTRIBUTE.search(page_break)
+            page = html.unescape(n.group(1).decode('utf-8')) if n else None
+            pages.append([page, number, match.start()])
+    return pages
+
+# Function to write a tree as a sharded edition: output_file becomes the master,
+# the shards go to its _shards directory and the index next to it
+def write_sharded(tree, output_file, shard_by='page', pages_per_shard=1):
+    if shard_by not in SHARD_MODES:
+        raise ValueError(f"Unknown shard mode '{shard_by}', expected one of: {', '.join(SHARD_MODES)}")
+    if pages_per_shard < 1:
+        raise ValueError("pages_per_shard must be at least 1")
+    root = tree.getroot()
+    body = root.find(BODY_PATH)
+    divs = [child for child in body if child.tag == DIV_TAG] if body is not None else []
+    if not divs:
+        raise ValueError("The body of the TEI document has no <div> to shard")
+
+    metrics = get_metrics()
+    directory = shard_dir(output_file)
+    os.makedirs(directory, exist_ok=True)
+    try:
+        stale = {shard['file'] for shard in read_index(output_file)['shards']}
+    except ValueError:
+        stale = set()
+
+    qnames, declarations = document_names(root)
+    index = {'version': INDEX_VERSION, 'shard_by': shard_by, 'shards': [], 'lines': {}, 'pages': []}
+    includes = {}
+    with metrics.timer('serialize'):
+        declared = declaration_attributes(declarations)
+        for div in divs:
+            hrefs = includes[div] = []
+            for children in _split(div, shard_by, pages_per_shard):
+                number = len(index['shards'])
+                href = f"{os.path.basename(directory)}/{number + 1:04d}.xml"
+                content = _shard_content(div, children, qnames, declared)
+                write_atomic(os.path.join(os.path.dirname(output_file), href), content)
+                index['shards'].append({'file': href})
+                index['pages'].extend(_index_shard(index, number, content))
+                hrefs.append(href)
+                stale.discard(href)
+
+        # The master is the document with each <div> replaced by the includes of its shards
+        if XI_NS not in dict(declarations):
+            declarations.append((XI_NS, 'xi'))
+        substitutes = {
+            div: (div.tail or '\n').join(f'<xi:include href="{escape_attribute(href)}" />' for href in hrefs)
+            for div, hrefs in includes.items()
+        }
+        parts = [XML_DECLARATION]
+        serialize_named(parts.append, root, qnames, declaration_attributes(declarations), substitutes)
+        write_atomic(output_file, ''.join(parts).encode('utf-8', 'xmlcharrefreplace'))
+
+    for href in stale:
+        try:
+            os.remove(os.path.join(os.path.dirname(output_file), href))
+        except OSError:
+            pass
+    _save_index(output_file, index)
+    metrics.count('shards_written', len(index['shards']))
+    metrics.info(f"Wrote {len(index['shards'])} shard(s) to {directory}")
+    return index
+
+# Function to read the <l> element of a line from a sharded edition, without parsing
+# anything; returns its XML as text, or None for an unknown line
+def read_line(master_file, line_id, index=None):
+    index = index or read_index(master_file)
+    location = index['lines'].get(line_id)
+    if location is None:
+        return None
+    shard, offset, length = location
+    with open(os.path.join(os.path.dirname(master_file), index['shards'][shard]['file']), 'rb') as file:
+        file.seek(offset)
+        return file.read(length).decode('utf-8')
+
+# The lines of a sharded edition, looked up like in a LineIndex. A shard is only
+# parsed when one of its lines is asked for.
+class ShardLines:
+    def __init__(self, master_file, index):
+        self.directory = os.path.dirname(master_file)
+        self.index = index
+        self.trees = {}
+        self.line_indexes = {}
+
+    def get(self, line_id):
+        location = self.index['lines'].get(line_id)
+        if location is None:
+            return None
+        shard = location[0]
+        line_index = self.line_indexes.get(shard)
+        if line_index is None:
+            tree = self.trees[shard] = load_tree(os.path.join(self.directory, self.index['shards'][shard]['file']))
+            line_index = self.line_indexes[shard] = LineIndex(tree.getroot())
+        return line_index.get(line_id)
+
+# Function to apply apparatus layers to a sharded edition: only the shards holding
+# lines of the apparatus are parsed and written again. When output_file is another
+# file than the master, the edition is copied there with its shards.
+def apply_layers_to_shards(master_file, layers, output_file=None):
+    metrics = get_metrics()
+    index = read_index(master_file)
+    output_file = output_file or master_file
+    in_place = os.path.abspath(output_file) == os.path.abspath(master_file)
+    source_dir = os.path.dirname(master_file)
+    output_dir = os.path.dirname(output_file)
+    directory = os.path.basename(shard_dir(output_file))
+    if not in_place:
+        os.makedirs(os.path.join(output_dir, directory), exist_ok=True)
+
+    lines = ShardLines(master_file, index)
+    apply_layers(None, layers, lines)
+
+    with metrics.timer('serialize'):
+        for number, shard in enumerate(index['shards']):
+            source = os.path.join(source_dir, shard['file'])
+            href = shard['file'] if in_place else f"{directory}/{os.path.basename(shard['file'])}"
+            target = os.path.join(output_dir, href)
+            if number in lines.trees:
+                write_tree(lines.trees[number], target + '.tmp')
+                with open(target + '.tmp', 'rb') as file:
+                    content = file.read()
+                os.replace(target + '.tmp', target)
+                pages = [page for page in index['pages'] if page[1] != number] + _index_shard(index, number, content)
+                index['pages'] = sorted(pages, key=lambda page: (page[1], page[2]))
+            elif not in_place:
+                shutil.copyfile(source, target)
+            shard['file'] = href
+
+        if not in_place:
+            with open_text(master_file) as file:
+                master = file.read()
+            old_directory = os.path.basename(shard_dir(master_file))
+            master = master.replace(f'href="{escape_attribute(old_directory)}/', f'href="{escape_attribute(directory)}/')
+            write_atomic(output_file, master.encode('utf-8'))
+
+    _save_index(output_file, index)
+    metrics.count('shards_rewritten', len(lines.trees))
+    metrics.info(f"Updated {len(lines.trees)} of {len(index['shards'])} shard(s) of {output_file}")
+
+# Options of the commands that can write a sharded edition
+def add_shard_options(parser):
+    parser.add_argument('--shard_by', choices=SHARD_MODES, help='Write the TEI as a master file including one shard per page (or every --pages_per_shard pages) or per <div>.')
+    parser.add_argument('--pages_per_shard', type=int, default=1, help='Pages in each shard with --shard_by page (default: 1).')
+
+def shard_options(args):
+    return {'shard_by': args.shard_by, 'pages_per_shard': args.pages_per_shard}
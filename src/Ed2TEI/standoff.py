@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import time
+
+from .instrumentation import get_metrics
+
+# Standoff model of a line: the plain text of the line and a sorted list of
+# (start, end, element) spans over it. The markup already in the <l> element is
+# read into spans, the apparatus layers add their own spans, and the line is
+# rendered back to nested TEI once all the layers are done. Earlier markup
+# (<app>, <choice>, <note>, <pb>...) is kept when later layers run.
+#
+# The text of the line is its base text: the readings (<rdg>), rejected
+# readings (<sic>) and notes are kept in their elements and do not count in it.
+
+# Elements whose base text is held by one of their children
+BASE_TEXT_CHILDREN = {
+    'app': ('lem',),
+    'choice': ('corr', 'reg', 'expan'),
+}
+
+# Elements without base text, placed between two characters of the line
+NO_BASE_TEXT = {'note', 'pb', 'lb', 'cb', 'milestone', 'anchor', 'gap', 'rdg', 'sic', 'orig', 'abbr'}
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else tag
+
+# Function to find the element holding the base text of an element: the element
+# itself, one of its children, or None for elements without base text
+def base_text_slot(element):
+    name = local_name(element.tag)
+    if name in BASE_TEXT_CHILDREN:
+        for child in element:
+            if local_name(child.tag) in BASE_TEXT_CHILDREN[name]:
+                return child
+        return None
+    if name in NO_BASE_TEXT or not isinstance(element.tag, str):
+        return None
+    return element
+
+# Function to get the base text of an element, without changing it
+def element_text(element):
+    parts = [element.text or '']
+    for child in element:
+        slot = base_text_slot(child)
+        if slot is not None:
+            parts.append(element_text(slot))
+        parts.append(child.tail or '')
+    return ''.join(parts)
+
+class StandoffLine:
+    def __init__(self, l_element):
+        metrics = get_metrics()
+        if metrics.detailed:
+            start_time = time.perf_counter()
+        self.element = l_element
+        self.spans = []
+        self._count = 0
+        self._parts = []
+        self._length = 0
+
+        self._read(l_element)
+        self.text = ''.join(self._parts)
+        del self._parts
+
+        # The content is now held by the spans until the line is rendered
+        l_element.text = None
+        del l_element[:]
+        if metrics.detailed:
+            metrics.add_time('rebuild', time.perf_counter() - start_time)
+
+    def _next(self):
+        self._count += 1
+        return self._count
+
+    def _read_text(self, text):
+        if text:
+            self._parts.append(text)
+            self._length += len(text)
+
+    # Function to read the content of an element into the text and the spans
+    def _read(self, parent):
+        self._read_text(parent.text)
+        for child in list(parent):
+            tail = child.tail
+            child.tail = None
+            start = self._length
+            slot = base_text_slot(child)
+            # Numbered before its content, so that it stays outside of it
+            number = self._next()
+            if slot is not None:
+                self._read(slot)
+                slot.text = None
+                del slot[:]
+            self._insert(start, self._length, number, child, slot)
+            self._read_text(tail)
+
+    def _insert(self, start, end, number, element, slot):
+        # At the same position, elements without text come before the others,
+        # and the longest spans come first as they hold the shorter ones
+        rank = 1 if end > start else 0
+        bisect.insort(self.spans, (start, rank, -end, number, end, element, slot))
+
+    # Function to check whether a new span would cross an existing one
+    def crosses(self, start, end):
+        for span_start, _, _, _, span_end, _, _ in self.spans:
+            if span_start < start < span_end < end or start < span_start < end < span_end:
+                return True
+        return False
+
+    # Function to add an element over text[start:end], with the base text put in
+    # slot (whose content is replaced); elements without slot are placed at start.
+    # Returns False, without adding anything, when the span would cross an existing one.
+    def add(self, start, end, element, slot=None):
+        if slot is None:
+            end = start
+        if not 0 <= start <= end <= len(self.text) or self.crosses(start, end):
+            return False
+        if slot is not None:
+            slot.text = None
+            del slot[:]
+        self._insert(start, end, self._next(), element, slot)
+        return True
+
+    # Function to write the text and the spans back into the <l> element
+    def render(self):
+        metrics = get_metrics()
+        if metrics.detailed:
+            start_time = time.perf_counter()
+        self._fill(self.element, 0, len(self.text), 0, True)
+        if metrics.detailed:
+            metrics.add_time('rebuild', time.perf_counter() - start_time)
+
+    # Function to fill target with text[start:end] and the spans it holds, from
+    # self.spans[index]; returns the index of the first span left
+    def _fill(self, target, start, end, index, is_line):
+        spans = self.spans
+        text = self.text
+        position = start
+        last = None
+
+        while index < len(spans):
+            span_start, _, _, _, span_end, element, slot = spans[index]
+            # Elements without text at the end of a span go after it
+            if span_end > end or (span_start == span_end == end and not is_line):
+                break
+            last = self._append_text(target, last, text[position:span_start])
+            target.append(element)
+            last = element
+            if slot is not None:
+                index = self._fill(slot, span_start, span_end, index + 1, False)
+            else:
+                index += 1
+            position = max(position, span_end)
+
+        self._append_text(target, last, text[position:end])
+        return index
+
+    @staticmethod
+    def _append_text(target, last, text):
+        if text:
+            if last is None:
+                target.text = (target.text or '') + text
+            else:
+                last.tail = (last.tail or '') + text
+        return last
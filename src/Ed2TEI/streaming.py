@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import time
+import xml.etree.ElementTree as ET
+
+from .file_io import TEMP_SUFFIX, open_binary, open_text
+from .instrumentation import get_metrics
+
+from .serializer import DEFAULT_PREFIXES, XML_DECLARATION, end_tag, escape_text, new_prefix, qualified_name, serialize_element, serialize_named, start_tag
+from .standoff import StandoffLine, element_text
+from .tei_document import L_TAG, TEI_NS, XML_ID, XML_NS
+from .tei_writer import LINE_INDENT, OUTPUT_BUFFER_SIZE, emit_xml, format_line, write_batched
+
+# Streaming application of the apparatus: the TEI file is read with a pull
+# parser, each <l> is updated as soon as it is complete, written out and
+# dropped, so that only the current line is held in memory. The output is the
+# same as when the whole tree is parsed, updated and written by ElementTree.
+
+# Size of the blocks read from the TEI file
+READ_BLOCK_SIZE = 1 << 16
+
+LINE_NUMBER = re.compile(r'L(\d+)$')
+
+def _line_order(layer):
+    return sorted(layer.entries.items(), key=lambda item: int(item[0]))
+
+# Function to prepare the layers that are not applied in the order of their entries,
+# see ApparatusLayer: line_texts(line_ids) gives the base text of the lines of the
+# document whose ID is in line_ids, {tei_line_id: text}, and is only called when a
+# layer needs it, as it takes another pass over the document
+def prepare_layers(layers, line_texts):
+    layers = [layer for layer in layers if not layer.prepared and _line_order(layer) != list(layer.entries.items())]
+    if layers:
+        texts = line_texts({f"L{line_id}" for layer in layers for line_id in layer.entries})
+        for layer in layers:
+            layer.prepare(texts.get)
+
+# Merge-join cursor over one apparatus layer, whose entries are sorted by line
+# number and consumed while the <l> elements go by in document order
+class LayerCursor:
+    def __init__(self, layer):
+        self.layer = layer
+        self.entries = _line_order(layer)
+        self.position = 0
+        if not layer.prepared and self.entries != list(layer.entries.items()):
+            raise ValueError("The entries of the layer are not in line order, the layer must be prepared first, see prepare_layers")
+
+    # Function to get the entries of the line, reporting the lines passed over
+    def take(self, tei_line_id, line_number):
+        entries = self.entries
+        taken = []
+
+        # Entries for lines that were passed over do not exist in the document
+        while self.position < len(entries) and int(entries[self.position][0]) < line_number:
+            self.layer.missing(f"L{entries[self.position][0]}")
+            self.position += 1
+
+        while self.position < len(entries) and int(entries[self.position][0]) == line_number:
+            line_id, entry = entries[self.position]
+            if f"L{line_id}" == tei_line_id:
+                taken.append(entry)
+            else:
+                self.layer.missing(f"L{line_id}")
+            self.position += 1
+        return taken
+
+    # Function to get the number of the next line with an entry
+    def next_line(self):
+        if self.position < len(self.entries):
+            return int(self.entries[self.position][0])
+        return float('inf')
+
+    def finish(self):
+        for line_id, _ in self.entries[self.position:]:
+            self.layer.missing(f"L{line_id}")
+        self.position = len(self.entries)
+
+# Generator rewriting a TEI document given as chunks of XML: yields the output
+# as strings, with the apparatus layers applied to every <l>. The layers are
+# prepared, see prepare_layers.
+def iter_rewritten(chunks, layers):
+    metrics = get_metrics()
+    cursors = [LayerCursor(layer) for layer in layers]
+    parser = ET.XMLPullParser(events=('start-ns', 'start', 'end'))
+    prefixes = dict(DEFAULT_PREFIXES)
+    root_declarations = []
+    stack = []           # open elements whose start tag was written
+    pending = None       # (state, element) waiting for its text or tail to be complete
+    line = None          # the <l> element being collected
+    line_depth = 0
+    last_line_number = 0
+
+    yield XML_DECLARATION
+
+    def events():
+        for chunk in chunks:
+            parser.feed(chunk)
+            yield from parser.read_events()
+        parser.close()
+        yield from parser.read_events()
+
+    for event, item in events():
+        if line is not None:
+            # Inside an <l>: wait for the whole line before doing anything
+            if event == 'start':
+                line_depth += 1
+            elif event == 'end':
+                line_depth -= 1
+            if event != 'end' or line_depth:
+                continue
+
+            tei_line_id = line.get(XML_ID)
+            match = LINE_NUMBER.match(tei_line_id or '')
+            if match:
+                line_number = int(match.group(1))
+                if line_number <= last_line_number:
+                    raise ValueError(f"Line ID {tei_line_id} is out of document order, the TEI file cannot be streamed")
+                last_line_number = line_number
+                updates = [(cursor.layer, entry) for cursor in cursors for entry in cursor.take(tei_line_id, line_number)]
+                if updates:
+                    standoff_line = StandoffLine(line)
+                    for layer, entry in updates:
+                        layer.apply(standoff_line, tei_line_id, entry)
+                    standoff_line.render()
+                    metrics.count('lines_touched')
+
+            if metrics.detailed:
+                start_time = time.perf_counter()
+            parts = []
+            serialize_element(parts.append, line, prefixes)
+            if metrics.detailed:
+                metrics.add_time('serialize', time.perf_counter() - start_time)
+            yield ''.join(parts)
+            pending = ('tail', line)
+            line = None
+            continue
+
+        if event == 'start-ns':
+            prefix, uri = item
+            if not stack and uri != XML_NS:
+                root_declarations.append(uri)
+            continue
+
+        # The text or tail of the previous element is complete once a new event comes in
+        if pending is not None:
+            state, element = pending
+            pending = None
+            if state == 'open':
+                declarations = _declarations(root_declarations, prefixes) if len(stack) == 1 else ()
+                if event == 'end' and item is element and not element.text:
+                    # Empty element, written like <pb ... />
+                    yield start_tag(element, prefixes, declarations, close=True)
+                    stack.pop()
+                    if stack:
+                        pending = ('tail', element)
+                    continue
+                yield start_tag(element, prefixes, declarations)
+                if element.text:
+                    yield escape_text(element.text)
+            else:
+                if element.tail:
+                    yield escape_text(element.tail)
+                # The element is written: drop it from the tree
+                stack[-1].remove(element)
+
+        if event == 'start':
+            if item.tag == L_TAG:
+                line = item
+                line_depth = 1
+                continue
+            stack.append(item)
+            pending = ('open', item)
+        elif event == 'end':
+            yield end_tag(item, prefixes)
+            stack.pop()
+            if stack:
+                pending = ('tail', item)
+
+    for cursor in cursors:
+        cursor.finish()
+
+# Namespace declarations of the root element, with the prefixes ElementTree would use
+def _declarations(uris, prefixes):
+    declarations = []
+    for uri in uris:
+        prefix = prefixes.get(uri)
+        if prefix is None:
+            prefix = new_prefix(uri, prefixes)
+        declarations.append((uri, prefix))
+    return declarations
+
+def _read_blocks(infile):
+    return iter(lambda: infile.read(READ_BLOCK_SIZE), b'')
+
+# Function to get the base text of the lines of a TEI file whose ID is in line_ids,
+# reading it with a pull parser like iter_rewritten: {tei_line_id: text}
+def tei_line_texts(tei_file, line_ids):
+    texts = {}
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    stack = []
+    with open_binary(tei_file) as infile:
+        for chunk in _read_blocks(infile):
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                if event == 'start':
+                    stack.append(element)
+                    continue
+                stack.pop()
+                if element.tag == L_TAG and element.get(XML_ID) in line_ids:
+                    texts.setdefault(element.get(XML_ID), element_text(element))
+                # The elements are dropped once read, except inside the lines
+                if stack and not any(parent.tag == L_TAG for parent in stack):
+                    stack[-1].remove(element)
+        parser.close()
+    return texts
+
+# Function to apply apparatus layers to a TEI file in streaming mode. The output
+# is written next to it and moved into place at the end, as it can be the TEI
+# file itself.
+def stream_layers(tei_file, output_file, layers):
+    if output_file is None:
+        raise ValueError("An output file is required in streaming mode")
+    prepare_layers(layers, lambda line_ids: tei_line_texts(tei_file, line_ids))
+    temp_file = output_file + TEMP_SUFFIX
+    with open_binary(tei_file) as infile:
+        stream_chunks(_read_blocks(infile), temp_file, layers)
+    os.replace(temp_file, output_file)
+
+# Function to apply apparatus layers to a TEI document given as chunks of XML
+def stream_chunks(chunks, output_file, layers):
+    with open_text(output_file, 'w', newline='', buffering=OUTPUT_BUFFER_SIZE) as outfile:
+        write_batched(iter_rewritten(chunks, layers), outfile)
+
+# Qualified names of the elements and attributes of the lines, found once; a name
+# whose namespace would have to be declared is missing
+class LineNames(dict):
+    def __missing__(self, name):
+        declarations = []
+        qname = qualified_name(name, dict(DEFAULT_PREFIXES), declarations)
+        if declarations:
+            raise KeyError(name)
+        self[name] = qname
+        return qname
+
+# Generator writing an edition straight from the line records of its text, with
+# the apparatus layers applied: no document is parsed, only the lines with an
+# apparatus get an <l> element, rendered through their standoff model, and the
+# other lines are written as they are. The output is the one of iter_rewritten
+# on the TEI of the records. The layers are prepared, see prepare_layers.
+def iter_edition(records, layers):
+    metrics = get_metrics()
+    cursors = [LayerCursor(layer) for layer in layers]
+    names = LineNames()
+    # The lines before the next one with an entry are written without looking at the layers
+    next_line = min((cursor.next_line() for cursor in cursors), default=float('inf'))
+
+    def write_line(line_id, n, line_content):
+        nonlocal next_line
+        line_number = int(line_id[1:])
+        if line_number < next_line:
+            return format_line(line_id, n, line_content)
+        updates = [(cursor.layer, entry) for cursor in cursors for entry in cursor.take(line_id, line_number)]
+        next_line = min(cursor.next_line() for cursor in cursors)
+        if not updates:
+            return format_line(line_id, n, line_content)
+
+        l_element = ET.fromstring(f'<TEI xmlns="{TEI_NS}">{format_line(line_id, n, line_content)}</TEI>')[0]
+        standoff_line = StandoffLine(l_element)
+        for layer, entry in updates:
+            layer.apply(standoff_line, line_id, entry)
+        standoff_line.render()
+        metrics.count('lines_touched')
+
+        if metrics.detailed:
+            start_time = time.perf_counter()
+        parts = [LINE_INDENT]
+        l_element.tail = '\n'
+        try:
+            serialize_named(parts.append, l_element, names)
+        except KeyError:
+            # Markup in other namespaces, declared on the elements
+            parts = [LINE_INDENT]
+            serialize_element(parts.append, l_element, dict(DEFAULT_PREFIXES), with_tail=True)
+        if metrics.detailed:
+            metrics.add_time('serialize', time.perf_counter() - start_time)
+        return ''.join(parts)
+
+    yield from emit_xml(records, write_line)
+    for cursor in cursors:
+        cursor.finish()
+
+# Function to write an edition from the line records of its text, see iter_edition
+def write_edition(records, output_file, layers):
+    with open_text(output_file, 'w', newline='', buffering=OUTPUT_BUFFER_SIZE) as outfile:
+        write_batched(iter_edition(records, layers), outfile)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import os
+import xml.etree.ElementTree as ET
+
+from .file_io import compress
+from .instrumentation import get_metrics
+from .standoff import StandoffLine
+from . import xml_backend
+
+TEI_NS = "http://www.tei-c.org/ns/1.0"
+XML_NS = "http://www.w3.org/XML/1998/namespace"
+NS = {'tei': TEI_NS, 'xml': XML_NS}
+
+XML_ID = f'{{{XML_NS}}}id'
+L_TAG = f'{{{TEI_NS}}}l'
+
+# Function to get the tag of a TEI element, 'app' -> '{http://www.tei-c.org/ns/1.0}app'
+def tei_tag(name):
+    return f'{{{TEI_NS}}}{name}'
+
+# Register the XML namespace
+ET.register_namespace('', TEI_NS)
+ET.register_namespace('xml', XML_NS)
+
+# Function to get a tree from either a file path or an already parsed document,
+# so that the processing stages can be chained in memory. Files are parsed with
+# the selected XML backend, see xml_backend.
+def load_tree(tei_file):
+    if hasattr(tei_file, 'getroot'):
+        return tei_file
+    if ET.iselement(tei_file):
+        return xml_backend.element_tree(tei_file)
+    with get_metrics().timer('parse'):
+        return xml_backend.parse(tei_file)
+
+# Function to save a tree, skipped when no output file is given
+def write_tree(tree, output_file):
+    if output_file is not None:
+        with get_metrics().timer('serialize'):
+            xml_backend.write(tree, output_file)
+
+# Function to replace a file at once, so that readers never see it half written;
+# the content is compressed when the file is, see file_io
+def write_atomic(output_file, content):
+    temp_file = output_file + '.tmp'
+    with open(temp_file, 'wb') as file:
+        file.write(compress(content, output_file))
+    os.replace(temp_file, output_file)
+
+# Index of the <l> elements by xml:id, built in a single pass over the tree, so
+# that the injectors can look up a line in constant time instead of searching the
+# whole document for every apparatus entry. As with a search, the first line
+# carrying an xml:id is the one found.
+class LineIndex:
+    def __init__(self, root):
+        self.root = root
+        self.elements = {}
+        for l_element in root.iter(L_TAG):
+            xml_id = l_element.get(XML_ID)
+            if xml_id is not None:
+                self.elements.setdefault(xml_id, l_element)
+
+    def __contains__(self, xml_id):
+        return xml_id in self.elements
+
+    def __len__(self):
+        return len(self.elements)
+
+    def get(self, xml_id):
+        return self.elements.get(xml_id)
+
+
+def build_line_index(root):
+    return LineIndex(root)
+
+
+# An apparatus layer: the entries of one apparatus file by line number, and the
+# function adding an entry to the standoff model of its line. The entries of some
+# layers depend on the ones before them in the file (the notes are numbered as
+# they are placed); such a layer has a prepare function, to be called with
+# line_text(tei_line_id), the base text of a line or None when it is not in the
+# document, before its entries are applied in another order than theirs.
+class ApparatusLayer:
+    def __init__(self, entries, annotate, missing_message, prepare=None):
+        self.entries = entries
+        self.annotate = annotate
+        self.missing_message = missing_message
+        self._prepare = prepare
+        self.prepared = prepare is None
+
+    def prepare(self, line_text):
+        if self._prepare is not None:
+            self._prepare(line_text)
+        self.prepared = True
+
+    def apply(self, line, tei_line_id, entry):
+        self.annotate(line, tei_line_id, entry)
+
+    def missing(self, tei_line_id):
+        get_metrics().warn(self.missing_message.format(tei_line_id), 'missing_line_ids')
+
+# Function to apply apparatus layers to a parsed tree, one layer after the other.
+# The layers add their markup to the standoff model of each line, and every line
+# is rendered back to TEI once, after the last layer. The lines can also be looked
+# up in a line_index given instead of the tree, as for sharded editions.
+def apply_layers(tree, layers, line_index=None):
+    metrics = get_metrics()
+    if line_index is None:
+        with metrics.timer('index'):
+            line_index = build_line_index(tree.getroot())
+    lines = {}
+
+    for layer in layers:
+        for line_id, entry in layer.entries.items():
+            tei_line_id = f"L{line_id}"
+            line = lines.get(tei_line_id)
+            if line is None:
+                l_element = line_index.get(tei_line_id)
+                if l_element is None:
+                    layer.missing(tei_line_id)
+                    continue
+                line = lines[tei_line_id] = StandoffLine(l_element)
+            layer.apply(line, tei_line_id, entry)
+
+    for line in lines.values():
+        line.render()
+    metrics.count('lines_touched', len(lines))
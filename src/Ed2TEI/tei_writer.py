@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import re
+import xml.etree.ElementTree as ET
+
+from .instrumentation import get_metrics
+from .serializer import XML_DECLARATION, escape_attribute, escape_text, tostring
+from .standoff import element_text
+from .tei_document import TEI_NS
+
+# Writer of the TEI documents made from the line records of the text (see
+# process_text.group_lines), without building any tree. Every element is written
+# as ElementTree writes it, with the header, page breaks and blocks one per line,
+# so that the TEI of create_tei, of the builds in memory and of the streaming
+# builds are byte-identical, and a change of the text only changes its lines.
+
+TEI_HEADER = (
+    XML_DECLARATION +
+    '<TEI xmlns="http://www.tei-c.org/ns/1.0">\n'
+    '<teiHeader>\n'
+    '  <fileDesc>\n'
+    '    <titleStmt>\n'
+    '      <title />\n'
+    '    </titleStmt>\n'
+    '    <publicationStmt><p /></publicationStmt>\n'
+    '    <sourceDesc><p /></sourceDesc>\n'
+    '  </fileDesc>\n'
+    '</teiHeader>\n'
+    '  <text>\n'
+    '    <body>\n'
+    '    <div>\n'
+)
+
+TEI_FOOTER = (
+    '    </div>\n'
+    '    </body>\n'
+    '  </text>\n'
+    '</TEI>'
+)
+
+# Size of the buffer of the output file
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+# Number of XML chunks joined into a single write on the output stream
+WRITE_BATCH_SIZE = 512
+
+LINE_INDENT = '      '
+
+# Characters of a line that cannot be written as they are: '&' outside an entity
+# or character reference, '<' that does not open a tag
+BAD_AMPERSAND = re.compile(r'&(?!(?:amp|lt|gt|quot|apos|#\d+|#x[0-9a-fA-F]+);)')
+BAD_LESS_THAN = re.compile(r'<(?![A-Za-z/!?])')
+
+def _parse_line(line_content):
+    return ET.fromstring(f'<l xmlns="{TEI_NS}">{line_content}</l>')
+
+def _is_plain(line_content):
+    return '<' not in line_content and '>' not in line_content and '&' not in line_content
+
+# Function to parse the content of a line into an <l> element. In a line that is
+# not well-formed, the stray '&' and '<' are escaped. Returns (element, error), the
+# element being None when the line can only be written as text.
+def _line_element(line_content):
+    try:
+        return _parse_line(line_content), None
+    except ET.ParseError as error:
+        escaped = BAD_LESS_THAN.sub('&lt;', BAD_AMPERSAND.sub('&amp;', line_content))
+        try:
+            return _parse_line(escaped), error
+        except ET.ParseError:
+            return None, error
+
+# Function to write the content of a line as ElementTree would: a line holding
+# markup or entities is parsed and written again. In a line that is not well-formed,
+# the stray '&' and '<' are escaped, and when that is not enough, the whole line
+# is written as text, so that the TEI is always well-formed.
+def line_markup(line_id, line_content):
+    if _is_plain(line_content):
+        return line_content
+    l_element, error = _line_element(line_content)
+    if error is not None:
+        get_metrics().warn(f"Line {line_id} is not well-formed XML ({error}), its special characters are escaped.", 'invalid_text')
+    if l_element is None:
+        return escape_text(line_content)
+    parts = [escape_text(l_element.text or '')]
+    for child in l_element:
+        parts.append(tostring(child, with_tail=True))
+    return ''.join(parts)
+
+# Function to get the base text of a line of the text, as the apparatus layers
+# find it in its <l> element, see standoff.element_text
+def line_text(line_content):
+    if _is_plain(line_content):
+        return line_content
+    l_element, _ = _line_element(line_content)
+    return line_content if l_element is None else element_text(l_element)
+
+# Function to get the base text of the lines of line records whose ID is in
+# line_ids: {tei_line_id: text}
+def record_line_texts(records, line_ids):
+    return {record[1]: line_text(record[3]) for record in records if record[0] == 'l' and record[1] in line_ids}
+
+def format_line(line_id, n, line_content):
+    line_content = line_markup(line_id, line_content)
+    if n is not None:
+        return f'{LINE_INDENT}<l n="{n}" xml:id="{line_id}">{line_content}</l>\n'
+    return f'{LINE_INDENT}<l xml:id="{line_id}">{line_content}</l>\n'
+
+def format_page_break(ed, n):
+    return f'    <pb ed="{ed}" n="{escape_attribute(n)}" />\n'
+
+# Function to write the records as a TEI document, header and footer included;
+# the lines are written by write_line(line_id, n, line_content)
+def emit_xml(records, write_line=format_line):
+    yield TEI_HEADER
+    for record in records:
+        kind = record[0]
+        if kind == 'l':
+            yield write_line(*record[1:])
+        elif kind == 'pb':
+            yield format_page_break('base', record[1])
+        elif kind == 'folio':
+            yield format_page_break('folio', record[1])
+        elif kind == 'open':
+            _, tag, number = record
+            if number is not None:
+                yield f'    <{tag} n="{escape_attribute(str(number))}">\n'
+            else:
+                yield f'    <{tag}>\n'
+        elif kind == 'close':
+            yield f'    </{record[1]}>\n'
+    yield TEI_FOOTER
+
+# Function to write the chunks in batches rather than one small write per chunk
+def write_batched(chunks, outfile, batch_size=WRITE_BATCH_SIZE):
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            outfile.write(''.join(batch))
+            batch.clear()
+    if batch:
+        outfile.write(''.join(batch))
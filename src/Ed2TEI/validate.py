@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+import json
+import re
+from xml.sax.saxutils import unescape
+
+from .apparatus_tokenizer import APPARATUS_KINDS, JOINED_KINDS, format_position, iter_records
+from .file_io import open_text
+from .instrumentation import get_metrics
+from .lemma_locator import find_occurrences, locate_lemmas, split_occurrence
+from .process_text import iter_line_records
+from .tei_writer import BAD_AMPERSAND, BAD_LESS_THAN
+
+# Validation of an edition without building it: the apparatus files are checked
+# against the text in one pass over the lines of the text, with the same rules
+# as the injectors but without any XML. Every issue is reported with its position,
+# file:line:column, as an error (the entry would be skipped) or a warning (the
+# entry or the text is used, but probably not as intended).
+
+ERROR = 'error'
+WARNING = 'warning'
+
+# Markup in the lines of the text, which has no base text
+TAG = re.compile(r'<[^>]*>')
+
+class ValidationReport:
+    def __init__(self):
+        self.issues = []
+        self.counts = {ERROR: 0, WARNING: 0}
+        self.summary = {'lines': 0, 'lines_with_apparatus': 0}
+
+    # Function to record an issue at position (file, line, column); it is printed
+    # and counted like the warnings of the other commands
+    def add(self, severity, code, position, message):
+        location = format_position(*position)
+        self.issues.append({'severity': severity, 'code': code, 'location': location, 'message': message})
+        self.counts[severity] += 1
+        get_metrics().warn(f"{location}: {severity}: {message}", code)
+
+    def error(self, code, position, message):
+        self.add(ERROR, code, position, message)
+
+    def warning(self, code, position, message):
+        self.add(WARNING, code, position, message)
+
+    @property
+    def errors(self):
+        return self.counts[ERROR]
+
+    @property
+    def warnings(self):
+        return self.counts[WARNING]
+
+    def to_dict(self):
+        return {'errors': self.errors, 'warnings': self.warnings, 'summary': self.summary, 'issues': self.issues}
+
+    def write(self, output_file):
+        with open(output_file, 'w', encoding='utf-8') as file:
+            json.dump(self.to_dict(), file, ensure_ascii=False, indent=2)
+
+# Function to get the base text of a line of the text, as the injectors see it
+def base_text(line_content):
+    if '<' in line_content:
+        line_content = TAG.sub('', line_content)
+    if '&' in line_content:
+        line_content = unescape(line_content, {'&quot;': '"', '&apos;': "'"})
+    return line_content
+
+# Function to read the records of an apparatus file grouped by line ID. For the
+# kinds whose entries are not joined, the last line of the file given for a line
+# ID replaces the earlier ones, as when the edition is built.
+def _read_records(file_path, kind, report):
+    def malformed(position, message):
+        report.error('malformed_entries', position, message)
+
+    records = {}
+    for record in iter_records(file_path, kind, malformed):
+        line_records = records.get(record.line_id)
+        if line_records and kind not in JOINED_KINDS and line_records[0].position[1] != record.position[1]:
+            report.warning('overridden_entries', line_records[0].position,
+                           f"entry for line {record.line_id} replaced by the one at {record.location()}")
+            line_records = None
+        if line_records is None:
+            records[record.line_id] = [record]
+        else:
+            line_records.append(record)
+    return records
+
+# Function to tell whether a lemma that could not be placed is in the line all the
+# same, before or inside the lemma placed before it
+def _found_elsewhere(text, lemma):
+    lemma_text, occurrence = split_occurrence(lemma)
+    positions = find_occurrences(text, [lemma_text])[lemma_text] if lemma_text else [0]
+    return len(positions) >= (occurrence or 1)
+
+def _crosses(spans, start, end):
+    for span_start, span_end in spans:
+        if span_start < start < span_end < end or start < span_start < end < span_end:
+            return True
+    return False
+
+# Function to check the apparatus of one line, given its base text
+def _check_line(report, line_id, text, entries):
+    tei_line_id = f"L{line_id}"
+    spans = []
+
+    variants = entries.get('variants')
+    if variants:
+        # The lemmas are placed as by add_variants: each lemma once, in text order
+        lemmas = {}
+        for record in variants:
+            lemmas.setdefault(record.lemma, record)
+            if not record.readings:
+                report.warning('empty_readings', record.position, f"no reading for the lemma '{record.lemma}' in line {tei_line_id}")
+            if not record.witnesses:
+                report.warning('missing_witnesses', record.position, f"no [witnesses] for the reading of '{record.lemma}' in line {tei_line_id}")
+        for lemma, start, end in locate_lemmas(text, list(lemmas), in_text_order=True):
+            if start is None:
+                if _found_elsewhere(text, lemma):
+                    report.error('lemmas_not_found', lemmas[lemma].position, f"lemma '{lemma}' only found before or inside the lemma of another variant in line {tei_line_id}")
+                else:
+                    report.error('lemmas_not_found', lemmas[lemma].position, f"lemma '{lemma}' not found in line {tei_line_id}")
+            else:
+                spans.append((start, end))
+
+    rejected = entries.get('rejected')
+    if rejected:
+        # The corrected texts are placed one after the other, in the order of the file
+        located = locate_lemmas(text, [record.lemma for record in rejected])
+        for record, (corr_text, start, end) in zip(rejected, located):
+            if start is None:
+                if _found_elsewhere(text, corr_text):
+                    report.error('misordered_rejected', record.position, f"corrected text '{corr_text}' comes before the one of an earlier rejected reading in line {tei_line_id}")
+                else:
+                    report.error('lemmas_not_found', record.position, f"corrected text '{corr_text}' not found in line {tei_line_id}")
+            elif _crosses(spans, start, end):
+                report.error('overlapping_lemmas', record.position, f"corrected text '{corr_text}' overlaps a variant lemma in line {tei_line_id}")
+
+    notes = entries.get('notes')
+    if notes:
+        for record in notes:
+            if locate_lemmas(text, [record.lemma])[0][1] is None:
+                report.error('lemmas_not_found', record.position, f"location text '{record.lemma}' not found in line {tei_line_id}")
+
+# The lines of the text file, counted as they are read
+class _LineCounter:
+    def __init__(self, infile):
+        self.infile = infile
+        self.number = 0
+        self.line = ''
+
+    def __iter__(self):
+        for line in self.infile:
+            self.number += 1
+            self.line = line
+            yield line
+
+# Function to validate an edition: its text file and the apparatus files given
+# as {'variants': ..., 'rejected': ..., 'notes': ...}. Returns a ValidationReport.
+def validate_edition(text_file, apparatus_files):
+    report = ValidationReport()
+    metrics = get_metrics()
+    records = {}
+    with metrics.timer('parse'):
+        for kind in APPARATUS_KINDS:
+            file_path = apparatus_files.get(kind)
+            if not file_path:
+                continue
+            try:
+                records[kind] = _read_records(file_path, kind, report)
+            except FileNotFoundError:
+                report.error('missing_files', (file_path, 0, 0), f"{kind} file not found")
+            except UnicodeDecodeError as error:
+                report.error('malformed_entries', (file_path, 0, 0), f"not encoded in UTF-8: {error}")
+            else:
+                report.summary[f'{kind}_lines'] = len(records[kind])
+
+    with metrics.timer('match'), open_text(text_file) as infile:
+        lines = _LineCounter(infile)
+        for record in iter_line_records(lines):
+            if record[0] != 'l':
+                continue
+            _, tei_line_id, _, content = record
+            report.summary['lines'] += 1
+            position = (text_file, lines.number, max(lines.line.find(content), 0) + 1)
+            for pattern, character in ((BAD_AMPERSAND, '&'), (BAD_LESS_THAN, '<')):
+                match = pattern.search(content)
+                if match:
+                    report.warning('invalid_text', (text_file, lines.number, position[2] + match.start()),
+                                   f"unescaped '{character}' in line {tei_line_id}, it will be written as text")
+
+            line_id = tei_line_id[1:]
+            entries = {kind: kind_records.pop(line_id) for kind, kind_records in records.items() if line_id in kind_records}
+            if entries:
+                report.summary['lines_with_apparatus'] += 1
+                _check_line(report, line_id, base_text(content), entries)
+
+    # The entries left point at lines that are not in the text
+    for kind, kind_records in records.items():
+        for line_id, line_records in kind_records.items():
+            report.error('missing_line_ids', line_records[0].position, f"line L{line_id} of the {kind} file is not in the text")
+    return report
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+
+from .process_text import iter_line_records, tei_tree_from_records
+from .add_variants import variants_layer
+from .add_rejected import rejected_layer
+from .add_notes import notes_layer
+from .apparatus_loader import APPARATUS_READERS
+from .apparatus_tokenizer import APPARATUS_KINDS
+from .file_io import open_text, read_bytes
+from .incremental import L_ELEMENT, record_note_numbers, render_line
+from .instrumentation import get_metrics
+from .tei_document import apply_layers, write_atomic, write_tree
+
+# Watch mode: the edition is built once and kept in memory, as the line records
+# of the text, the parsed apparatus and the output split into its <l> elements
+# and the text between them. The source files are polled; when one of them is
+# saved, only the lines whose text or apparatus changed are rendered again and
+# the output is rewritten atomically from the pieces kept in memory. A change of
+# the line numbering or of the structure (pages, paragraphs, stanzas) rebuilds
+# the whole edition.
+
+DEFAULT_INTERVAL = 0.05
+
+# Function to get what tells whether a file changed, None when it does not exist
+def _file_state(file_path):
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+# Everything in the line records but the content of the lines
+def _structure(records):
+    return [record[:3] if record[0] == 'l' else record for record in records]
+
+class EditionWatcher:
+    def __init__(self, text_file, output_file, variants_file=None, rejected_file=None, notes_file=None, **tei_options):
+        self.files = {'text': text_file, 'variants': variants_file, 'rejected': rejected_file, 'notes': notes_file}
+        self.output_file = output_file
+        self.tei_options = tei_options
+        self.states = {}
+        self.records = []
+        self.lines = {}
+        self.apparatus = {kind: {} for kind in APPARATUS_KINDS}
+        # The output, and the index in it of the piece holding each <l>
+        self.pieces = []
+        self.positions = {}
+        # Note number of each line, see add_notes.number_notes
+        self.note_numbers = {}
+
+    # Function to read one of the files, the text as line records and the apparatus
+    # as parsed entries
+    def _read(self, kind):
+        file_path = self.files[kind]
+        self.states[kind] = _file_state(file_path)
+        if kind == 'text':
+            with get_metrics().timer('convert'), open_text(file_path) as infile:
+                return list(iter_line_records(infile, **self.tei_options))
+
+        read_file = APPARATUS_READERS[kind][0]
+        with get_metrics().timer('parse'):
+            return read_file(file_path)
+
+    # Function to list the files that changed since they were last read
+    def poll(self):
+        return [
+            kind for kind, file_path in self.files.items()
+            if file_path and _file_state(file_path) != self.states.get(kind)
+        ]
+
+    def build(self):
+        records = self._read('text')
+        apparatus = {kind: self._read(kind) if self.files[kind] else {} for kind in APPARATUS_KINDS}
+        self._full_build(records, apparatus)
+        get_metrics().info(f"Successfully created TEI file: {self.output_file}")
+
+    # Function to build the whole edition from the records and apparatus given,
+    # and to keep the output in memory
+    def _full_build(self, records, apparatus):
+        tree = tei_tree_from_records(records)
+        apply_layers(tree, [variants_layer(apparatus['variants']), rejected_layer(apparatus['rejected']), notes_layer(apparatus['notes'])])
+
+        temp_file = self.output_file + '.tmp'
+        write_tree(tree, temp_file)
+        output = read_bytes(temp_file).decode('utf-8')
+        os.replace(temp_file, self.output_file)
+
+        pieces = []
+        positions = {}
+        last_end = 0
+        for match in L_ELEMENT.finditer(output):
+            pieces.append(output[last_end:match.start()])
+            positions[match.group(1)] = len(pieces)
+            pieces.append(match.group(0))
+            last_end = match.end()
+        pieces.append(output[last_end:])
+
+        self.records = records
+        self.lines = {record[1]: record for record in records if record[0] == 'l'}
+        self.apparatus = apparatus
+        self.pieces = pieces
+        self.positions = positions
+        self.note_numbers = record_note_numbers(records, apparatus['notes'])
+
+    # Function to bring the output up to date after the given files changed.
+    # Returns the set of line IDs that were rendered again, or None after a full build.
+    def update(self, kinds):
+        metrics = get_metrics()
+        start = time.perf_counter()
+
+        records, lines = self.records, self.lines
+        changed = set()
+        if 'text' in kinds:
+            records = self._read('text')
+            lines = {record[1]: record for record in records if record[0] == 'l'}
+            if _structure(records) != _structure(self.records):
+                apparatus = {kind: self._read(kind) if kind in kinds else self.apparatus[kind] for kind in APPARATUS_KINDS}
+                metrics.info(f"Full rebuild of {self.output_file}: the line numbering or structure changed")
+                self._full_build(records, apparatus)
+                metrics.info(f"Successfully created TEI file: {self.output_file} ({time.perf_counter() - start:.3f} s)")
+                return None
+            changed = {line_id for line_id, record in lines.items() if record[3] != self.lines[line_id][3]}
+
+        apparatus = dict(self.apparatus)
+        for kind in APPARATUS_KINDS:
+            if kind in kinds:
+                entries = self._read(kind)
+                previous = self.apparatus[kind]
+                for key in entries.keys() | previous.keys():
+                    if entries.get(key) != previous.get(key):
+                        line_id = f"L{key}"
+                        if line_id in lines:
+                            changed.add(line_id)
+                        elif key in entries:
+                            metrics.warn(f"Line ID {line_id} not found in the TEI file. Skipping {kind} entry...", 'missing_line_ids')
+                apparatus[kind] = entries
+
+        # The lines whose note is numbered anew are rendered again with the others;
+        # a note can be placed or not after a change of the text as of the notes
+        note_numbers = record_note_numbers(records, apparatus['notes'])
+        for line_id in note_numbers.keys() | self.note_numbers.keys():
+            if line_id in lines and note_numbers.get(line_id) != self.note_numbers.get(line_id):
+                changed.add(line_id)
+        rendered = {line_id: render_line(lines[line_id], apparatus, note_numbers.get(line_id, 0)) for line_id in changed}
+
+        pieces = list(self.pieces)
+        for line_id, text in rendered.items():
+            pieces[self.positions[line_id]] = text
+        if rendered:
+            with metrics.timer('serialize'):
+                write_atomic(self.output_file, ''.join(pieces).encode('utf-8'))
+
+        self.records, self.lines, self.apparatus = records, lines, apparatus
+        self.pieces, self.note_numbers = pieces, note_numbers
+
+        metrics.count('lines_touched', len(rendered))
+        if rendered:
+            metrics.info(f"Updated {len(rendered)} line(s) in TEI file: {self.output_file} ({(time.perf_counter() - start) * 1000:.0f} ms)")
+        return set(rendered)
+
+    # Function to build the edition and keep it up to date until interrupted, or
+    # until max_updates updates were made. A file that cannot be processed is
+    # reported and the previous output is kept until it is saved again.
+    def watch(self, interval=DEFAULT_INTERVAL, max_updates=None):
+        self.build()
+        updates = 0
+        while max_updates is None or updates < max_updates:
+            kinds = self.poll()
+            if kinds:
+                updates += 1
+                try:
+                    self.update(kinds)
+                except Exception as error:
+                    get_metrics().warn(f"Could not update {self.output_file}: {error}", 'update_errors')
+            else:
+                time.sleep(interval)
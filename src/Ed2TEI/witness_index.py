@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+import xml.etree.ElementTree as ET
+
+from .file_io import open_binary
+from .instrumentation import get_metrics
+from .shards import is_sharded, read_index
+from .standoff import element_text
+from .tei_document import L_TAG, TEI_NS, XML_ID
+
+# Inverted index of the apparatus of an edition: for every witness the readings
+# it attests, for every lemma the lines where it has variants, and for every line
+# its <app> elements. It is built from the tree while the apparatus is added, or
+# from a TEI file without loading it whole, and exported to a SQLite database,
+# which answers the collation queries without going through the TEI again:
+#
+#   lines (line_id, n, page, position)       the lines with an apparatus
+#   apps (app_id, line_id, lemma)            app_id in document order
+#   readings (reading_id, app_id, reading)
+#   witnesses (witness, reading_id)          the witnesses of each reading
+
+INDEX_VERSION = 1
+
+PB_TAG = f'{{{TEI_NS}}}pb'
+APP_TAG = f'{{{TEI_NS}}}app'
+LEM_TAG = f'{{{TEI_NS}}}lem'
+RDG_TAG = f'{{{TEI_NS}}}rdg'
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE lines (line_id TEXT PRIMARY KEY, n TEXT, page TEXT, position INTEGER NOT NULL);
+CREATE TABLE apps (app_id INTEGER PRIMARY KEY, line_id TEXT NOT NULL, lemma TEXT NOT NULL);
+CREATE TABLE readings (reading_id INTEGER PRIMARY KEY, app_id INTEGER NOT NULL, reading TEXT NOT NULL);
+CREATE TABLE witnesses (witness TEXT NOT NULL, reading_id INTEGER NOT NULL, PRIMARY KEY (witness, reading_id)) WITHOUT ROWID;
+CREATE INDEX apps_line ON apps (line_id);
+CREATE INDEX apps_lemma ON apps (lemma);
+CREATE INDEX readings_app ON readings (app_id);
+CREATE INDEX witnesses_reading ON witnesses (reading_id);
+"""
+
+# Function to get the witnesses of a <rdg>, '#C #P' -> ['C', 'P']
+def reading_witnesses(rdg_element):
+    return [witness.lstrip('#') for witness in (rdg_element.get('wit') or '').split()]
+
+class WitnessIndex:
+    def __init__(self):
+        # line_id -> (n, page) of the lines with an apparatus, in document order
+        self.lines = {}
+        # (line_id, lemma, [(reading, [witnesses])]), numbered in document order
+        self.apps = []
+        # The inverted index: witness -> [(app number, reading number)],
+        # lemma -> [line_id], line_id -> [app number]
+        self.by_witness = {}
+        self.by_lemma = {}
+        self.by_line = {}
+
+    def add_app(self, line_id, lemma, readings):
+        number = len(self.apps)
+        self.apps.append((line_id, lemma, readings))
+        self.by_line.setdefault(line_id, []).append(number)
+        line_ids = self.by_lemma.setdefault(lemma, [])
+        if not line_ids or line_ids[-1] != line_id:
+            line_ids.append(line_id)
+        for reading_number, (_, witnesses) in enumerate(readings):
+            for witness in witnesses:
+                self.by_witness.setdefault(witness, []).append((number, reading_number))
+
+    # Function to index the <app> elements of an <l> element, on page page
+    def add_line(self, l_element, page=None):
+        line_id = l_element.get(XML_ID)
+        apps = list(l_element.iter(APP_TAG))
+        if line_id is None or not apps:
+            return
+        self.lines[line_id] = (l_element.get('n'), page)
+        for app in apps:
+            lemma = ''
+            readings = []
+            for child in app:
+                if child.tag == LEM_TAG:
+                    lemma = element_text(child)
+                elif child.tag == RDG_TAG:
+                    readings.append((element_text(child), reading_witnesses(child)))
+            self.add_app(line_id, lemma, readings)
+
+    # Function to index the lines of a tree, or of an element holding some of them
+    def add_tree(self, root, page=None):
+        for element in root.iter():
+            if element.tag == PB_TAG and element.get('ed') == 'base':
+                page = element.get('n')
+            elif element.tag == L_TAG:
+                self.add_line(element, page)
+        return page
+
+    # Function to index a TEI file, read one line at a time; a page break inside a
+    # line only counts from the next line on. The elements are dropped once read,
+    # so the memory used does not grow with the file.
+    def add_file(self, tei_file, page=None):
+        stack = []
+        depth = 0
+        with open_binary(tei_file) as file:
+            for event, element in ET.iterparse(file, events=('start', 'end')):
+                if event == 'start':
+                    if element.tag == L_TAG:
+                        if not depth:
+                            line_page = page
+                        depth += 1
+                    stack.append(element)
+                    continue
+                stack.pop()
+                if element.tag == L_TAG:
+                    depth -= 1
+                    if not depth:
+                        self.add_line(element, line_page)
+                elif element.tag == PB_TAG and element.get('ed') == 'base':
+                    page = element.get('n')
+                # The elements inside a line are kept until the whole line is read
+                if stack and not depth:
+                    stack[-1].remove(element)
+        return page
+
+    @classmethod
+    def from_tree(cls, tree):
+        index = cls()
+        index.add_tree(tree.getroot() if hasattr(tree, 'getroot') else tree)
+        return index
+
+    # Function to index a TEI file, or the shards of a sharded edition in order
+    @classmethod
+    def from_file(cls, tei_file):
+        index = cls()
+        if is_sharded(tei_file):
+            page = None
+            for shard in read_index(tei_file)['shards']:
+                page = index.add_file(os.path.join(os.path.dirname(tei_file), shard['file']), page)
+        else:
+            index.add_file(tei_file)
+        return index
+
+    # The queries, answered from the inverted index
+
+    def witnesses(self):
+        return sorted((witness, len(readings)) for witness, readings in self.by_witness.items())
+
+    # Function to get the readings of a witness as (line_id, lemma, reading)
+    def readings_of(self, witness):
+        return [
+            (self.apps[number][0], self.apps[number][1], self.apps[number][2][reading_number][0])
+            for number, reading_number in self.by_witness.get(witness, [])
+        ]
+
+    def lines_of(self, lemma):
+        return list(self.by_lemma.get(lemma, []))
+
+    # Function to get the apparatus of a line as (lemma, [(reading, [witnesses])])
+    def apps_of(self, line_id):
+        return [self.apps[number][1:] for number in self.by_line.get(line_id, [])]
+
+    # Function to get the readings attested by all the witnesses given together,
+    # as (line_id, lemma, reading)
+    def agreements(self, witnesses):
+        shared = None
+        for witness in witnesses:
+            readings = set(self.by_witness.get(witness, []))
+            shared = readings if shared is None else shared & readings
+        return [
+            (self.apps[number][0], self.apps[number][1], self.apps[number][2][reading_number][0])
+            for number, reading_number in sorted(shared or ())
+        ]
+
+    # Function to write the index to a SQLite database, replacing it at once
+    def save(self, db_file, source=None):
+        temp_file = db_file + '.tmp'
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        connection = sqlite3.connect(temp_file)
+        try:
+            # Written in one transaction to a new file: no journal is needed
+            connection.execute('PRAGMA journal_mode = OFF')
+            connection.execute('PRAGMA synchronous = OFF')
+            connection.executescript(SCHEMA)
+            with connection:
+                connection.executemany('INSERT INTO meta VALUES (?, ?)', [('version', str(INDEX_VERSION)), ('source', source or '')])
+                connection.executemany(
+                    'INSERT INTO lines VALUES (?, ?, ?, ?)',
+                    ((line_id, n, page, position) for position, (line_id, (n, page)) in enumerate(self.lines.items()))
+                )
+                connection.executemany('INSERT INTO apps VALUES (?, ?, ?)', ((number, line_id, lemma) for number, (line_id, lemma, _) in enumerate(self.apps)))
+                readings = []
+                witnesses = []
+                for number, (_, _, app_readings) in enumerate(self.apps):
+                    for reading, reading_witnesses in app_readings:
+                        reading_id = len(readings)
+                        readings.append((reading_id, number, reading))
+                        witnesses.extend((witness, reading_id) for witness in set(reading_witnesses))
+                connection.executemany('INSERT INTO readings VALUES (?, ?, ?)', readings)
+                connection.executemany('INSERT INTO witnesses VALUES (?, ?)', witnesses)
+            connection.execute('ANALYZE')
+        finally:
+            connection.close()
+        os.replace(temp_file, db_file)
+        get_metrics().count('apps_indexed', len(self.apps))
+
+# The queries of WitnessIndex, answered from a database written by WitnessIndex.save
+class WitnessDatabase:
+    def __init__(self, db_file):
+        if not os.path.isfile(db_file):
+            raise FileNotFoundError(f"Witness database not found: {db_file}")
+        self.connection = sqlite3.connect(f'file:{db_file}?mode=ro', uri=True)
+        version = self.connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if version is None or version[0] != str(INDEX_VERSION):
+            self.connection.close()
+            raise ValueError(f"The witness database {db_file} has an unsupported version")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def witnesses(self):
+        return self.connection.execute('SELECT witness, COUNT(*) FROM witnesses GROUP BY witness ORDER BY witness').fetchall()
+
+    def readings_of(self, witness):
+        return self.connection.execute(
+            'SELECT apps.line_id, apps.lemma, readings.reading FROM witnesses'
+            ' JOIN readings ON readings.reading_id = witnesses.reading_id'
+            ' JOIN apps ON apps.app_id = readings.app_id'
+            ' WHERE witnesses.witness = ? ORDER BY readings.reading_id',
+            (witness,)
+        ).fetchall()
+
+    def lines_of(self, lemma):
+        rows = self.connection.execute(
+            'SELECT apps.line_id FROM apps JOIN lines ON lines.line_id = apps.line_id'
+            ' WHERE apps.lemma = ? GROUP BY apps.line_id ORDER BY MIN(lines.position)',
+            (lemma,)
+        )
+        return [line_id for line_id, in rows]
+
+    def apps_of(self, line_id):
+        apps = {}
+        rows = self.connection.execute(
+            'SELECT apps.app_id, apps.lemma, readings.reading_id, readings.reading, witnesses.witness FROM apps'
+            ' LEFT JOIN readings ON readings.app_id = apps.app_id'
+            ' LEFT JOIN witnesses ON witnesses.reading_id = readings.reading_id'
+            ' WHERE apps.line_id = ? ORDER BY apps.app_id, readings.reading_id, witnesses.witness',
+            (line_id,)
+        )
+        for app_id, lemma, reading_id, reading, witness in rows:
+            readings = apps.setdefault(app_id, (lemma, {}))[1]
+            if reading_id is not None:
+                witnesses = readings.setdefault(reading_id, (reading, []))[1]
+                if witness is not None:
+                    witnesses.append(witness)
+        return [(lemma, list(readings.values())) for lemma, readings in apps.values()]
+
+    def agreements(self, witnesses):
+        witnesses = sorted(set(witnesses))
+        if not witnesses:
+            return []
+        return self.connection.execute(
+            'SELECT apps.line_id, apps.lemma, readings.reading FROM readings'
+            ' JOIN apps ON apps.app_id = readings.app_id'
+            ' WHERE readings.reading_id IN (SELECT reading_id FROM witnesses'
+            f' WHERE witness IN ({", ".join("?" * len(witnesses))}) GROUP BY reading_id HAVING COUNT(*) = ?)'
+            ' ORDER BY readings.reading_id',
+            (*witnesses, len(witnesses))
+        ).fetchall()
+
+# Function to index the apparatus of a TEI file, or of a tree, into db_file
+def index_witnesses(tei_file, db_file):
+    metrics = get_metrics()
+    with metrics.timer('index'):
+        if isinstance(tei_file, str):
+            index = WitnessIndex.from_file(tei_file)
+        else:
+            index = WitnessIndex.from_tree(tei_file)
+        index.save(db_file, tei_file if isinstance(tei_file, str) else None)
+    metrics.info(f"Indexed {len(index.apps)} variant(s) of {len(index.lines)} line(s) in {db_file}")
+    return index
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import importlib.util
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+from .file_io import is_compressed, open_binary, open_text
+
+# XML backend used to parse the TEI documents: ElementTree from the standard
+# library, or lxml when it is installed, whose parser is faster. The backend is
+# chosen with the ED2TEI_XML_BACKEND environment variable or the --xml_backend
+# option: 'auto' (lxml when installed), 'etree' or 'lxml'.
+# Whatever the backend, the documents are written in the format of
+# ElementTree.write, so both give byte-identical files.
+
+XML_BACKEND_ENV = 'ED2TEI_XML_BACKEND'
+BACKENDS = ('auto', 'etree', 'lxml')
+
+_backend = None
+
+# lxml is optional, and only imported once a document is parsed with it
+def lxml_installed():
+    return importlib.util.find_spec('lxml') is not None
+
+def _lxml():
+    from lxml import etree
+    return etree
+
+def available_backends():
+    return ['etree', 'lxml'] if lxml_installed() else ['etree']
+
+# Function to choose the backend, returns the name of the backend in use
+def set_backend(name):
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown XML backend '{name}', expected one of: {', '.join(BACKENDS)}")
+    if name == 'auto':
+        name = 'lxml' if lxml_installed() else 'etree'
+    if name == 'lxml' and not lxml_installed():
+        raise ValueError("The lxml XML backend was requested but lxml is not installed")
+    _backend = name
+    return name
+
+def get_backend():
+    if _backend is None:
+        set_backend(os.environ.get(XML_BACKEND_ENV) or 'auto')
+    return _backend
+
+def is_lxml_element(element):
+    lxml_etree = sys.modules.get('lxml.etree')
+    return lxml_etree is not None and isinstance(element, lxml_etree._Element)
+
+# Function to get a parser for the current backend. Comments and processing
+# instructions are dropped, as ElementTree does.
+def new_parser():
+    if get_backend() == 'lxml':
+        return _lxml().XMLParser(remove_comments=True, remove_pis=True, resolve_entities=False, huge_tree=True)
+    return ET.XMLParser(encoding="utf-8")
+
+# Function to parse a TEI file; a compressed file is decompressed as it is parsed
+def parse(tei_file):
+    if is_compressed(tei_file):
+        with open_binary(tei_file) as file:
+            return parse(file)
+    parser = new_parser()
+    if get_backend() == 'lxml':
+        return _lxml().parse(tei_file, parser)
+    return ET.parse(tei_file, parser=parser)
+
+# Function to parse a document given as chunks of XML text, returns its tree
+def parse_chunks(chunks):
+    parser = new_parser()
+    if get_backend() == 'lxml':
+        # lxml does not accept text with an encoding declaration
+        for chunk in chunks:
+            parser.feed(chunk.encode('utf-8'))
+        return _lxml().ElementTree(parser.close())
+    for chunk in chunks:
+        parser.feed(chunk)
+    return ET.ElementTree(parser.close())
+
+def element_tree(element):
+    if is_lxml_element(element):
+        return _lxml().ElementTree(element)
+    return ET.ElementTree(element)
+
+# Function to write a tree: ElementTree writes its own trees, and the trees of
+# lxml go through the serializer, which writes in the same format
+def write(tree, output_file):
+    root = tree.getroot()
+    if not is_lxml_element(root):
+        if is_compressed(output_file):
+            with open_binary(output_file, 'wb') as file:
+                tree.write(file, encoding='utf-8', xml_declaration=True)
+        else:
+            tree.write(output_file, encoding='utf-8', xml_declaration=True)
+        return
+
+    # Imported here as the serializer itself depends on tei_document
+    from .serializer import XML_DECLARATION, serialize_document
+    from .tei_writer import OUTPUT_BUFFER_SIZE
+    with open_text(output_file, 'w', errors='xmlcharrefreplace', newline='', buffering=OUTPUT_BUFFER_SIZE) as file:
+        file.write(XML_DECLARATION)
+        serialize_document(file.write, root)
+
+# Options of the XML backend shared by the commands
+def add_backend_option(parser):
+    parser.add_argument('--xml_backend', choices=BACKENDS, help=f'XML backend used to parse the TEI (default: ${XML_BACKEND_ENV} or auto, i.e. lxml when installed).')
+
+# Function to apply the --xml_backend option; the worker processes of batch
+# builds get it through the environment
+def select_backend(args):
+    if args.xml_backend:
+        set_backend(args.xml_backend)
+        os.environ[XML_BACKEND_ENV] = args.xml_backend
+    return get_backend()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+
+import pytest
+
+from Ed2TEI import cli, xml_backend
+from Ed2TEI.instrumentation import reset_metrics
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Txt_models')
+VOLUME = 'Joshua_vol1'
+APPARATUS_KINDS = ('variants', 'rejected', 'notes')
+
+# Every test records its own metrics, quietly, and leaves the XML backend as it was
+@pytest.fixture(autouse=True)
+def quiet_metrics(monkeypatch):
+    monkeypatch.delenv(xml_backend.XML_BACKEND_ENV, raising=False)
+    monkeypatch.setattr(xml_backend, '_backend', None)
+    return reset_metrics(quiet=True)
+
+# The model volume copied to a temporary directory: {'text': ..., 'variants': ...,
+# 'rejected': ..., 'notes': ...}
+@pytest.fixture
+def model_files(tmp_path):
+    files = {}
+    for kind in ('text',) + APPARATUS_KINDS:
+        files[kind] = str(tmp_path / f'{VOLUME}_{kind}.txt')
+        shutil.copyfile(os.path.join(MODELS_DIR, f'{VOLUME}_{kind}.txt'), files[kind])
+    return files
+
+# Function to write the files of a small edition, given as {'text': ..., 'notes': ...}
+# contents, and to get their paths
+def write_files(directory, contents):
+    files = {}
+    for kind, content in contents.items():
+        files[kind] = str(directory / f'{kind}.txt')
+        with open(files[kind], 'w', encoding='utf-8') as file:
+            file.write(content)
+    return files
+
+def read(file_path):
+    with open(file_path, 'rb') as file:
+        return file.read()
+
+# Function to run ed2tei with the given arguments, returns its exit status
+def run_cli(*arguments):
+    try:
+        cli.main([str(argument) for argument in arguments] + ['--quiet'])
+    except SystemExit as exit:
+        return exit.code
+    return 0
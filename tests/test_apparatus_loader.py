@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from Ed2TEI import apparatus_loader
+from Ed2TEI.apparatus_loader import parse_apparatus_file
+from Ed2TEI.instrumentation import get_metrics, recorded_warnings
+
+ENTRIES = {
+    'variants': '{n} (lemme{i}) variänte{i} [C,P]',
+    'rejected': '{n} (corr{i}) sic{i}; (autre{i}) autré{i}',
+    'notes': '{n} (lieu{i}) Note numéro {i}.',
+}
+
+# Function to write an apparatus file with CRLF line breaks, line IDs given several
+# times, blank lines and lines that are not entries
+def write_apparatus(file_path, kind):
+    lines = []
+    for i in range(2000):
+        if i % 97 == 0:
+            lines.append('not an entry')
+        elif i % 89 == 0:
+            lines.append('')
+        lines.append(ENTRIES[kind].format(n=i % 700 + 1, i=i))
+    with open(file_path, 'w', encoding='utf-8', newline='') as file:
+        file.write('\r\n'.join(lines) + '\r\n')
+
+@pytest.mark.parametrize('kind', sorted(ENTRIES))
+def test_chunked_parse_matches_serial_parse(tmp_path, monkeypatch, kind):
+    file_path = str(tmp_path / f'{kind}.txt')
+    write_apparatus(file_path, kind)
+    with recorded_warnings() as serial_warnings:
+        serial = parse_apparatus_file(file_path, kind)
+    assert 'parse_chunks' not in get_metrics().counters
+
+    monkeypatch.setattr(apparatus_loader, 'MIN_CHUNK_SIZE', 1000)
+    with recorded_warnings() as chunked_warnings:
+        chunked = parse_apparatus_file(file_path, kind, workers=3, threshold=0)
+    assert get_metrics().counters['parse_chunks'] == 6
+    assert list(chunked.items()) == list(serial.items())
+    assert chunked_warnings == serial_warnings
+    assert len(serial_warnings) == 21
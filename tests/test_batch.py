@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+
+from Ed2TEI.batch import build_volumes, discover_volumes, find_volume_files, read_manifest
+from Ed2TEI.file_io import compress
+from Ed2TEI.instrumentation import get_metrics
+from Ed2TEI.pipeline import build_edition
+
+from .conftest import read, run_cli
+
+def touch(path, content=b''):
+    with open(path, 'wb') as file:
+        file.write(content)
+
+def test_volumes_are_discovered_with_their_files(tmp_path):
+    for name in ('b_text.txt', 'b_notes.txt', 'a_text.txt.gz', 'a_variants.txt.xz', 'c_notes.txt', 'notes.txt', 'a_text.xml'):
+        touch(tmp_path / name)
+    assert discover_volumes(str(tmp_path)) == [str(tmp_path / 'a'), str(tmp_path / 'b')]
+    assert find_volume_files(str(tmp_path / 'a')) == {'text': str(tmp_path / 'a_text.txt.gz'), 'variants': str(tmp_path / 'a_variants.txt.xz')}
+    assert find_volume_files(str(tmp_path / 'b')) == {'text': str(tmp_path / 'b_text.txt'), 'notes': str(tmp_path / 'b_notes.txt')}
+    assert find_volume_files(str(tmp_path / 'c')) == {'notes': str(tmp_path / 'c_notes.txt')}
+
+def test_manifest_lists_volumes_relative_to_it(tmp_path):
+    (tmp_path / 'lists').mkdir()
+    manifest = tmp_path / 'lists' / 'volumes.txt'
+    manifest.write_text('# The first volumes\nJoshua_vol1\n\n  ../Joshua_vol2  \n# Joshua_vol3\n', encoding='utf-8')
+    assert read_manifest(str(manifest)) == [
+        os.path.join(str(tmp_path / 'lists'), 'Joshua_vol1'),
+        os.path.join(str(tmp_path / 'lists'), '../Joshua_vol2'),
+    ]
+
+# A volume that fails is reported without stopping the others
+def test_failing_volume_does_not_stop_the_batch(model_files, tmp_path):
+    volumes_dir = tmp_path / 'volumes'
+    volumes_dir.mkdir()
+    for kind, file_path in model_files.items():
+        shutil.copyfile(file_path, volumes_dir / f'good_{kind}.txt')
+    with open(volumes_dir / 'packed_text.txt.gz', 'wb') as file:
+        file.write(compress(read(model_files['text']), 'packed_text.txt.gz'))
+    touch(volumes_dir / 'broken_text.txt', b'Donavit \xff illi\n')
+
+    volumes = discover_volumes(str(volumes_dir)) + [str(volumes_dir / 'missing')]
+    results = build_volumes(volumes, output_dir=str(tmp_path / 'output'), workers=2)
+    errors = {os.path.basename(volume): error for volume, _, error in results}
+    assert sorted(errors) == ['broken', 'good', 'missing', 'packed']
+    assert errors['good'] is None and errors['packed'] is None
+    assert 'UnicodeDecodeError' in errors['broken']
+    assert 'Text file not found' in errors['missing']
+    assert get_metrics().counters['volumes_built'] == 2
+    assert get_metrics().counters['volumes_failed'] == 2
+
+    build_edition(model_files['text'], str(tmp_path / 'expected.xml'), variants_file=model_files['variants'],
+                  rejected_file=model_files['rejected'], notes_file=model_files['notes'])
+    assert read(tmp_path / 'output' / 'good.xml') == read(tmp_path / 'expected.xml')
+    assert os.path.isfile(tmp_path / 'output' / 'packed.xml')
+    assert not os.path.exists(tmp_path / 'output' / 'broken.xml')
+
+def test_batch_command_fails_when_a_volume_fails(model_files, tmp_path):
+    volumes_dir = tmp_path / 'volumes'
+    volumes_dir.mkdir()
+    shutil.copyfile(model_files['text'], volumes_dir / 'good_text.txt')
+    touch(volumes_dir / 'broken_text.txt', b'\xff\n')
+    assert run_cli('batch', '--dir', volumes_dir, '--workers', 1) == 1
+    assert os.path.isfile(volumes_dir / 'good.xml')
+    manifest = tmp_path / 'volumes.txt'
+    manifest.write_text('volumes/good\n', encoding='utf-8')
+    assert run_cli('batch', '--manifest', manifest, '--output_dir', tmp_path / 'output') == 0
+    assert read(tmp_path / 'output' / 'good.xml') == read(volumes_dir / 'good.xml')
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from Ed2TEI import add_notes, add_rejected, add_variants, create_tei
+from Ed2TEI import xml_backend
+from Ed2TEI.add_notes import read_notes_from_file
+from Ed2TEI.add_rejected import read_rejected_from_file
+from Ed2TEI.add_variants import read_variants_from_file
+from Ed2TEI.instrumentation import get_metrics
+from Ed2TEI.pipeline import build_edition
+from Ed2TEI.process_text import create_tei_tree
+from Ed2TEI.tei_document import NS
+
+from .conftest import read, write_files
+
+BACKENDS = xml_backend.available_backends()
+
+# Function to build an edition with the separate commands, one file per stage
+def build_with_scripts(files, directory):
+    create_tei(files['text'], str(directory / 'text.xml'))
+    add_variants(str(directory / 'text.xml'), read_variants_from_file(files['variants']), str(directory / 'variants.xml'))
+    add_rejected(str(directory / 'variants.xml'), read_rejected_from_file(files['rejected']), str(directory / 'rejected.xml'))
+    add_notes(str(directory / 'rejected.xml'), read_notes_from_file(files['notes']), str(directory / 'notes.xml'))
+    return str(directory / 'notes.xml')
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_build_matches_the_separate_commands(model_files, tmp_path, backend):
+    xml_backend.set_backend(backend)
+    expected = build_with_scripts(model_files, tmp_path)
+    build_edition(model_files['text'], str(tmp_path / 'built.xml'), model_files['variants'], model_files['rejected'], model_files['notes'])
+    assert read(tmp_path / 'built.xml') == read(expected)
+
+def test_backends_write_the_same_files(model_files, tmp_path):
+    if 'lxml' not in BACKENDS:
+        pytest.skip("lxml is not installed")
+    outputs = []
+    for backend in BACKENDS:
+        xml_backend.set_backend(backend)
+        outputs.append(read(build_with_scripts(model_files, tmp_path)))
+    assert outputs[0] == outputs[1]
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_returned_tree_holds_the_apparatus(model_files, backend):
+    xml_backend.set_backend(backend)
+    tree = create_tei_tree(model_files['text'])
+    tree = add_variants(tree, read_variants_from_file(model_files['variants']))
+    tree = add_rejected(tree, read_rejected_from_file(model_files['rejected']))
+    tree = add_notes(tree, read_notes_from_file(model_files['notes']))
+    root = tree.getroot()
+    assert root.find('.//tei:app/tei:lem', NS) is not None
+    assert root.find('.//tei:app/tei:rdg[@wit]', NS) is not None
+    assert root.find('.//tei:choice/tei:sic', NS) is not None
+    assert root.find('.//tei:note[@resp="#EDT"]', NS) is not None
+
+def test_lines_are_counted_once(tmp_path):
+    files = write_files(tmp_path, {
+        'text': 'alpha beta\ngamma delta\nepsilon zeta\n',
+        'variants': '1 (beta) bheta [A]\n2 (gamma) gama [B]\n',
+        'rejected': '1 (alpha) alfa\n',
+        'notes': '1 (beta) First note.\n3 (zeta) Second note.\n',
+    })
+    build_edition(files['text'], str(tmp_path / 'out.xml'), files['variants'], files['rejected'], files['notes'])
+    assert get_metrics().counters['lines_touched'] == 3
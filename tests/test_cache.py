@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+from Ed2TEI import apparatus_cache
+from Ed2TEI.apparatus_cache import CACHE_SUFFIX, clear_cache, evict_cache, load_apparatus
+from Ed2TEI.apparatus_loader import parse_apparatus_file
+from Ed2TEI.instrumentation import get_metrics, recorded_warnings, reset_metrics
+
+from .conftest import run_cli, write_files
+
+VARIANTS = '1 (alpha) alfa [C]\nnot an entry\n2 (gamma) gama [P]\n'
+
+# Function to count the parses of the apparatus files while loading them
+@pytest.fixture
+def parses(monkeypatch):
+    calls = []
+
+    def parse(file_path, kind, workers=None):
+        calls.append(file_path)
+        return parse_apparatus_file(file_path, kind, workers)
+
+    monkeypatch.setattr(apparatus_cache, 'parse_apparatus_file', parse)
+    return calls
+
+def cache_files(cache_dir):
+    return sorted(name for name in os.listdir(cache_dir) if name.endswith(CACHE_SUFFIX)) if os.path.isdir(cache_dir) else []
+
+def test_unchanged_file_is_read_from_the_cache(tmp_path, parses):
+    files = write_files(tmp_path, {'variants': VARIANTS})
+    cache_dir = str(tmp_path / 'cache')
+    parsed = load_apparatus(files['variants'], 'variants', use_cache=True, cache_dir=cache_dir)
+    first_warnings = get_metrics().counters['malformed_entries']
+
+    metrics = reset_metrics(quiet=True)
+    with recorded_warnings() as warnings:
+        assert load_apparatus(files['variants'], 'variants', use_cache=True, cache_dir=cache_dir) == parsed
+    assert len(parses) == 1
+    # The warnings about the file are given again
+    assert metrics.counters['malformed_entries'] == first_warnings == 1
+    assert warnings == [(f"{files['variants']}:2:1: expected a line number followed by an entry, skipping the line", 'malformed_entries')]
+
+def test_changed_file_or_parser_is_parsed_again(tmp_path, parses, monkeypatch):
+    files = write_files(tmp_path, {'variants': VARIANTS})
+    cache_dir = str(tmp_path / 'cache')
+    load_apparatus(files['variants'], 'variants', use_cache=True, cache_dir=cache_dir)
+    with open(files['variants'], 'a', encoding='utf-8') as file:
+        file.write('3 (delta) dela [C]\n')
+    assert '3' in load_apparatus(files['variants'], 'variants', use_cache=True, cache_dir=cache_dir)
+    monkeypatch.setattr(apparatus_cache, 'PARSER_VERSION', apparatus_cache.PARSER_VERSION + 1)
+    load_apparatus(files['variants'], 'variants', use_cache=True, cache_dir=cache_dir)
+    assert len(parses) == 3
+    assert len(cache_files(cache_dir)) == 3
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache_dir = tmp_path / 'cache'
+    cache_dir.mkdir()
+    for age, name in enumerate(['recent', 'old', 'oldest']):
+        path = cache_dir / f'{name}{CACHE_SUFFIX}'
+        path.write_bytes(b'x' * 100)
+        os.utime(path, (1000000 - age * 1000, 1000000 - age * 1000))
+    (cache_dir / 'other.txt').write_bytes(b'x' * 1000)
+    evict_cache(str(cache_dir), max_size=250)
+    assert cache_files(str(cache_dir)) == [f'old{CACHE_SUFFIX}', f'recent{CACHE_SUFFIX}']
+    evict_cache(str(cache_dir), max_size=100)
+    assert cache_files(str(cache_dir)) == [f'recent{CACHE_SUFFIX}']
+    assert (cache_dir / 'other.txt').exists()
+
+def test_clear_cache_removes_every_entry(tmp_path, parses):
+    files = write_files(tmp_path, {'variants': VARIANTS, 'notes': '1 (alpha) A note.\n'})
+    cache_dir = str(tmp_path / 'cache')
+    load_apparatus(files['variants'], 'variants', use_cache=True, cache_dir=cache_dir)
+    load_apparatus(files['notes'], 'notes', use_cache=True, cache_dir=cache_dir)
+    assert clear_cache(cache_dir) == 2
+    assert cache_files(cache_dir) == []
+    load_apparatus(files['notes'], 'notes', use_cache=True, cache_dir=cache_dir)
+    assert len(parses) == 3
+
+# The build only uses the cache when asked to
+def test_build_uses_the_cache_with_the_option(tmp_path, monkeypatch):
+    files = write_files(tmp_path, {'text': 'alpha beta\ngamma\n', 'variants': VARIANTS})
+    cache_dir = str(tmp_path / 'cache')
+    monkeypatch.setenv('ED2TEI_CACHE_DIR', cache_dir)
+    arguments = ['build', '--text', files['text'], '--output', tmp_path / 'edition.xml', '--variants', files['variants']]
+    assert run_cli(*arguments) == 0
+    assert cache_files(cache_dir) == []
+    assert run_cli(*arguments, '--cache') == 0
+    assert len(cache_files(cache_dir)) == 1
+    assert run_cli(*arguments, '--clear_cache') == 0
+    assert cache_files(cache_dir) == []
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from Ed2TEI import add_notes, add_rejected, add_variants, create_tei
+from Ed2TEI.add_notes import read_notes_from_file
+from Ed2TEI.add_rejected import read_rejected_from_file
+from Ed2TEI.add_variants import read_variants_from_file
+from Ed2TEI.file_io import COMPRESSIONS, compress, read_bytes
+from Ed2TEI.pipeline import build_edition
+
+from .conftest import read
+
+SUFFIXES = sorted(COMPRESSIONS)
+MODES = [{}, {'stream': True}, {'incremental': True}]
+
+# Function to compress the files of the model volume, returns their paths
+def compress_files(files, suffix):
+    compressed = {}
+    for kind, file_path in files.items():
+        compressed[kind] = file_path + suffix
+        with open(compressed[kind], 'wb') as file:
+            file.write(compress(read(file_path), compressed[kind]))
+    return compressed
+
+def apparatus_files(files):
+    return {'variants_file': files['variants'], 'rejected_file': files['rejected'], 'notes_file': files['notes']}
+
+@pytest.mark.parametrize('suffix', SUFFIXES)
+def test_compressed_text_gives_the_same_tei(model_files, tmp_path, suffix):
+    compressed = compress_files(model_files, suffix)
+    create_tei(model_files['text'], str(tmp_path / 'plain.xml'))
+    create_tei(compressed['text'], str(tmp_path / f'compressed.xml{suffix}'))
+    assert read(tmp_path / f'compressed.xml{suffix}') != read(tmp_path / 'plain.xml')
+    assert read_bytes(str(tmp_path / f'compressed.xml{suffix}')) == read(tmp_path / 'plain.xml')
+
+@pytest.mark.parametrize('suffix', SUFFIXES)
+@pytest.mark.parametrize('mode', MODES, ids=['tree', 'stream', 'incremental'])
+def test_compressed_build_gives_the_same_tei(model_files, tmp_path, suffix, mode):
+    compressed = compress_files(model_files, suffix)
+    build_edition(model_files['text'], str(tmp_path / 'plain.xml'), **apparatus_files(model_files))
+    output_file = str(tmp_path / f'compressed.xml{suffix}')
+    build_edition(compressed['text'], output_file, **apparatus_files(compressed), **mode)
+    assert read_bytes(output_file) == read(tmp_path / 'plain.xml')
+    if mode:
+        # Built a second time, from its own compressed output
+        build_edition(compressed['text'], output_file, **apparatus_files(compressed), **mode)
+        assert read_bytes(output_file) == read(tmp_path / 'plain.xml')
+
+# The apparatus is added in place, the notes in streaming mode
+@pytest.mark.parametrize('suffix', SUFFIXES)
+def test_compressed_tei_takes_the_apparatus(model_files, tmp_path, suffix):
+    for tei_file in (str(tmp_path / 'plain.xml'), str(tmp_path / f'compressed.xml{suffix}')):
+        create_tei(model_files['text'], tei_file)
+        add_variants(tei_file, read_variants_from_file(model_files['variants']), tei_file)
+        add_rejected(tei_file, read_rejected_from_file(model_files['rejected']), tei_file)
+        add_notes(tei_file, read_notes_from_file(model_files['notes']), tei_file, stream=True)
+    assert read_bytes(str(tmp_path / f'compressed.xml{suffix}')) == read(tmp_path / 'plain.xml')
+
+def test_compression_is_deterministic(model_files, tmp_path):
+    (tmp_path / 'first').mkdir()
+    (tmp_path / 'second').mkdir()
+    for suffix in SUFFIXES:
+        create_tei(model_files['text'], str(tmp_path / 'first' / f'edition.xml{suffix}'))
+        create_tei(model_files['text'], str(tmp_path / 'second' / f'edition.xml{suffix}'))
+        assert read(tmp_path / 'first' / f'edition.xml{suffix}') == read(tmp_path / 'second' / f'edition.xml{suffix}')
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from Ed2TEI.pipeline import build_edition
+
+from .conftest import read, write_files
+
+# Function to edit one of the files of the edition in place
+def edit(file_path, old, new):
+    with open(file_path, 'r', encoding='utf-8', newline='') as file:
+        content = file.read()
+    assert old in content, old
+    with open(file_path, 'w', encoding='utf-8', newline='') as file:
+        file.write(content.replace(old, new, 1))
+
+# Function to build the edition incrementally, then fully, and to check that both
+# give the same file. Returns what the incremental build returned.
+def build_both(files, directory):
+    apparatus = {'variants_file': files['variants'], 'rejected_file': files['rejected'], 'notes_file': files['notes']}
+    changed = build_edition(files['text'], str(directory / 'incremental.xml'), incremental=True, number_stanzas_paragraphs=True, **apparatus)
+    build_edition(files['text'], str(directory / 'full.xml'), number_stanzas_paragraphs=True, **apparatus)
+    assert read(directory / 'incremental.xml') == read(directory / 'full.xml')
+    return changed
+
+# Edits of the model volume and the number of lines they change
+EDITS = [
+    ('variants', 'mansiun', 'mansion', 1),
+    ('text', 'Sathanas ki', 'Sathanas qui', 1),
+    ('rejected', 'preole', 'preolle', 1),
+    ('notes', 'Phil.2,9', 'Phil. 2,9', 1),
+    # The note can no longer be placed: the notes after it are numbered anew
+    ('notes', '(cest)', '(cestxx)', 6),
+    ('variants', '20 (duné)', '21 (del)', 2),
+]
+
+@pytest.mark.parametrize('kind, old, new, lines', EDITS)
+def test_incremental_build_matches_full_build(model_files, tmp_path, kind, old, new, lines):
+    assert build_both(model_files, tmp_path) is None
+    assert build_both(model_files, tmp_path) == set()
+    edit(model_files[kind], old, new)
+    assert len(build_both(model_files, tmp_path)) == lines
+
+def test_incremental_build_renumbers_the_notes(tmp_path):
+    files = write_files(tmp_path, {
+        'text': 'alpha beta\ngamma delta\nepsilon zeta\ntheta iota\n',
+        'variants': '',
+        'rejected': '',
+        'notes': '1 (beta) First note.\n3 (zeta) Second note.\n4 (iota) Third note.\n',
+    })
+    build_both(files, tmp_path)
+    # A note on an earlier line shifts the numbers of the notes that follow it
+    edit(files['notes'], '3 (zeta)', '2 (delta) New note.\n3 (zeta)')
+    assert build_both(files, tmp_path) == {'L2', 'L3', 'L4'}
+
+@pytest.mark.parametrize('kind, old, new', [
+    ('text', 'Donavit illi', 'Donavit\n illi'),
+    ('text', '<p i-7>', '<p i-8>'),
+])
+def test_structure_changes_rebuild_the_edition(model_files, tmp_path, kind, old, new):
+    build_both(model_files, tmp_path)
+    edit(model_files[kind], old, new)
+    assert build_both(model_files, tmp_path) is None
+
+def test_modified_output_is_rebuilt(model_files, tmp_path):
+    build_both(model_files, tmp_path)
+    with open(tmp_path / 'incremental.xml', 'ab') as file:
+        file.write(b' ')
+    assert build_both(model_files, tmp_path) is None
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from Ed2TEI.instrumentation import Metrics, get_metrics, recorded_warnings, replay_warnings, reset_metrics
+from Ed2TEI.lemma_locator import locate_lemmas
+
+from .conftest import run_cli, write_files
+
+def test_report_and_merge():
+    metrics = Metrics(quiet=True)
+    metrics.count('lines', 3)
+    metrics.count('apps_added')
+    metrics.add_time('parse', 0.25)
+    with metrics.timer('convert'):
+        pass
+    report = metrics.report()
+    assert list(report) == ['elapsed', 'timers', 'counters']
+    assert report['counters'] == {'apps_added': 1, 'lines': 3}
+    assert list(report['timers']) == ['convert', 'parse'] and report['timers']['parse'] == 0.25
+
+    total = Metrics(quiet=True)
+    total.count('lines', 2)
+    total.add_time('parse', 0.5)
+    total.merge(report)
+    total.merge(json.loads(json.dumps(report)))
+    assert total.counters == {'apps_added': 2, 'lines': 8}
+    assert total.timers['parse'] == 1.0
+    assert total.summary().startswith('Summary: apps added: 2, lines: 8 (')
+
+def test_warnings_are_printed_unless_quiet(capsys):
+    Metrics().warn("Lemma 'x' not found in line L1.", 'lemmas_not_found')
+    metrics = Metrics(quiet=True)
+    metrics.warn("Lemma 'y' not found in line L2.", 'lemmas_not_found')
+    metrics.info("Done")
+    assert capsys.readouterr().out == "Lemma 'x' not found in line L1.\n"
+    assert metrics.counters == {'lemmas_not_found': 1}
+
+def test_recorded_warnings_are_replayed():
+    metrics = get_metrics()
+    with recorded_warnings() as outer:
+        metrics.warn('first', 'malformed_entries')
+        with recorded_warnings() as inner:
+            metrics.warn('second', 'missing_line_ids')
+    metrics.warn('not recorded', 'malformed_entries')
+    assert inner == [('second', 'missing_line_ids')]
+    assert outer == [('first', 'malformed_entries'), ('second', 'missing_line_ids')]
+
+    replayed = reset_metrics(quiet=True)
+    replay_warnings(outer)
+    assert replayed.counters == {'malformed_entries': 1, 'missing_line_ids': 1}
+
+# The steps done for every line are only timed when the timings are asked for
+def test_line_steps_are_timed_when_detailed(tmp_path):
+    locate_lemmas('alpha beta', ['beta'])
+    assert 'match' not in get_metrics().timers
+    metrics = reset_metrics(quiet=True, detailed=True)
+    locate_lemmas('alpha beta', ['beta'])
+    assert 'match' in metrics.timers
+
+    files = write_files(tmp_path, {'text': 'alpha beta\ngamma\n', 'variants': '1 (beta) beeta [C]\n'})
+    arguments = ['build', '--text', files['text'], '--output', tmp_path / 'edition.xml', '--variants', files['variants']]
+    assert run_cli(*arguments) == 0
+    assert 'match' not in get_metrics().timers
+    assert run_cli(*arguments, '--metrics_file', tmp_path / 'metrics.json') == 0
+    with open(tmp_path / 'metrics.json', encoding='utf-8') as file:
+        report = json.load(file)
+    assert {'convert', 'parse', 'match', 'rebuild', 'serialize'} <= set(report['timers'])
+    assert report['counters']['apps_added'] == 1
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+
+from Ed2TEI.pipeline import build_edition
+
+from .conftest import read, run_cli, write_files
+
+CLEAN_EDITION = {
+    'text': 'alpha beta\ngamma delta\nepsilon zeta\n',
+    'variants': '1 (beta) bheta [A]\n2 (gamma) gama [B]\n',
+    'rejected': '3 (zeta) zheta\n',
+    'notes': '2 (delta) A note.\n',
+}
+
+# Function to write a JSON manifest next to the files of the edition
+def write_manifest(directory, manifest):
+    manifest_file = directory / 'jobs.json'
+    with open(manifest_file, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file)
+    return manifest_file
+
+def test_run_manifest_matches_the_commands(tmp_path):
+    files = write_files(tmp_path, CLEAN_EDITION)
+    manifest_file = write_manifest(tmp_path, {
+        'defaults': {'is_verse': True, 'number_stanzas_paragraphs': True},
+        'jobs': [
+            {'name': 'edition', 'text': 'text.txt', 'variants': 'variants.txt', 'rejected': 'rejected.txt', 'output': 'edition.xml'},
+            {'command': 'add_notes', 'tei_file': 'edition.xml', 'notes_file': 'notes.txt', 'output_file': 'notes.xml'},
+            {'command': 'create_tei', 'input_file': 'text.txt', 'output_file': 'prose.xml', 'is_verse': False},
+        ],
+    })
+    assert run_cli('run', manifest_file) == 0
+
+    build_edition(files['text'], str(tmp_path / 'expected.xml'), files['variants'], files['rejected'], files['notes'], number_stanzas_paragraphs=True)
+    assert read(tmp_path / 'notes.xml') == read(tmp_path / 'expected.xml')
+    build_edition(files['text'], str(tmp_path / 'expected.xml'), is_verse=False, number_stanzas_paragraphs=True)
+    assert read(tmp_path / 'prose.xml') == read(tmp_path / 'expected.xml')
+
+@pytest.mark.parametrize('stop_on_error', [False, True])
+def test_run_reports_failed_jobs(tmp_path, stop_on_error):
+    write_files(tmp_path, CLEAN_EDITION)
+    manifest_file = write_manifest(tmp_path, {
+        'jobs': [
+            {'text': 'missing.txt', 'output': 'missing.xml'},
+            {'text': 'text.txt', 'output': 'edition.xml'},
+        ],
+    })
+    arguments = ['run', manifest_file] + (['--stop_on_error'] if stop_on_error else [])
+    assert run_cli(*arguments) == 1
+    assert (tmp_path / 'edition.xml').exists() != stop_on_error
+
+@pytest.mark.parametrize('manifest', [
+    {'jobs': [{'command': 'unknown'}]},
+    {'jobs': {}},
+    {'defaults': [], 'jobs': []},
+])
+def test_run_rejects_invalid_manifests(tmp_path, manifest):
+    status = run_cli('run', write_manifest(tmp_path, manifest))
+    assert isinstance(status, str) and status.startswith('ed2tei run:')
+
+def test_run_rejects_unknown_options(tmp_path):
+    write_files(tmp_path, CLEAN_EDITION)
+    manifest_file = write_manifest(tmp_path, {'jobs': [{'text': 'text.txt', 'output': 'edition.xml', 'colour': 'blue'}]})
+    assert run_cli('run', manifest_file) == 1
+    assert not (tmp_path / 'edition.xml').exists()
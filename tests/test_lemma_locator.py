@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+import pytest
+
+from Ed2TEI import lemma_locator
+from Ed2TEI.lemma_locator import find_occurrences, lemma_text, locate_lemmas, split_occurrence
+from Ed2TEI.pipeline import build_edition
+
+from .conftest import read, write_files
+
+@pytest.mark.parametrize('lemma, expected', [
+    ('et', ('et', None)),
+    ('et²', ('et', 2)),
+    ('et¹²', ('et', 12)),
+    ('et⁰', ('et', None)),
+    ('²', ('²', None)),
+    ('et² ne', ('et² ne', None)),
+])
+def test_split_occurrence(lemma, expected):
+    assert split_occurrence(lemma) == expected
+    assert lemma_text(lemma) == expected[0]
+
+def test_occurrence_marker_picks_the_occurrence():
+    text = 'et li reis et la reine et'
+    assert locate_lemmas(text, ['et²']) == [('et²', 11, 13)]
+    assert locate_lemmas(text, ['et³', 'la']) == [('et³', 23, 25), ('la', None, None)]
+    assert locate_lemmas(text, ['et³', 'la'], in_text_order=True) == [('la', 14, 16), ('et³', 23, 25)]
+    assert locate_lemmas(text, ['et⁴']) == [('et⁴', None, None)]
+    # Without a marker, each lemma takes its first occurrence after the previous one
+    assert locate_lemmas(text, ['reis', 'et']) == [('reis', 6, 10), ('et', 11, 13)]
+    # Occurrences inside other words are counted
+    assert locate_lemmas('en tente en', ['en²']) == [('en²', 4, 6)]
+
+def test_occurrence_marker_in_every_apparatus(tmp_path):
+    files = write_files(tmp_path, {
+        'text': 'et li reis et la reine\n',
+        'variants': '1 (et²) e [C]\n',
+        'rejected': '1 (reine) reinne\n',
+        'notes': '1 (et²) A note.\n',
+    })
+    build_edition(files['text'], str(tmp_path / 'edition.xml'), variants_file=files['variants'], rejected_file=files['rejected'], notes_file=files['notes'])
+    tei = read(tmp_path / 'edition.xml').decode('utf-8')
+    assert ('et li reis <app type="variant"><lem>et</lem><rdg wit="#C">e</rdg></app>'
+            '<note resp="#EDT" n="1">A note.</note> la ') in tei
+
+# The lemmas are found alike with str.find and with the compiled alternation
+@pytest.mark.parametrize('seed', range(20))
+def test_scan_threshold_does_not_change_the_result(monkeypatch, seed):
+    generator = random.Random(seed)
+    words = ['a', 'ab', 'aba', 'b', 'ba', 'et', 'e', 't', 'reis', 'rei', 'is']
+    text = ' '.join(generator.choice(words) for _ in range(40))
+    lemmas = generator.sample(words, 10)
+    lemmas += [lemma + generator.choice('¹²³') for lemma in generator.sample(words, 3)]
+
+    results = []
+    for threshold in (0, len(lemmas) + 1):
+        monkeypatch.setattr(lemma_locator, 'SCAN_THRESHOLD', threshold)
+        results.append((
+            find_occurrences(text, [lemma_text(lemma) for lemma in lemmas]),
+            locate_lemmas(text, lemmas),
+            locate_lemmas(text, lemmas, in_text_order=True),
+        ))
+    assert results[0] == results[1]
+    for lemma, positions in results[0][0].items():
+        assert positions == [i for i in range(len(text)) if text.startswith(lemma, i)]
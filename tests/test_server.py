@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+
+from Ed2TEI import server
+from Ed2TEI.pipeline import build_edition
+
+from .conftest import read, write_files
+
+# Time given to a response to end, the first one waiting for a worker to start
+RESPONSE_TIMEOUT = 30
+
+# Function to send a request to the server and read its response up to the end
+# of the connection; returns (status, body)
+async def send(port, method, path, body=b'', content_type='application/json'):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    head = f"{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: {content_type}\r\n"
+    if method == 'POST':
+        head += f"Content-Length: {len(body)}\r\n"
+    writer.write(head.encode('latin-1') + b'\r\n' + body)
+    await writer.drain()
+    response = await asyncio.wait_for(reader.read(), RESPONSE_TIMEOUT)
+    writer.close()
+    head, content = response.split(b'\r\n\r\n', 1)
+    return int(head.split()[1]), content
+
+# Function to start a server on a free port, send it the given requests one after
+# the other and stop it; returns the responses
+def exchange(*requests):
+    async def run():
+        conversion_server = await server.ConversionServer(port=0, workers=1).start()
+        try:
+            return [await send(conversion_server.port, *request) for request in requests]
+        finally:
+            await conversion_server.close()
+
+    return asyncio.run(run())
+
+def test_server_answers_every_request(tmp_path):
+    files = write_files(tmp_path, {'text': 'alpha beta\ngamma\n', 'notes': '1 (beta) A note.\n'})
+    build_edition(files['text'], str(tmp_path / 'expected.xml'), notes_file=files['notes'], is_verse=False)
+    payload = json.dumps({'text': 'alpha beta\ngamma\n', 'notes': '1 (beta) A note.\n'}).encode('utf-8')
+
+    responses = exchange(
+        ('POST', '/convert', payload),
+        ('POST', '/convert', b'alpha beta\ngamma\n', 'text/plain'),
+        ('GET', '/health'),
+        ('GET', '/metrics'),
+    )
+    assert responses[0] == (200, read(tmp_path / 'expected.xml'))
+    assert responses[1][0] == 200
+    assert responses[2][0] == 200 and json.loads(responses[2][1])['status'] == 'ok'
+    status, content = responses[3]
+    report = json.loads(content)
+    assert status == 200
+    assert report['requests'] == {'200': 3}
+    assert report['counters']['conversions'] == 2
+
+def test_server_rejects_invalid_requests():
+    responses = exchange(
+        ('POST', '/convert', b'{"text": 1}'),
+        ('POST', '/convert', b'{"text": "alpha", "options": {"colour": true}}'),
+        ('GET', '/convert'),
+        ('GET', '/unknown'),
+    )
+    assert [status for status, _ in responses] == [400, 400, 405, 404]
+    assert all('error' in json.loads(content) for _, content in responses)
+
+# A failed conversion gives its message to the client, and its traceback to the log
+def test_failed_conversion_hides_the_traceback(monkeypatch):
+    def fail(*args, **kwargs):
+        raise ValueError("Cannot convert")
+
+    monkeypatch.setattr(server, 'build_edition', fail)
+    tei, error, log, report = server.convert_edition('alpha\n', {}, dict(server.TEI_OPTIONS))
+    assert tei is None
+    assert error == "Cannot convert"
+    assert 'Traceback' in log and 'ValueError' in log
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import os
+import xml.etree.ElementTree as ET
+from xml.etree import ElementInclude
+
+import pytest
+
+from Ed2TEI import add_notes, add_rejected, add_variants, create_tei
+from Ed2TEI import xml_backend
+from Ed2TEI.add_notes import read_notes_from_file
+from Ed2TEI.add_rejected import read_rejected_from_file
+from Ed2TEI.add_variants import read_variants_from_file
+from Ed2TEI.pipeline import build_edition
+from Ed2TEI.shards import is_sharded, read_index, read_line
+from Ed2TEI.tei_document import TEI_NS
+
+BACKENDS = xml_backend.available_backends()
+SHARDINGS = [('page', 1), ('page', 3), ('div', 1)]
+
+# Function to get the lines and page breaks of a TEI file, after resolving the
+# XIncludes of a sharded edition relative to its master
+def lines_and_pages(tei_file):
+    directory = os.path.dirname(tei_file)
+
+    def loader(href, parse, encoding=None):
+        return ElementInclude.default_loader(os.path.join(directory, href), parse, encoding)
+
+    root = ET.parse(tei_file).getroot()
+    ElementInclude.include(root, loader)
+    tags = (f'{{{TEI_NS}}}l', f'{{{TEI_NS}}}pb')
+    return [
+        (element.tag, element.attrib, ET.tostring(element, encoding='unicode').rsplit('>', 1)[0])
+        for element in root.iter() if element.tag in tags
+    ]
+
+def apparatus_files(files):
+    return {'variants_file': files['variants'], 'rejected_file': files['rejected'], 'notes_file': files['notes']}
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('shard_by, pages_per_shard', SHARDINGS)
+def test_sharded_build_matches_single_file(model_files, tmp_path, backend, shard_by, pages_per_shard):
+    xml_backend.set_backend(backend)
+    build_edition(model_files['text'], str(tmp_path / 'single.xml'), **apparatus_files(model_files))
+    master = str(tmp_path / 'sharded.xml')
+    build_edition(model_files['text'], master, shard_by=shard_by, pages_per_shard=pages_per_shard, **apparatus_files(model_files))
+    assert is_sharded(master)
+    assert lines_and_pages(master) == lines_and_pages(str(tmp_path / 'single.xml'))
+
+def test_index_locates_every_line(model_files, tmp_path):
+    master = str(tmp_path / 'sharded.xml')
+    build_edition(model_files['text'], master, shard_by='page', **apparatus_files(model_files))
+    index = read_index(master)
+    line_ids = [attributes['{http://www.w3.org/XML/1998/namespace}id'] for tag, attributes, _ in lines_and_pages(master) if tag.endswith('}l')]
+    assert sorted(index['lines']) == sorted(line_ids)
+    for line_id in line_ids:
+        line = read_line(master, line_id, index)
+        assert line.startswith('<l') and f'xml:id="{line_id}"' in line and line.endswith(('</l>', '/>'))
+    assert read_line(master, 'L0', index) is None
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_injecting_into_shards_matches_single_file(model_files, tmp_path, backend):
+    xml_backend.set_backend(backend)
+    variants = read_variants_from_file(model_files['variants'])
+    rejected = read_rejected_from_file(model_files['rejected'])
+    notes = read_notes_from_file(model_files['notes'])
+    for name, sharding in (('single', {}), ('sharded', {'shard_by': 'page'})):
+        create_tei(model_files['text'], str(tmp_path / f'{name}.xml'), **sharding)
+        add_variants(str(tmp_path / f'{name}.xml'), variants, str(tmp_path / f'{name}_variants.xml'))
+        add_rejected(str(tmp_path / f'{name}_variants.xml'), rejected, str(tmp_path / f'{name}_rejected.xml'))
+        add_notes(str(tmp_path / f'{name}_rejected.xml'), notes, str(tmp_path / f'{name}_notes.xml'))
+    assert lines_and_pages(str(tmp_path / 'sharded.xml')) == lines_and_pages(str(tmp_path / 'single.xml'))
+    assert lines_and_pages(str(tmp_path / 'sharded_notes.xml')) == lines_and_pages(str(tmp_path / 'single_notes.xml'))
+    index = read_index(str(tmp_path / 'sharded_notes.xml'))
+    for line_id in index['lines']:
+        line = read_line(str(tmp_path / 'sharded_notes.xml'), line_id, index)
+        assert line.startswith('<l') and line.endswith(('</l>', '/>'))
+
+def test_sharded_build_cannot_be_streamed(model_files, tmp_path):
+    with pytest.raises(ValueError):
+        build_edition(model_files['text'], str(tmp_path / 'sharded.xml'), shard_by='page', stream=True)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from Ed2TEI import add_notes, add_rejected, add_variants, create_tei
+from Ed2TEI.add_notes import read_notes_from_file
+from Ed2TEI.add_rejected import read_rejected_from_file
+from Ed2TEI.add_variants import read_variants_from_file
+from Ed2TEI.pipeline import build_edition
+from Ed2TEI.watch import EditionWatcher
+
+from .conftest import read, write_files
+
+READERS = {
+    'variants': (add_variants, read_variants_from_file),
+    'rejected': (add_rejected, read_rejected_from_file),
+    'notes': (add_notes, read_notes_from_file),
+}
+
+@pytest.mark.parametrize('kind', list(READERS))
+def test_streamed_layer_matches_the_tree(model_files, tmp_path, kind):
+    add_layer, read_file = READERS[kind]
+    create_tei(model_files['text'], str(tmp_path / 'text.xml'))
+    add_layer(str(tmp_path / 'text.xml'), read_file(model_files[kind]), str(tmp_path / 'tree.xml'))
+    add_layer(str(tmp_path / 'text.xml'), read_file(model_files[kind]), str(tmp_path / 'stream.xml'), stream=True)
+    assert read(tmp_path / 'stream.xml') == read(tmp_path / 'tree.xml')
+
+def test_streamed_build_matches_the_tree(model_files, tmp_path):
+    apparatus = (model_files['variants'], model_files['rejected'], model_files['notes'])
+    build_edition(model_files['text'], str(tmp_path / 'tree.xml'), *apparatus)
+    build_edition(model_files['text'], str(tmp_path / 'stream.xml'), *apparatus, stream=True)
+    assert read(tmp_path / 'stream.xml') == read(tmp_path / 'tree.xml')
+
+# Function to add the notes of a small edition in every mode, returns the outputs
+def add_notes_every_way(files, directory):
+    outputs = {}
+    for mode in ('tree', 'stream', 'incremental'):
+        outputs[mode] = str(directory / f'{mode}.xml')
+        build_edition(files['text'], outputs[mode], notes_file=files['notes'], stream=mode == 'stream', incremental=mode == 'incremental')
+    create_tei(files['text'], str(directory / 'text.xml'))
+    for stream in (False, True):
+        outputs[f'add_notes_{stream}'] = str(directory / f'add_notes_{stream}.xml')
+        add_notes(str(directory / 'text.xml'), read_notes_from_file(files['notes']), outputs[f'add_notes_{stream}'], stream=stream)
+    outputs['watch'] = str(directory / 'watch.xml')
+    EditionWatcher(files['text'], outputs['watch'], notes_file=files['notes']).build()
+    return {mode: read(output_file) for mode, output_file in outputs.items()}
+
+# Notes are numbered in the order of the notes file, also when it does not follow
+# the order of the lines
+def test_notes_keep_the_order_of_the_notes_file(tmp_path):
+    files = write_files(tmp_path, {
+        'text': 'alpha beta\ngamma delta\nepsilon zeta\n',
+        'notes': '3 (zeta) First note.\n1 (beta) Second note.\n',
+    })
+    outputs = add_notes_every_way(files, tmp_path)
+    assert b'beta<note resp="#EDT" n="2">Second note.</note>' in outputs['tree']
+    assert b'zeta<note resp="#EDT" n="1">First note.</note>' in outputs['tree']
+    for output in outputs.values():
+        assert output == outputs['tree']
+
+# Only the notes that are placed are numbered: a note whose location is not in its
+# line, or whose line is not in the text, leaves no gap in the numbers
+@pytest.mark.parametrize('notes', [
+    '1 (zzz) A.\n2 (gamma) B.\n',
+    '9 (alpha) C.\n1 (zzz) A.\n2 (gamma) B.\n',
+    '3 (zeta) D.\n1 (zzz) A.\n2 (gamma) B.\n',
+])
+def test_notes_that_are_not_placed_are_not_numbered(tmp_path, notes):
+    files = write_files(tmp_path, {'text': 'alpha beta\ngamma delta\nepsilon zeta\n', 'notes': notes})
+    outputs = add_notes_every_way(files, tmp_path)
+    expected = b'n="2">B.</note>' if '(zeta)' in notes else b'n="1">B.</note>'
+    assert expected in outputs['tree']
+    assert b'>A.</note>' not in outputs['tree']
+    for output in outputs.values():
+        assert output == outputs['tree']
+
+def test_streaming_reports_lines_out_of_order(tmp_path):
+    files = write_files(tmp_path, {'text': 'alpha\nbeta\n', 'notes': '1 (alpha) A note.\n'})
+    create_tei(files['text'], str(tmp_path / 'text.xml'))
+    content = read(tmp_path / 'text.xml').replace(b'xml:id="L1"', b'xml:id="L3"')
+    (tmp_path / 'shuffled.xml').write_bytes(content)
+    with pytest.raises(ValueError):
+        add_notes(str(tmp_path / 'shuffled.xml'), read_notes_from_file(files['notes']), str(tmp_path / 'out.xml'), stream=True)
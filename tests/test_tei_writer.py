@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from Ed2TEI import create_tei
+from Ed2TEI import xml_backend
+from Ed2TEI.cli import main
+from Ed2TEI.instrumentation import get_metrics
+from Ed2TEI.pipeline import build_edition
+from Ed2TEI.tei_document import NS
+from Ed2TEI.tei_writer import line_markup
+
+from .conftest import read, write_files
+
+@pytest.mark.parametrize('backend', xml_backend.available_backends())
+def test_create_tei_matches_the_tree_build(model_files, tmp_path, backend):
+    xml_backend.set_backend(backend)
+    create_tei(model_files['text'], str(tmp_path / 'text.xml'))
+    build_edition(model_files['text'], str(tmp_path / 'tree.xml'))
+    build_edition(model_files['text'], str(tmp_path / 'stream.xml'), stream=True)
+    assert read(tmp_path / 'tree.xml') == read(tmp_path / 'text.xml')
+    assert read(tmp_path / 'stream.xml') == read(tmp_path / 'text.xml')
+
+@pytest.mark.parametrize('line_content, expected', [
+    ('delta & epsilon', 'delta &amp; epsilon'),
+    ('a < b', 'a &lt; b'),
+    ('fish &amp; chips', 'fish &amp; chips'),
+    ('&eacute;t&eacute;', '&amp;eacute;t&amp;eacute;'),
+    ('<hi>x</hi> & y', '<hi>x</hi> &amp; y'),
+    ('<hi>open & shut', '&lt;hi&gt;open &amp; shut'),
+])
+def test_line_markup_escapes_what_is_not_markup(line_content, expected):
+    assert line_markup('L1', line_content) == expected
+
+def test_line_markup_keeps_markup(tmp_path):
+    assert line_markup('L1', 'a <hi rend="italic">b</hi> &lt; c') == 'a <hi rend="italic">b</hi> &lt; c'
+    assert 'invalid_text' not in get_metrics().counters
+
+# A plain-text line never makes the TEI ill-formed, whatever the command
+@pytest.mark.parametrize('backend', xml_backend.available_backends())
+def test_unescaped_characters_give_well_formed_tei(tmp_path, backend):
+    files = write_files(tmp_path, {
+        'text': 'alpha beta\ndelta & epsilon\nzeta < theta\n',
+        'variants': '2 (epsilon) epsilone [A]\n',
+        'notes': '3 (theta) A note.\n',
+    })
+    outputs = [str(tmp_path / name) for name in ('create.xml', 'tree.xml', 'stream.xml', 'cli.xml')]
+    xml_backend.set_backend(backend)
+    create_tei(files['text'], outputs[0])
+    build_edition(files['text'], outputs[1], files['variants'], notes_file=files['notes'])
+    build_edition(files['text'], outputs[2], files['variants'], notes_file=files['notes'], stream=True)
+    main(['build', '--text', files['text'], '--output', outputs[3], '--variants', files['variants'], '--notes', files['notes'], '--is_verse', '--quiet', '--xml_backend', backend])
+
+    for output_file in outputs:
+        root = ET.parse(output_file).getroot()
+        assert ''.join(root.find('.//tei:l[@xml:id="L2"]', NS).itertext()) in ('delta & epsilon', 'delta & epsilonepsilone')
+        assert ''.join(root.find('.//tei:l[@xml:id="L3"]', NS).itertext()).startswith('zeta < theta')
+    assert read(outputs[2]) == read(outputs[1])
+    assert read(outputs[3]) == read(outputs[1])
+    assert b'<app type="variant"><lem>epsilon</lem>' in read(outputs[1])
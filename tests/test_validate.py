@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from .conftest import run_cli, write_files
+
+CLEAN_EDITION = {
+    'text': 'alpha beta\ngamma delta\nepsilon zeta\n',
+    'variants': '1 (beta) bheta [A]\n2 (gamma) gama [B]\n',
+    'rejected': '3 (zeta) zheta\n',
+    'notes': '2 (delta) A note.\n',
+}
+
+def validate(files, *options):
+    return run_cli('validate', '--text', files['text'], '--variants', files['variants'],
+                   '--rejected', files['rejected'], '--notes', files['notes'], *options)
+
+def test_validate_passes_a_clean_edition(tmp_path):
+    files = write_files(tmp_path, CLEAN_EDITION)
+    assert validate(files) == 0
+    assert validate(files, '--strict') == 0
+
+def test_validate_fails_on_errors(tmp_path):
+    files = write_files(tmp_path, dict(CLEAN_EDITION, variants='1 (omega) bheta [A]\n'))
+    assert validate(files, '--report_file', tmp_path / 'report.json') == 1
+    with open(tmp_path / 'report.json', 'r', encoding='utf-8') as file:
+        report = json.load(file)
+    assert [issue['code'] for issue in report['issues']] == ['lemmas_not_found']
+
+def test_validate_fails_on_warnings_when_strict(tmp_path):
+    files = write_files(tmp_path, dict(CLEAN_EDITION, text='alpha beta\ngamma & delta\nepsilon zeta\n'))
+    assert validate(files) == 0
+    assert validate(files, '--strict') == 1
+
+def test_validate_volume(model_files):
+    volume = model_files['text'][:-len('_text.txt')]
+    assert run_cli('validate', '--volume', volume, '--strict') == 0
+    assert run_cli('validate', '--volume', volume + '_missing').startswith('ed2tei validate:')
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+from Ed2TEI.instrumentation import get_metrics
+from Ed2TEI.pipeline import build_edition
+from Ed2TEI.watch import EditionWatcher
+
+from .conftest import read
+
+TEI_OPTIONS = {'number_stanzas_paragraphs': True}
+
+# Function to edit one of the files of the edition in place, as saved by an
+# editor; old and new are text, or bytes
+def edit(file_path, old, new):
+    old, new = (part.encode('utf-8') if isinstance(part, str) else part for part in (old, new))
+    content = read(file_path)
+    assert old in content, old
+    state = os.stat(file_path)
+    with open(file_path, 'wb') as file:
+        file.write(content.replace(old, new, 1))
+    # The modification time moves on even on a file system with a coarse clock
+    os.utime(file_path, ns=(state.st_atime_ns, state.st_mtime_ns + 10 ** 9))
+
+def apparatus_files(files):
+    return {'variants_file': files['variants'], 'rejected_file': files['rejected'], 'notes_file': files['notes']}
+
+def full_build(files, directory):
+    build_edition(files['text'], str(directory / 'full.xml'), **apparatus_files(files), **TEI_OPTIONS)
+    return read(directory / 'full.xml')
+
+# Edits of the model volume and the number of lines they change
+EDITS = [
+    ('variants', 'mansiun', 'mansion', 1),
+    ('text', 'Sathanas ki', 'Sathanas qui', 1),
+    ('rejected', 'preole', 'preolle', 1),
+    ('notes', 'Phil.2,9', 'Phil. 2,9', 1),
+    # The note can no longer be placed: the notes after it are numbered anew
+    ('notes', '(cest)', '(cestxx)', 6),
+    ('variants', '20 (duné)', '21 (del)', 2),
+]
+
+@pytest.mark.parametrize('kind, old, new, lines', EDITS)
+def test_update_matches_full_build(model_files, tmp_path, kind, old, new, lines):
+    output_file = str(tmp_path / 'watched.xml')
+    watcher = EditionWatcher(model_files['text'], output_file, **apparatus_files(model_files), **TEI_OPTIONS)
+    watcher.build()
+    assert read(output_file) == full_build(model_files, tmp_path)
+    assert watcher.poll() == []
+
+    edit(model_files[kind], old, new)
+    assert watcher.poll() == [kind]
+    assert len(watcher.update(watcher.poll())) == lines
+    assert read(output_file) == full_build(model_files, tmp_path)
+    assert watcher.poll() == []
+
+def test_structure_change_rebuilds_the_edition(model_files, tmp_path):
+    output_file = str(tmp_path / 'watched.xml')
+    watcher = EditionWatcher(model_files['text'], output_file, **apparatus_files(model_files), **TEI_OPTIONS)
+    watcher.build()
+    edit(model_files['text'], 'Donavit illi', 'Donavit\n illi')
+    edit(model_files['notes'], 'Phil.2,9', 'Phil. 2,9')
+    assert watcher.update(watcher.poll()) is None
+    assert read(output_file) == full_build(model_files, tmp_path)
+    # The edition rebuilt is updated line by line again
+    edit(model_files['variants'], 'mansiun', 'mansion')
+    assert len(watcher.update(watcher.poll())) == 1
+    assert read(output_file) == full_build(model_files, tmp_path)
+
+# A file that cannot be read is reported, and the output kept until it is saved again
+def test_failed_update_keeps_the_output(model_files, tmp_path):
+    output_file = str(tmp_path / 'watched.xml')
+    watcher = EditionWatcher(model_files['text'], output_file, **apparatus_files(model_files), **TEI_OPTIONS)
+    saved = []
+
+    # The variants file is saved with an encoding error right after the first build
+    def build():
+        EditionWatcher.build(watcher)
+        saved.append(read(output_file))
+        edit(model_files['variants'], 'mansiun', b'\xff')
+
+    watcher.build = build
+    watcher.watch(interval=0, max_updates=1)
+    assert get_metrics().counters['update_errors'] == 1
+    assert read(output_file) == saved[0]
+
+    edit(model_files['variants'], b'\xff', 'mansion')
+    assert watcher.update(watcher.poll()) == {'L6'}
+    assert read(output_file) == full_build(model_files, tmp_path)
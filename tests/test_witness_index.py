@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from Ed2TEI import cli, witness_index
+from Ed2TEI.pipeline import build_edition
+from Ed2TEI.tei_document import TEI_NS
+from Ed2TEI.witness_index import WitnessDatabase, WitnessIndex
+
+from .conftest import run_cli
+
+PAGED_TEI = f'''<TEI xmlns="{TEI_NS}"><text><body>
+<pb ed="base" n="1"/>
+<l xml:id="L1">a <app type="variant"><lem>a</lem><rdg wit="#C">b</rdg></app> <pb ed="base" n="2"/> c</l>
+<l xml:id="L2">d</l>
+<l xml:id="L3"><app type="variant"><lem>e</lem><rdg wit="#C #P">f</rdg><rdg wit="#D">g</rdg></app></l>
+</body></text></TEI>
+'''
+
+# Function to build the model volume with its witness database
+def build_indexed(files, directory, **options):
+    tei_file = str(directory / 'edition.xml')
+    db_file = str(directory / 'witnesses.db')
+    build_edition(files['text'], tei_file, variants_file=files['variants'], rejected_file=files['rejected'],
+                  notes_file=files['notes'], witness_db=db_file, **options)
+    return tei_file, db_file
+
+# Function to run every query on an index or a database
+def all_queries(index, witnesses, lemmas, line_ids):
+    return {
+        'witnesses': index.witnesses(),
+        'readings': {witness: index.readings_of(witness) for witness in witnesses},
+        'lines': {lemma: index.lines_of(lemma) for lemma in lemmas},
+        'apps': {line_id: index.apps_of(line_id) for line_id in line_ids},
+        'agreements': {pair: index.agreements(pair) for pair in itertools.combinations(witnesses, 2)},
+    }
+
+def test_database_answers_like_the_index(model_files, tmp_path):
+    tei_file, db_file = build_indexed(model_files, tmp_path)
+    index = WitnessIndex.from_file(tei_file)
+    with WitnessDatabase(db_file) as database:
+        assert database.witnesses() == [('C', 3), ('D', 1), ('P', 3)]
+        assert database.readings_of('P') == [('L6', 'meisun', 'mansiun'), ('L16', 'jurnee', 'journee'), ('L20', 'duné', 'D ad d.')]
+        assert database.readings_of('X') == []
+        assert database.agreements(['C', 'P']) == [('L6', 'meisun', 'mansiun')]
+        assert database.agreements([]) == []
+        assert database.lines_of('Deu') == ['L26']
+        assert database.apps_of('L26') == [('Deu', [('om', ['C']), ('D. devine', ['D'])])]
+        assert database.apps_of('L1') == []
+        queries = ['C', 'D', 'P', 'X'], ['meisun', 'sulpherin', 'jurnee', 'duné', 'Deu', 'et'], ['L6', 'L16', 'L20', 'L26', 'L1']
+        assert all_queries(database, *queries) == all_queries(index, *queries)
+
+def test_index_of_tree_file_and_shards_agree(model_files, tmp_path):
+    tei_file, _ = build_indexed(model_files, tmp_path)
+    (tmp_path / 'sharded').mkdir()
+    sharded_file, _ = build_indexed(model_files, tmp_path / 'sharded', shard_by='page')
+    from_file = WitnessIndex.from_file(tei_file)
+    from_tree = WitnessIndex.from_tree(ET.parse(tei_file))
+    from_shards = WitnessIndex.from_file(sharded_file)
+    for index in (from_tree, from_shards):
+        assert index.lines == from_file.lines
+        assert index.apps == from_file.apps
+
+# A page break inside a line counts from the next line on
+def test_pages_of_the_lines(tmp_path):
+    (tmp_path / 'paged.xml').write_text(PAGED_TEI, encoding='utf-8')
+    from_file = WitnessIndex.from_file(str(tmp_path / 'paged.xml'))
+    from_tree = WitnessIndex.from_tree(ET.parse(str(tmp_path / 'paged.xml')))
+    assert from_file.lines == from_tree.lines == {'L1': (None, '1'), 'L3': (None, '2')}
+    assert from_file.agreements(['C', 'P']) == [('L3', 'e', 'f')]
+
+# The elements of the file are dropped as it is read
+def test_indexed_file_is_not_kept_in_memory(model_files, tmp_path, monkeypatch):
+    tei_file, _ = build_indexed(model_files, tmp_path)
+    roots = []
+    iterparse = ET.iterparse
+
+    def recording_iterparse(source, events):
+        for event, element in iterparse(source, events):
+            if not roots:
+                roots.append(element)
+            yield event, element
+
+    monkeypatch.setattr(witness_index.ET, 'iterparse', recording_iterparse)
+    index = WitnessIndex.from_file(tei_file)
+    assert len(index.apps) == 5
+    assert list(roots[0].iter()) == roots
+
+def test_index_and_query_commands(model_files, tmp_path, capsys):
+    tei_file, _ = build_indexed(model_files, tmp_path)
+    db_file = str(tmp_path / 'command.db')
+    assert run_cli('index_witnesses', tei_file, db_file) == 0
+    capsys.readouterr()
+
+    cli.main(['query_witnesses', db_file, '--agree', 'C', 'P'])
+    assert capsys.readouterr().out == 'L6\tmeisun\tmansiun\n'
+    cli.main(['query_witnesses', db_file, '--line', 'L26'])
+    assert capsys.readouterr().out == 'Deu\tom\tC\nDeu\tD. devine\tD\n'
+    cli.main(['query_witnesses', db_file, '--lemma', 'jurnee'])
+    assert capsys.readouterr().out == 'L16\n'
+    cli.main(['query_witnesses', db_file, '--list_witnesses'])
+    assert capsys.readouterr().out == 'C\t3\nD\t1\nP\t3\n'
+    with pytest.raises(SystemExit) as exit:
+        cli.main(['query_witnesses', str(tmp_path / 'missing.db'), '--witness', 'C'])
+    assert 'Witness database not found' in str(exit.value.code)